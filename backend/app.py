@@ -1,14 +1,37 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from python_debugger import debug_python
+from python_debugger import debug_python, stream_debug_python, analyze_complexity, TRACER_ENGINES, MONITORING_AVAILABLE
+from code_cache import compile_program
+from batch import BatchSpec, run_case, case_summary
+from session_store import SessionStore
+from watch import WatchList
+from serializer import ValueSerializer
+from empirical import EmpiricalSpec
+from memory import MemoryTracker
+from call_tree import CallDag
+from replay import ReplaySession, ReplayError, CheckpointPolicy, REPLAY_AVAILABLE
+from result_cache import ResultCache, cache_key, is_cacheable, is_reproducible, without_volatile_fields
+from transport import PayloadEncoder, JSON_TYPE, MSGPACK_TYPES, media_types, content_codings, new_compressor
+from worker_pool import WorkerPool, PoolSaturated, JobTimeout, WorkerJobError
+from metrics import MetricsRegistry
 import os
+import json
 import logging
+import marshal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import traceback
 
 app = Flask(__name__)
 CORS(app)
 
+# Request bodies larger than this are rejected with 413
+MAX_REQUEST_MB = float(os.getenv('MAX_REQUEST_MB', 2))
+app.config['MAX_CONTENT_LENGTH'] = int(MAX_REQUEST_MB * 1024 * 1024)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -19,6 +42,235 @@ logging.basicConfig(
     ]
 )
 
+# Server-side trace sessions for paged retrieval
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', 600))
+SESSION_MAX_COUNT = int(os.getenv('SESSION_MAX_COUNT', 50))
+SESSION_PAGE_SIZE = int(os.getenv('SESSION_PAGE_SIZE', 200))
+SESSION_MAX_PAGE_SIZE = int(os.getenv('SESSION_MAX_PAGE_SIZE', 2000))
+
+sessions = SessionStore(max_sessions=SESSION_MAX_COUNT, ttl_seconds=SESSION_TTL_SECONDS)
+
+# Record/replay sessions (Linux): a light recording with fork checkpoints, replayed to any step on request.
+# Each one holds a recorder process and up to its maxCheckpoints forked copies of the program.
+REPLAY_MAX_SESSIONS = int(os.getenv('REPLAY_MAX_SESSIONS', 4))
+REPLAY_TTL_SECONDS = int(os.getenv('REPLAY_TTL_SECONDS', 300))
+REPLAY_MAX_EVENTS = int(os.getenv('REPLAY_MAX_EVENTS', 2000000))
+REPLAY_STEP_SECONDS = float(os.getenv('REPLAY_STEP_SECONDS', 10))
+# Recordings run in their own processes next to the worker pool; beyond this many at once they get a 429
+REPLAY_MAX_RECORDINGS = max(1, int(os.getenv('REPLAY_MAX_RECORDINGS', 2)))
+
+replays = SessionStore(max_sessions=REPLAY_MAX_SESSIONS, ttl_seconds=REPLAY_TTL_SECONDS)
+
+# Worker processes that run user code (WORKER_POOL_SIZE=0 runs it inside the API process)
+WORKER_POOL_SIZE = int(os.getenv('WORKER_POOL_SIZE', os.cpu_count() or 1))
+WORKER_MAX_JOBS = int(os.getenv('WORKER_MAX_JOBS', 100))
+WORKER_MAX_MEMORY_MB = int(os.getenv('WORKER_MAX_MEMORY_MB', 512))
+WORKER_JOB_TIMEOUT = float(os.getenv('WORKER_JOB_TIMEOUT', 30))
+WORKER_QUEUE_SIZE = int(os.getenv('WORKER_QUEUE_SIZE', WORKER_POOL_SIZE * 2))
+WORKER_HASH_SEED = int(os.getenv('WORKER_HASH_SEED', 0))  # Fixed so set ordering is the same in every worker
+
+pool = WorkerPool(
+    size=WORKER_POOL_SIZE,
+    max_jobs_per_worker=WORKER_MAX_JOBS,
+    max_memory_mb=WORKER_MAX_MEMORY_MB,
+    job_timeout=WORKER_JOB_TIMEOUT,
+    max_queue=WORKER_QUEUE_SIZE,
+    hash_seed=WORKER_HASH_SEED
+) if WORKER_POOL_SIZE > 0 else None
+
+# Set once the server is shutting down; /api/health then reports not ready
+draining = threading.Event()
+
+def begin_drain():
+    """Stop reporting ready so load balancers send no new requests"""
+    draining.set()
+
+def drain(timeout):
+    """Wait up to `timeout` seconds for in-flight traces, then stop the worker pool"""
+    draining.set()
+    replays.clear()
+    if pool is not None:
+        if pool.drain(timeout):
+            logging.info("Worker pool drained")
+        else:
+            logging.warning(f"Worker pool stopped with jobs still running after {timeout:g}s")
+
+# Trace budgets: server-wide caps, and the defaults used when a request sets no limits
+TRACE_LIMIT_CAPS = {
+    'max_events': int(os.getenv('TRACE_MAX_EVENTS', 200000)),
+    'max_depth': int(os.getenv('TRACE_MAX_DEPTH', 500)),
+    'max_seconds': float(os.getenv('TRACE_MAX_SECONDS', 10)),
+    'max_bytes': int(os.getenv('TRACE_MAX_BYTES', 256 * 1024 * 1024)),
+}
+TRACE_LIMIT_DEFAULTS = {
+    'max_events': int(os.getenv('TRACE_DEFAULT_EVENTS', 50000)),
+    'max_depth': int(os.getenv('TRACE_DEFAULT_DEPTH', TRACE_LIMIT_CAPS['max_depth'])),
+    'max_seconds': float(os.getenv('TRACE_DEFAULT_SECONDS', 5)),
+    'max_bytes': int(os.getenv('TRACE_DEFAULT_BYTES', 64 * 1024 * 1024)),
+}
+# Raw traces longer than this many steps are moved to a memory-mapped temp file (0 never spills)
+TRACE_SPILL_STEPS = int(os.getenv('TRACE_SPILL_STEPS', 1000000))
+# Request field for each limit
+TRACE_LIMIT_FIELDS = {
+    'maxEvents': 'max_events',
+    'maxDepth': 'max_depth',
+    'maxSeconds': 'max_seconds',
+    'maxBytes': 'max_bytes',
+}
+
+# Tracer engine used when a request does not pick one: auto, settrace or monitoring
+TRACER_ENGINE = os.getenv('TRACER_ENGINE', 'auto')
+
+# Cache of finished /api/debug responses (RESULT_CACHE_MAX_MB=0 keeps nothing in memory)
+RESULT_CACHE_MAX_MB = int(os.getenv('RESULT_CACHE_MAX_MB', 64))
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR')  # Optional on-disk tier that survives restarts
+RESULT_CACHE_DISK_MAX_MB = int(os.getenv('RESULT_CACHE_DISK_MAX_MB', 512))
+
+result_cache = ResultCache(
+    max_bytes=RESULT_CACHE_MAX_MB * 1024 * 1024,
+    disk_dir=RESULT_CACHE_DIR,
+    disk_max_bytes=RESULT_CACHE_DISK_MAX_MB * 1024 * 1024
+)
+
+# Batch runs: one program against many stdin cases
+BATCH_MAX_CASES = int(os.getenv('BATCH_MAX_CASES', 200))
+BATCH_MAX_TRACES = int(os.getenv('BATCH_MAX_TRACES', 5))  # Cases per batch that also get a full trace
+BATCH_MAX_STEPS = int(os.getenv('BATCH_MAX_STEPS', 10000000))
+
+# Prometheus metrics served at /api/metrics
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram(
+    'debugger_stage_seconds', 'Time spent in each debug pipeline stage', ('stage',))
+request_seconds = metrics.histogram(
+    'debugger_request_seconds', 'Debug request latency by endpoint and cache result', ('endpoint', 'cache'))
+states_total = metrics.counter(
+    'debugger_states_total', 'States recorded by the tracer (raw) and sent after filtering (kept)', ('kind',))
+response_bytes_total = metrics.counter(
+    'debugger_response_bytes_total', 'Encoded debug response body bytes', ('endpoint',))
+errors_total = metrics.counter(
+    'debugger_errors_total', 'Failed debug requests by error type', ('type',))
+traces_in_flight = metrics.gauge(
+    'debugger_traces_in_flight', 'Debug requests and streams currently tracing a program')
+metrics.gauge('debugger_sessions', 'Trace sessions held in memory', lambda: len(sessions))
+metrics.gauge('debugger_replay_sessions', 'Record/replay sessions with live checkpoint processes', lambda: len(replays))
+replay_recordings = metrics.gauge(
+    'debugger_replay_recordings', 'Replay recordings currently running')
+recording_slots = threading.BoundedSemaphore(REPLAY_MAX_RECORDINGS)
+metrics.gauge('debugger_jobs_waiting', 'Requests waiting for a free worker', lambda: pool.waiting if pool else 0)
+metrics.gauge('debugger_result_cache_bytes', 'Bytes held by the in-memory result cache', lambda: result_cache.stats()['bytes'])
+
+def record_result_metrics(result):
+    """Count the states and observe the stage timings of a debug result (or stream summary)"""
+    counts = result.get('stateCounts') or {}
+    for kind in ('raw', 'kept'):
+        states_total.inc(counts.get(kind, 0), kind=kind)
+    for stage, ms in (result.get('timings') or {}).items():
+        stage_seconds.observe(ms / 1000, stage=stage)
+
+def count_error(e):
+    errors_total.inc(type=e.error_type if isinstance(e, WorkerJobError) else type(e).__name__)
+
+def server_timing(timings):
+    """Server-Timing header value for stage timings in milliseconds"""
+    return ', '.join(f"{stage};dur={ms:g}" for stage, ms in timings.items())
+
+def trace_limits(data, caps=TRACE_LIMIT_CAPS, defaults=TRACE_LIMIT_DEFAULTS):
+    """
+    Per-request trace limits from the optional `limits` object, clamped to the server caps.
+    Raises ValueError when `limits` is not an object.
+    """
+    requested = data.get('limits')
+    if requested is None:
+        requested = {}
+    elif not isinstance(requested, dict):
+        raise ValueError("limits must be an object")
+    limits = {}
+    for field, name in TRACE_LIMIT_FIELDS.items():
+        value = requested.get(field)
+        cap = caps[name]
+        try:
+            value = type(cap)(value) if value is not None else defaults[name]
+        except (TypeError, ValueError):
+            value = defaults[name]
+        limits[name] = max(0, min(value, cap))
+    return limits
+
+def debug_job_args(data):
+    """Keyword arguments for debug_python / stream_debug_python from a request body"""
+    return {
+        'code': data.get('code', ''),
+        'input_data': data.get('input', ''),
+        'limits': dict(trace_limits(data), spill_steps=TRACE_SPILL_STEPS),
+        'engine': data.get('engine') or TRACER_ENGINE,
+        'watch': data.get('watch'),
+        'values': data.get('values'),
+        'empirical': data.get('empirical'),
+        'profile': data.get('profile', False),
+        'memory': data.get('memory'),
+        'call_dag': data.get('callDag')
+    }
+
+# Response bodies at least this large are gzip/brotli compressed when the client accepts it
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+
+payload_encoder = PayloadEncoder(COMPRESS_MIN_BYTES, default=app.json.default)
+
+def result_cache_key(job_args):
+    """Cache key for a debug job, or None when its program reads time, randomness or the environment"""
+    if not result_cache.enabled or not is_cacheable(job_args['code']):
+        return None
+    if job_args['profile'] or job_args['memory']:
+        return None  # Measurements differ on every run
+    if pool is None and sys.flags.hash_randomization:
+        return None  # Set ordering in this process changes with every restart
+    options = {name: job_args.get(name) for name in ('limits', 'engine', 'watch', 'values', 'compact', 'empirical', 'call_dag')}
+    return cache_key(job_args['code'], job_args['input_data'], options)
+
+def negotiated_encoding():
+    """(media type, preferred content coding or None) from the Accept and Accept-Encoding headers"""
+    media_type = request.accept_mimetypes.best_match(media_types(), default=JSON_TYPE)
+    coding = request.accept_encodings.best_match(content_codings())
+    return media_type, coding
+
+def representation_key(key, media_type, coding):
+    """Cache key and ETag of one encoding of a result"""
+    return f"{key}-{'msgpack' if media_type in MSGPACK_TYPES else 'json'}-{coding or 'identity'}"
+
+def body_response(body, media_type, coding, status=200):
+    response = Response(body, status=status, mimetype=media_type)
+    if coding != 'identity':
+        response.headers['Content-Encoding'] = coding
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
+
+def encoded_response(payload, status=200):
+    """Response with the payload encoded as negotiated with the client (JSON or MessagePack, maybe compressed)"""
+    media_type, coding = negotiated_encoding()
+    body, used = payload_encoder.encode(payload, media_type, coding)
+    return body_response(body, media_type, used, status)
+
+def run_debug(**kwargs):
+    """Run debug_python in the worker pool, or in-process when the pool is disabled"""
+    traces_in_flight.inc()
+    try:
+        if pool is None:
+            return debug_python(**kwargs)
+        return pool.run('debug', **kwargs)
+    finally:
+        traces_in_flight.dec()
+
+def run_batch_case(**kwargs):
+    """Run batch.run_case in the worker pool, or in-process when the pool is disabled"""
+    if pool is None:
+        return run_case(**kwargs)
+    return pool.run('case', **kwargs)
+
+def start_debug_stream(**kwargs):
+    """Start stream_debug_python in the worker pool, or in-process when the pool is disabled"""
+    if pool is None:
+        return stream_debug_python(**kwargs)
+    return pool.stream('stream', **kwargs)
+
 @app.route('/', methods=['GET'])
 def index():
     return jsonify({
@@ -28,80 +280,745 @@ def index():
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
+    """
+    Readiness: 503 while shutting down or when the worker queue is full.
+    Full replay recording slots only show in `replays`, the other endpoints still have workers.
+    """
+    queue = pool.stats() if pool is not None else None
+    if draining.is_set():
+        status = 'draining'
+    elif pool is not None and pool.saturated():
+        status = 'busy'
+    else:
+        status = 'healthy'
     return jsonify({
-        'status': 'healthy',
+        'status': status,
+        'ready': status == 'healthy',
+        'queue': queue,
+        'replays': {
+            'recording': replay_recordings.value,
+            'maxRecordings': REPLAY_MAX_RECORDINGS,
+            'saturated': replay_recordings.value >= REPLAY_MAX_RECORDINGS,
+            'sessions': len(replays)
+        },
         'timestamp': datetime.now().isoformat()
-    })
+    }), 200 if status == 'healthy' else 503
 
-@app.route('/api/debug', methods=['POST'])
-def debug_code():
-    start_time = datetime.now()
-    request_id = os.urandom(4).hex()
-    
+def parse_debug_request(request_id):
+    """Validate a debug request body, returning (data, None) or (None, error_response)"""
     data = request.get_json()
     if not data:
-        return jsonify({
+        return None, (jsonify({
             'success': False,
             'error': 'No JSON data received',
             'request_id': request_id
-        }), 400
+        }), 400)
 
     code = data.get('code', '')
-    input_data = data.get('input', '')
     language = data.get('language', 'python').lower()
 
     logging.info(f"[{request_id}] Debug request - Language: {language}")
 
     if not code.strip():
-        return jsonify({
+        return None, (jsonify({
             'success': False,
             'error': 'No code provided',
             'request_id': request_id
-        }), 400
+        }), 400)
+
+    if language == 'javascript':
+        return None, (jsonify({
+            'success': False,
+            'error': 'JavaScript debugging not implemented',
+            'request_id': request_id
+        }), 501)
+
+    if language != 'python':
+        return None, (jsonify({
+            'success': False,
+            'error': f'Unsupported language: {language}',
+            'supported_languages': ['python'],
+            'request_id': request_id
+        }), 400)
+
+    engine = data.get('engine') or TRACER_ENGINE
+    if engine not in TRACER_ENGINES or (engine == 'monitoring' and not MONITORING_AVAILABLE):
+        return None, (jsonify({
+            'success': False,
+            'error': f'Unsupported tracer engine: {engine}',
+            'supported_engines': [e for e in TRACER_ENGINES if e != 'monitoring' or MONITORING_AVAILABLE],
+            'request_id': request_id
+        }), 400)
+
+    for flag in ('compact', 'profile'):
+        if not isinstance(data.get(flag, False), bool):
+            return None, (jsonify({
+                'success': False,
+                'error': f'{flag} must be true or false',
+                'request_id': request_id
+            }), 400)
 
     try:
-        if language == 'python':
-            logging.info(f"[{request_id}] Starting Python debug session")
-            debug_states = debug_python(code, input_data)
-            logging.info(f"[{request_id}] Debug completed - {len(debug_states)} states")
-            
-            # Simplified response with just the debug states
-            return jsonify({
-                'success': True,
-                'debugStates': debug_states
-            })
-            
-        elif language == 'javascript':
-            return jsonify({
+        trace_limits(data)
+        WatchList.from_spec(data.get('watch'))
+        ValueSerializer.from_options(data.get('values'))
+        EmpiricalSpec.from_spec(data.get('empirical'))
+        MemoryTracker.from_options(data.get('memory'))
+        CallDag.from_options(data.get('callDag'))
+    except ValueError as e:
+        return None, (jsonify({
+            'success': False,
+            'error': str(e),
+            'request_id': request_id
+        }), 400)
+
+    return data, None
+
+def debug_error_response(request_id, e):
+    count_error(e)
+    if isinstance(e, PoolSaturated):
+        logging.warning(f"[{request_id}] Rejected: {str(e)}")
+        response = jsonify({
+            'success': False,
+            'error': 'Server is busy, please retry shortly',
+            'request_id': request_id
+        })
+        response.headers['Retry-After'] = '1'
+        return response, 429
+
+    if isinstance(e, JobTimeout):
+        logging.warning(f"[{request_id}] Timed out: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f"Debugging timed out after {pool.job_timeout:g}s",
+            'request_id': request_id
+        }), 504
+
+    remote_traceback = e.remote_traceback if isinstance(e, WorkerJobError) else ''
+    logging.error(f"[{request_id}] Error: {str(e)}\n{remote_traceback}{traceback.format_exc()}")
+    return jsonify({
+        'success': False,
+        'error': f"Debugging failed: {str(e)}",
+        'traceback': traceback.format_exc() if app.debug else None
+    }), 500
+
+@app.route('/api/debug', methods=['POST'])
+def debug_code():
+    start_time = time.perf_counter()
+    request_id = os.urandom(4).hex()
+
+    data, error_response = parse_debug_request(request_id)
+    if error_response:
+        errors_total.inc(type='BadRequest')
+        return error_response
+
+    stream_format = requested_stream_format(data)
+    if stream_format:
+        return stream_debug_response(request_id, data, stream_format)
+
+    job_args = debug_job_args(data)
+    if data.get('compact'):
+        # Call stacks sent once in a stackTable, states refer to them by stackId
+        job_args['compact'] = True
+    key = result_cache_key(job_args)
+    media_type, coding = negotiated_encoding()
+    # Small results are stored uncompressed, so look for both encodings
+    candidates = []
+    if key:
+        candidates = [representation_key(key, media_type, c) for c in dict.fromkeys((coding, None))]
+
+    # Keys cover everything that determines the result, so a matching ETag is still valid
+    for candidate in candidates:
+        if request.if_none_match.contains(candidate):
+            logging.info(f"[{request_id}] Not modified")
+            request_seconds.observe(time.perf_counter() - start_time, endpoint='debug', cache='not_modified')
+            return request_id_response(etag_response(Response(status=304), candidate), request_id)
+
+    cached_key, body = result_cache.lookup(candidates) if key else (None, None)
+    if body is not None:
+        logging.info(f"[{request_id}] Served from result cache")
+        used = 'identity' if cached_key.endswith('-identity') else coding
+        if used == 'identity' and coding and len(body) >= COMPRESS_MIN_BYTES:
+            # Stored for a client that didn't accept compression
+            compressor = new_compressor(coding)
+            body = compressor.compress(body) + compressor.flush()
+            used = coding
+            cached_key = representation_key(key, media_type, coding)
+            result_cache.put(cached_key, body)
+        response_bytes_total.inc(len(body), endpoint='debug')
+        request_seconds.observe(time.perf_counter() - start_time, endpoint='debug', cache='hit')
+        response = body_response(body, media_type, used)
+        # The cached body has no timings of its own (see without_volatile_fields), only this lookup took time
+        response.headers['Server-Timing'] = server_timing({'cache': round((time.perf_counter() - start_time) * 1000, 3)})
+        return request_id_response(etag_response(response, cached_key, 'HIT'), request_id)
+
+    try:
+        logging.info(f"[{request_id}] Starting Python debug session")
+        debug_states = run_debug(**job_args)
+        logging.info(f"[{request_id}] Debug completed - {debug_states['stateCounts']['kept']} states")
+        record_result_metrics(debug_states)
+        truncated = debug_states.get('truncated') or {}
+        # Timed-out traces depend on machine load, and memory addresses change, so they are not reused either
+        cacheable = key is not None and truncated.get('reason') != 'max_seconds' and is_reproducible(debug_states)
+        
+        # Simplified response with just the debug states
+        payload = {
+            'success': True,
+            'debugStates': debug_states,
+            'request_id': request_id
+        }
+        if cacheable:
+            # Later hits get this same body, so it holds nothing measured for this request only
+            payload = {'success': True, 'debugStates': without_volatile_fields(debug_states)}
+        encode_started = time.perf_counter()
+        body, used = payload_encoder.encode(payload, media_type, coding)
+        serialize_seconds = time.perf_counter() - encode_started
+        stage_seconds.observe(serialize_seconds, stage='serialize')
+
+    except Exception as e:
+        return debug_error_response(request_id, e)
+
+    response = request_id_response(body_response(body, media_type, used), request_id)
+    timings = dict(debug_states['timings'], serialize=round(serialize_seconds * 1000, 3))
+    response.headers['Server-Timing'] = server_timing(timings)
+    response_bytes_total.inc(len(body), endpoint='debug')
+    if not cacheable:
+        result_cache.skip()
+        request_seconds.observe(time.perf_counter() - start_time, endpoint='debug', cache='none')
+        return response
+
+    stored_key = representation_key(key, media_type, used)
+    result_cache.put(stored_key, body)
+    request_seconds.observe(time.perf_counter() - start_time, endpoint='debug', cache='miss')
+    return etag_response(response, stored_key, 'MISS')
+
+def request_id_response(response, request_id):
+    # Cached bodies have no request_id (see without_volatile_fields), the header always has the current one
+    response.headers['X-Request-ID'] = request_id
+    return response
+
+def etag_response(response, key, cache_status=None):
+    response.set_etag(key)
+    if cache_status:
+        response.headers['X-Cache'] = cache_status
+    return response
+
+@app.route('/api/batch', methods=['POST'])
+def batch_debug():
+    """
+    Run one program against a list of stdin cases. The program is parsed and
+    compiled once here and its marshalled code object is fanned out across
+    the worker pool; each case only counts steps, and full traces are kept
+    for cases that ask for one (or fail, with traceFailing).
+    """
+    start_time = time.perf_counter()
+    request_id = os.urandom(4).hex()
+
+    data, error_response = parse_debug_request(request_id)
+    if not error_response:
+        try:
+            spec = BatchSpec.from_request(data, BATCH_MAX_CASES)
+        except ValueError as e:
+            error_response = jsonify({
                 'success': False,
-                'error': 'JavaScript debugging not implemented',
+                'error': str(e),
                 'request_id': request_id
-            }), 501
-            
+            }), 400
+    if error_response:
+        errors_total.inc(type='BadRequest')
+        return error_response
+
+    code = data['code']
+    try:
+        program = compile_program(code)
+    except (SyntaxError, ValueError) as e:
+        errors_total.inc(type=type(e).__name__)
+        return jsonify({
+            'success': False,
+            'error': f"SyntaxError: {e.msg} (line {e.lineno})" if isinstance(e, SyntaxError) else str(e),
+            'request_id': request_id
+        }), 400
+    complexity = analyze_complexity(code, program.tree)
+    compiled_time = time.perf_counter()
+
+    logging.info(f"[{request_id}] Batch of {len(spec.cases)} cases")
+    case_args = {
+        'marshalled': marshal.dumps(program.code),
+        'source': code,
+        'filename': program.filename,
+        'max_steps': BATCH_MAX_STEPS,
+        'max_seconds': trace_limits(data)['max_seconds']
+    }
+
+    def run(case):
+        try:
+            return case_summary(case, run_batch_case(input_data=case.input_data, **case_args), spec.compare)
+        except Exception as e:
+            count_error(e)
+            return {'index': case.index, 'status': 'error', 'error': batch_error_message(e)}
+
+    def trace(case):
+        try:
+            return run_debug(**dict(debug_job_args(data), input_data=case.input_data))
+        except Exception as e:
+            count_error(e)
+            return {'error': batch_error_message(e)}
+
+    # One thread per pool worker; in-process runs share sys.stdout, so one at a time
+    with ThreadPoolExecutor(max_workers=min(len(spec.cases), pool.size if pool else 1)) as executor:
+        results = list(executor.map(run, spec.cases))
+        cases_time = time.perf_counter()
+
+        wanted = [
+            case for case, result in zip(spec.cases, results)
+            if case.trace or (spec.trace_failing and result['status'] in ('failed', 'error'))
+        ]
+        for case, traced in zip(wanted, executor.map(trace, wanted[:BATCH_MAX_TRACES])):
+            results[case.index]['trace'] = traced
+        for case in wanted[BATCH_MAX_TRACES:]:
+            results[case.index]['traceSkipped'] = True
+
+    summary = {'cases': len(results)}
+    for status in ('passed', 'failed', 'error', 'ran'):
+        summary[status] = sum(1 for result in results if result['status'] == status)
+    finished = time.perf_counter()
+    logging.info(f"[{request_id}] Batch completed - {summary['passed']} passed, {summary['failed']} failed, {summary['error']} errors")
+    request_seconds.observe(finished - start_time, endpoint='batch', cache='none')
+
+    return request_id_response(encoded_response({
+        'success': True,
+        'summary': summary,
+        'cases': results,
+        'complexity': complexity,
+        'timings': {
+            'compile': round((compiled_time - start_time) * 1000, 3),
+            'cases': round((cases_time - compiled_time) * 1000, 3),
+            'traces': round((finished - cases_time) * 1000, 3)
+        },
+        'request_id': request_id
+    }), request_id)
+
+def batch_error_message(e):
+    """Error text for a case whose job could not run"""
+    if isinstance(e, PoolSaturated):
+        return 'Server is busy, please retry shortly'
+    if isinstance(e, JobTimeout):
+        return f"Timed out after {pool.job_timeout:g}s"
+    return f"Debugging failed: {str(e)}"
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_text():
+    """Counters and latency histograms in the Prometheus text format"""
+    return Response(metrics.render(), mimetype=None, content_type=MetricsRegistry.CONTENT_TYPE)
+
+@app.route('/api/cache', methods=['GET'])
+def cache_stats():
+    """Result cache hit/miss counters"""
+    return jsonify({
+        'success': True,
+        'cache': result_cache.stats()
+    })
+
+def requested_stream_format(data):
+    """'ndjson' or 'sse' when the client asked for a streamed response, else None"""
+    stream = data.get('stream')
+    if stream in ('ndjson', 'sse'):
+        return stream
+    if stream is True:
+        return 'ndjson'
+
+    accept = request.headers.get('Accept', '')
+    if 'text/event-stream' in accept:
+        return 'sse'
+    if 'application/x-ndjson' in accept:
+        return 'ndjson'
+    return None
+
+def stream_debug_response(request_id, data, stream_format):
+    """Stream simplified states while the program runs, ending with a summary frame"""
+    _, coding = negotiated_encoding()
+    compressor = new_compressor(coding) if coding else None
+
+    def encode(frame):
+        if stream_format == 'sse':
+            text = f"event: {frame['type']}\ndata: {json.dumps(frame)}\n\n"
         else:
-            return jsonify({
+            text = json.dumps(frame) + '\n'
+        if compressor is None:
+            return text
+        # Flushed per frame so the client can decode each one as it arrives
+        return compressor.compress(text.encode('utf-8')) + compressor.sync()
+
+    logging.info(f"[{request_id}] Starting streamed Python debug session")
+    start_time = time.perf_counter()
+    try:
+        frames = start_debug_stream(**debug_job_args(data))
+    except Exception as e:
+        return debug_error_response(request_id, e)
+
+    def generate():
+        sent = 0
+        traces_in_flight.inc()
+        try:
+            for frame in frames:
+                if frame['type'] == 'summary':
+                    frame['request_id'] = request_id
+                    record_result_metrics(frame)
+                    logging.info(f"[{request_id}] Debug stream completed - {frame['totalStates']} states")
+                chunk = encode(frame)
+                sent += len(chunk)
+                yield chunk
+            request_seconds.observe(time.perf_counter() - start_time, endpoint='stream', cache='none')
+        except Exception as e:
+            count_error(e)
+            # Headers are already sent, so report the failure as a final frame
+            logging.error(f"[{request_id}] Error: {str(e)}\n{traceback.format_exc()}")
+            yield encode({
+                'type': 'error',
+                'error': f"Debugging failed: {str(e)}",
+                'request_id': request_id
+            })
+        finally:
+            # Stops the traced program if the client disconnected early
+            frames.close()
+            traces_in_flight.dec()
+            response_bytes_total.inc(sent, endpoint='stream')
+        if compressor is not None:
+            yield compressor.flush()
+
+    mimetype = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let proxies hold back chunks
+    response.headers['X-Request-ID'] = request_id
+    if compressor is not None:
+        response.headers['Content-Encoding'] = coding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def page_bounds(default_size):
+    """Read `from`/`to` query arguments, capping the page size"""
+    start = request.args.get('from', 0, type=int)
+    end = request.args.get('to', start + default_size, type=int)
+    return start, min(end, start + SESSION_MAX_PAGE_SIZE)
+
+def session_not_found(session_id):
+    return jsonify({
+        'success': False,
+        'error': f'Unknown or expired session: {session_id}'
+    }), 404
+
+@app.route('/api/sessions', methods=['POST'])
+def create_session():
+    """Trace the program and keep the result server-side, returning only the first page"""
+    request_id = os.urandom(4).hex()
+
+    data, error_response = parse_debug_request(request_id)
+    if error_response:
+        errors_total.inc(type='BadRequest')
+        return error_response
+
+    try:
+        page_size = min(int(data.get('pageSize', SESSION_PAGE_SIZE)), SESSION_MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        return jsonify({
+            'success': False,
+            'error': 'pageSize must be an integer',
+            'request_id': request_id
+        }), 400
+
+    try:
+        logging.info(f"[{request_id}] Starting Python debug session")
+        start_time = time.perf_counter()
+        result = run_debug(**debug_job_args(data))
+        record_result_metrics(result)
+        session = sessions.create(result)
+        start, end, states = session.states_range(0, page_size)
+        logging.info(f"[{request_id}] Session {session.session_id} created - {len(session.states)} states")
+        request_seconds.observe(time.perf_counter() - start_time, endpoint='session', cache='none')
+
+        return encoded_response({
+            'success': True,
+            'sessionId': session.session_id,
+            'summary': session.summary(),
+            'from': start,
+            'to': end,
+            'debugStates': states,
+            'timings': result['timings'],
+            'request_id': request_id
+        })
+
+    except Exception as e:
+        return debug_error_response(request_id, e)
+
+@app.route('/api/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    session = sessions.get(session_id)
+    if session is None:
+        return session_not_found(session_id)
+
+    return jsonify({
+        'success': True,
+        'sessionId': session_id,
+        'summary': session.summary()
+    })
+
+@app.route('/api/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    if not sessions.delete(session_id):
+        return session_not_found(session_id)
+    return jsonify({'success': True, 'sessionId': session_id})
+
+@app.route('/api/sessions/<session_id>/states', methods=['GET'])
+def get_session_states(session_id):
+    """Return the simplified states in [from, to)"""
+    session = sessions.get(session_id)
+    if session is None:
+        return session_not_found(session_id)
+
+    start, end, states = session.states_range(*page_bounds(SESSION_PAGE_SIZE))
+    return encoded_response({
+        'success': True,
+        'sessionId': session_id,
+        'from': start,
+        'to': end,
+        'total': len(session.states),
+        'debugStates': states
+    })
+
+@app.route('/api/sessions/<session_id>/states/<int:step>', methods=['GET'])
+def get_session_state(session_id, step):
+    session = sessions.get(session_id)
+    if session is None:
+        return session_not_found(session_id)
+
+    if step >= len(session.states):
+        return jsonify({
+            'success': False,
+            'error': f'Step {step} out of range',
+            'total': len(session.states)
+        }), 404
+
+    return jsonify({
+        'success': True,
+        'sessionId': session_id,
+        'step': step,
+        'state': session.states[step]
+    })
+
+@app.route('/api/sessions/<session_id>/calls/<path:call_id>', methods=['GET'])
+def get_session_calls(session_id, call_id):
+    """Return a call-tree subtree, optionally limited to `depth` levels below the call"""
+    session = sessions.get(session_id)
+    if session is None:
+        return session_not_found(session_id)
+
+    calls = session.call_subtree(call_id, request.args.get('depth', type=int))
+    if calls is None:
+        return jsonify({
+            'success': False,
+            'error': f'Unknown call: {call_id}'
+        }), 404
+
+    return jsonify({
+        'success': True,
+        'sessionId': session_id,
+        'callId': call_id,
+        'calls': calls
+    })
+
+def replay_not_found(replay_id):
+    return jsonify({
+        'success': False,
+        'error': f'Unknown or expired replay: {replay_id}'
+    }), 404
+
+@app.route('/api/replays', methods=['POST'])
+def create_replay():
+    """
+    Record the program with fork checkpoints instead of tracing every
+    variable, returning the first page of its timeline (line, event, depth
+    and function per step). Full states come from /api/replays/<id>/steps/<k>.
+    """
+    start_time = time.perf_counter()
+    request_id = os.urandom(4).hex()
+
+    if not REPLAY_AVAILABLE:
+        return jsonify({
+            'success': False,
+            'error': 'Record/replay needs fork() and is only available on Linux',
+            'request_id': request_id
+        }), 501
+
+    data, error_response = parse_debug_request(request_id)
+    if not error_response:
+        try:
+            CheckpointPolicy.from_options(data.get('checkpoints'))
+            error = None
+        except ValueError as e:
+            error = str(e)
+        try:
+            page_size = min(int(data.get('pageSize', SESSION_PAGE_SIZE)), SESSION_MAX_PAGE_SIZE)
+        except (TypeError, ValueError):
+            error = error or 'pageSize must be an integer'
+        if error:
+            error_response = jsonify({
                 'success': False,
-                'error': f'Unsupported language: {language}',
-                'supported_languages': ['python'],
+                'error': error,
                 'request_id': request_id
             }), 400
+    if error_response:
+        errors_total.inc(type='BadRequest')
+        return error_response
 
-    except Exception as e:
-        logging.error(f"[{request_id}] Error: {str(e)}\n{traceback.format_exc()}")
+    code = data['code']
+    try:
+        compile_program(code)
+    except (SyntaxError, ValueError) as e:
+        errors_total.inc(type=type(e).__name__)
+        return jsonify({
+            'success': False,
+            'error': f"SyntaxError: {e.msg} (line {e.lineno})" if isinstance(e, SyntaxError) else str(e),
+            'request_id': request_id
+        }), 400
+
+    # Recording keeps a few bytes per step, so it allows far more steps than a full trace
+    limits = trace_limits(
+        data,
+        dict(TRACE_LIMIT_CAPS, max_events=REPLAY_MAX_EVENTS),
+        dict(TRACE_LIMIT_DEFAULTS, max_events=REPLAY_MAX_EVENTS)
+    )
+    # Recordings share the CPUs with the worker pool, so they back off when either is full
+    if draining.is_set() or (pool is not None and pool.saturated()) or not recording_slots.acquire(blocking=False):
+        return debug_error_response(request_id, PoolSaturated("No free slot for a replay recording"))
+    replay_recordings.inc()
+    traces_in_flight.inc()
+    try:
+        if pool is not None:
+            # Recorders share the pool's fork server, so it has to start with the workers' hash seed
+            pool.start()
+        logging.info(f"[{request_id}] Starting replay recording")
+        session = ReplaySession.record(
+            request_id + os.urandom(12).hex(), code, data.get('input', ''), limits,
+            data.get('checkpoints'), data.get('values'), timeout=limits['max_seconds'] + 5
+        )
+    except ReplayError as e:
+        count_error(e)
+        logging.warning(f"[{request_id}] Recording failed: {str(e)}")
         return jsonify({
             'success': False,
-            'error': f"Debugging failed: {str(e)}",
-            'traceback': traceback.format_exc() if app.debug else None
+            'error': str(e),
+            'request_id': request_id
         }), 500
+    finally:
+        traces_in_flight.dec()
+        replay_recordings.dec()
+        recording_slots.release()
+    replays.add(session)
+    start, end, timeline = session.timeline_range(0, page_size)
+    logging.info(f"[{request_id}] Replay {session.session_id} recorded - {session.summary['totalSteps']} steps")
+    request_seconds.observe(time.perf_counter() - start_time, endpoint='replay', cache='none')
+
+    return encoded_response({
+        'success': True,
+        'replayId': session.session_id,
+        'summary': session.summary,
+        'from': start,
+        'to': end,
+        'timeline': timeline,
+        'request_id': request_id
+    })
+
+@app.route('/api/replays/<replay_id>', methods=['GET'])
+def get_replay(replay_id):
+    session = replays.get(replay_id)
+    if session is None:
+        return replay_not_found(replay_id)
+
+    try:
+        checkpoints = session.checkpoints()
+    except ReplayError as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify({
+        'success': True,
+        'replayId': replay_id,
+        'summary': session.summary,
+        'checkpoints': checkpoints
+    })
+
+@app.route('/api/replays/<replay_id>', methods=['DELETE'])
+def delete_replay(replay_id):
+    if not replays.delete(replay_id):
+        return replay_not_found(replay_id)
+    return jsonify({'success': True, 'replayId': replay_id})
+
+@app.route('/api/replays/<replay_id>/timeline', methods=['GET'])
+def get_replay_timeline(replay_id):
+    """Return the recorded timeline for steps [from, to)"""
+    session = replays.get(replay_id)
+    if session is None:
+        return replay_not_found(replay_id)
+
+    start, end, timeline = session.timeline_range(*page_bounds(SESSION_PAGE_SIZE))
+    return encoded_response({
+        'success': True,
+        'replayId': replay_id,
+        'from': start,
+        'to': end,
+        'total': session.summary['totalSteps'],
+        'timeline': timeline
+    })
+
+@app.route('/api/replays/<replay_id>/steps/<int:step>', methods=['GET'])
+def get_replay_step(replay_id, step):
+    """Full state at a step, re-executed from the nearest earlier checkpoint"""
+    start_time = time.perf_counter()
+    session = replays.get(replay_id)
+    if session is None:
+        return replay_not_found(replay_id)
+
+    if step >= session.summary['totalSteps']:
+        return jsonify({
+            'success': False,
+            'error': f'Step {step} out of range',
+            'total': session.summary['totalSteps']
+        }), 404
+
+    traces_in_flight.inc()
+    try:
+        state = session.state(step, REPLAY_STEP_SECONDS)
+    except ReplayError as e:
+        count_error(e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        traces_in_flight.dec()
+    stage_seconds.observe(state['replay']['seconds'], stage='replay')
+    request_seconds.observe(time.perf_counter() - start_time, endpoint='replay_step', cache='none')
+    return encoded_response({
+        'success': True,
+        'replayId': replay_id,
+        'step': step,
+        'state': state
+    })
 
 @app.after_request
 def add_header(response):
     """Add response headers for better cache control"""
+    if response.headers.get('ETag'):
+        # Cached debug results may be kept by the client but must be revalidated
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
     return response
 
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({
+        'success': False,
+        'error': f'Request body larger than {MAX_REQUEST_MB:g} MB'
+    }), 413
+
 @app.route('/api/languages', methods=['GET'])
 def get_languages():
     """Get supported languages"""
@@ -120,5 +1037,9 @@ if __name__ == '__main__':
     port = int(os.getenv('FLASK_PORT', 5000))
     debug = os.getenv('FLASK_DEBUG', 'false').lower() == 'true'
     
+    # Development server only; serve production traffic with gunicorn -c gunicorn.conf.py
     logging.info(f"Starting API on {host}:{port}")
-    app.run(host=host, port=port, debug=True)
\ No newline at end of file
+    try:
+        app.run(host=host, port=port, debug=debug, threaded=True)
+    finally:
+        drain(WORKER_JOB_TIMEOUT)
\ No newline at end of file
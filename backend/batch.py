@@ -0,0 +1,181 @@
+import io
+import linecache
+import marshal
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from contextlib import redirect_stdout, redirect_stderr
+
+from empirical import CountingTracer, StepLimitReached
+from budgets import TraceInterrupted
+from python_debugger import is_user_code
+
+DEFAULT_MAX_CASES = 200
+DEFAULT_MAX_STEPS = 10000000  # Line events per case
+DEFAULT_MAX_SECONDS = 5.0
+COMPARE_MODES = ('trim', 'exact')
+OUTPUT_PREVIEW_CHARS = 10000  # Output kept per case in the response
+LOADED_CACHE_SIZE = 64
+
+_loaded = OrderedDict()  # Program filename (which embeds its source hash) -> code object, per process
+
+
+class BatchCase:
+    """One stdin test case: the input, optional expected output, and whether to keep a full trace"""
+    __slots__ = ('index', 'input_data', 'expected', 'trace')
+
+    def __init__(self, index, input_data, expected=None, trace=False):
+        self.index = index
+        self.input_data = input_data
+        self.expected = expected
+        self.trace = trace
+
+
+class BatchSpec:
+    """
+    The test cases of a batch request plus how to judge them, e.g.
+    {"cases": [{"input": "3\\n", "expected": "6\\n"}, {"input": "0\\n", "trace": true}],
+     "compare": "trim", "traceFailing": true}.
+    """
+
+    def __init__(self, cases, compare='trim', trace_failing=False):
+        self.cases = cases
+        self.compare = compare
+        self.trace_failing = trace_failing
+
+    @classmethod
+    def from_request(cls, data, max_cases=DEFAULT_MAX_CASES):
+        """Build a spec from a batch request body. Raises ValueError for malformed entries"""
+        cases = data.get('cases')
+        if not isinstance(cases, list) or not cases:
+            raise ValueError("cases must be a non-empty list")
+        if len(cases) > max_cases:
+            raise ValueError(f"At most {max_cases} cases per batch")
+
+        parsed = []
+        for index, case in enumerate(cases):
+            if isinstance(case, str):
+                case = {'input': case}
+            if not isinstance(case, dict):
+                raise ValueError(f"cases[{index}] must be an object or an input string")
+            input_data = case.get('input', '')
+            expected = case.get('expected')
+            if not isinstance(input_data, str):
+                raise ValueError(f"cases[{index}].input must be a string")
+            if expected is not None and not isinstance(expected, str):
+                raise ValueError(f"cases[{index}].expected must be a string")
+            if not isinstance(case.get('trace', False), bool):
+                raise ValueError(f"cases[{index}].trace must be true or false")
+            parsed.append(BatchCase(index, input_data, expected, case.get('trace', False)))
+
+        compare = data.get('compare', 'trim')
+        if compare not in COMPARE_MODES:
+            raise ValueError(f"compare must be one of {', '.join(COMPARE_MODES)}")
+        if not isinstance(data.get('traceFailing', False), bool):
+            raise ValueError("traceFailing must be true or false")
+        return cls(parsed, compare, data.get('traceFailing', False))
+
+
+def normalize_output(text, compare):
+    """Output as compared: 'trim' ignores trailing whitespace on lines and trailing blank lines"""
+    if compare == 'exact':
+        return text
+    lines = [line.rstrip() for line in text.replace('\r\n', '\n').split('\n')]
+    while lines and not lines[-1]:
+        lines.pop()
+    return '\n'.join(lines)
+
+
+def judge(result, expected, compare):
+    """Status of a finished case: error, passed, failed, or ran when nothing is expected"""
+    if result['error'] is not None:
+        return 'error'
+    if expected is None:
+        return 'ran'
+    return 'passed' if normalize_output(result['output'], compare) == normalize_output(expected, compare) else 'failed'
+
+
+def load_code(marshalled, source, filename):
+    """Code object for a marshalled program, unmarshalled once per process"""
+    code = _loaded.get(filename)
+    if code is None:
+        code = _loaded[filename] = marshal.loads(marshalled)
+        if len(_loaded) > LOADED_CACHE_SIZE:
+            _loaded.popitem(last=False)
+    else:
+        _loaded.move_to_end(filename)
+    # Tracebacks of the program show its lines without a file on disk
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    return code
+
+
+def user_traceback(exc, filename):
+    """Formatted exception with only the program's own frames"""
+    frames = [frame for frame in traceback.extract_tb(exc.__traceback__) if frame.filename == filename]
+    lines = ['Traceback (most recent call last):\n'] + traceback.format_list(frames) if frames else []
+    return ''.join(lines + traceback.format_exception_only(type(exc), exc))
+
+
+def run_case(marshalled, source, filename, input_data, max_steps=DEFAULT_MAX_STEPS, max_seconds=DEFAULT_MAX_SECONDS):
+    """
+    Run a marshalled code object (see CompiledProgram) once against
+    `input_data`, counting line events of its own code instead of recording
+    states. Returns {'output', 'errorOutput', 'error', 'steps', 'maxDepth',
+    'seconds', 'stopped'}.
+    """
+    code = load_code(marshalled, source, filename)
+    tracer = CountingTracer(is_user_code, max_steps, time.monotonic() + max_seconds)
+    output = io.StringIO()
+    error_output = io.StringIO()
+    result = {'error': None, 'stopped': None}
+    previous_trace = sys.gettrace()
+
+    started = time.perf_counter()
+    try:
+        with redirect_stdout(output), redirect_stderr(error_output):
+            sys.stdin = io.StringIO(input_data or '')
+            sys.settrace(tracer.trace_calls)
+            try:
+                exec(code, {'__file__': filename})  # Same globals as run_traced
+            finally:
+                sys.settrace(previous_trace)
+    except StepLimitReached:
+        result['stopped'] = 'max_steps' if tracer.steps > max_steps else 'max_seconds'
+        result['error'] = f"Stopped after {tracer.steps} steps ({result['stopped']})"
+    except TraceInterrupted:
+        raise
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            result['error'] = f"SystemExit: {e.code}"
+    except BaseException as e:
+        result['error'] = user_traceback(e, filename)
+    finally:
+        sys.stdin = sys.__stdin__
+    result['seconds'] = round(time.perf_counter() - started, 6)
+
+    result['output'] = output.getvalue()
+    result['errorOutput'] = error_output.getvalue()
+    result['steps'] = tracer.steps
+    result['maxDepth'] = tracer.max_depth
+    return result
+
+
+def case_summary(case, result, compare):
+    """The response entry for a case, with its output capped"""
+    status = judge(result, case.expected, compare)
+    entry = {
+        'index': case.index,
+        'status': status,
+        'output': result['output'][:OUTPUT_PREVIEW_CHARS],
+        'errorOutput': result['errorOutput'][:OUTPUT_PREVIEW_CHARS],
+        'error': result['error'],
+        'steps': result['steps'],
+        'maxDepth': result['maxDepth'],
+        'seconds': result['seconds'],
+    }
+    if len(result['output']) > OUTPUT_PREVIEW_CHARS:
+        entry['outputTruncated'] = True
+    if case.expected is not None and status == 'failed':
+        entry['expected'] = case.expected[:OUTPUT_PREVIEW_CHARS]
+    return entry
@@ -0,0 +1,6 @@
+"""Performance benchmarks for the debugger backend.
+
+Run from the backend directory, e.g. ``python -m benchmarks.bench_call_tree``.
+``python -m benchmarks.suite`` measures the whole corpus and compares it with
+the stored baseline.json.
+"""
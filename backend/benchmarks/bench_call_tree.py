@@ -0,0 +1,83 @@
+"""Benchmark call-tree construction for growing numbers of calls.
+
+The time per call should stay flat as the number of calls grows, showing
+that building the hierarchy is linear in the number of calls.
+
+Like timeit, the cyclic garbage collector is paused while timing so that
+collector pauses do not hide the per-call cost.
+"""
+import gc
+import sys
+import time
+
+from call_tree import CallTree
+from python_debugger import debug_python
+
+SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+FIB_SIZES = [10, 14, 18]
+
+
+def simulate_calls(total_calls, fan_out=2):
+    """Replay a recursive call pattern of `total_calls` calls into a CallTree"""
+    tree = CallTree()
+    stack = []
+    pending = [0]  # children still to be created for each frame on the stack
+    step = 0
+
+    for counter in range(1, total_calls + 1):
+        # Unwind frames that have made all their calls
+        while stack and pending[-1] == 0:
+            call_id = stack.pop()
+            pending.pop()
+            tree.finish_call(call_id, step, None)
+            step += 1
+
+        parent_id = stack[-1] if stack else None
+        if stack:
+            pending[-1] -= 1
+        call_id = f"fib_{counter}"
+        tree.add_call(call_id, parent_id, 'fib', 1, len(stack), step)
+        stack.append(call_id)
+        pending.append(fan_out if len(stack) < 20 else 0)
+        step += 1
+
+    while stack:
+        tree.finish_call(stack.pop(), step, None)
+        step += 1
+
+    return tree
+
+
+def bench_call_tree():
+    print("CallTree construction")
+    print(f"{'calls':>10} {'seconds':>10} {'ns/call':>10}")
+    for size in SIZES:
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            tree = simulate_calls(size)
+            hierarchy = tree.to_hierarchy()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        assert len(hierarchy) == size
+        print(f"{size:>10} {elapsed:>10.3f} {elapsed / size * 1e9:>10.0f}")
+
+
+def bench_traced_fib():
+    print("\ndebug_python on naive fib")
+    print(f"{'n':>10} {'calls':>10} {'seconds':>10} {'us/call':>10}")
+    for n in FIB_SIZES:
+        code = f"def fib(n):\n    if n < 2:\n        return n\n    return fib(n-1) + fib(n-2)\n\nfib({n})\n"
+        start = time.perf_counter()
+        result = debug_python(code)
+        elapsed = time.perf_counter() - start
+        calls = len(result['callHierarchy'])
+        print(f"{n:>10} {calls:>10} {elapsed:>10.3f} {elapsed / calls * 1e6:>10.1f}")
+
+
+if __name__ == '__main__':
+    bench_call_tree()
+    if '--skip-trace' not in sys.argv:
+        bench_traced_fib()
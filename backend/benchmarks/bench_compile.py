@@ -0,0 +1,59 @@
+"""Time the per-request parse/compile work before and after the shared pipeline.
+
+Before: analyze_complexity parsed the source, then run_traced wrote it to a
+temporary file, read it back and compiled it. After: compile_program parses
+once, compiles from that AST and caches the result by source hash, so a
+repeated program costs one hash and a dict lookup.
+"""
+import ast
+import os
+import tempfile
+import time
+
+from code_cache import CodeCache
+
+REPEATS = 200
+
+
+def program(functions):
+    parts = []
+    for i in range(functions):
+        parts.append(f"def f{i}(n):\n    total = 0\n    for k in range(n):\n        total += k * {i}\n    return total\n")
+    parts.append("print(sum(f(3) for f in [" + ", ".join(f"f{i}" for i in range(functions)) + "]))\n")
+    return "\n".join(parts)
+
+
+def before(code):
+    ast.parse(code)
+    with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as temp_file:
+        temp_file.write(code)
+        temp_filename = temp_file.name
+    try:
+        with open(temp_filename, 'r') as f:
+            compile(f.read(), temp_filename, 'exec')
+    finally:
+        os.unlink(temp_filename)
+
+
+def timed(function, code):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        function(code)
+    return (time.perf_counter() - start) / REPEATS
+
+
+def main():
+    print(f"{'lines':>6} {'temp file us':>13} {'first compile us':>17} {'cached us':>10}")
+    for functions in (1, 10, 100):
+        code = program(functions)
+        lines = code.count('\n')
+        old = timed(before, code)
+        # A fresh cache per repeat measures the miss path: one parse, one compile
+        first = timed(lambda source: CodeCache().compile(source), code)
+        cache = CodeCache()
+        cached = timed(cache.compile, code)
+        print(f"{lines:>6} {old * 1e6:>13.1f} {first * 1e6:>17.1f} {cached * 1e6:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
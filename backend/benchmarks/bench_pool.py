@@ -0,0 +1,61 @@
+"""Measure debug throughput through the worker pool for growing pool sizes.
+
+Each run submits the same batch of jobs from as many client threads as there
+are workers, so throughput should grow with the pool size up to the number of
+available cores.
+"""
+import os
+import threading
+import time
+
+from worker_pool import WorkerPool
+
+PROGRAM = """
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n-1) + fib(n-2)
+
+print(fib(12))
+"""
+JOBS = 32
+
+
+def measure(pool_size):
+    pool = WorkerPool(size=pool_size, max_queue=JOBS)
+    pool.start()
+    pool.run('debug', code="print('warm up')")
+
+    remaining = list(range(JOBS))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                if not remaining:
+                    return
+                remaining.pop()
+            pool.run('debug', code=PROGRAM)
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(pool_size)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+    return elapsed
+
+
+def main():
+    cores = os.cpu_count() or 1
+    print(f"{cores} cores available")
+    print(f"{'workers':>8} {'seconds':>10} {'jobs/s':>10}")
+    for size in sorted({1, 2, 4, cores}):
+        elapsed = measure(size)
+        print(f"{size:>8} {elapsed:>10.2f} {JOBS / elapsed:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Check and time the fused post-processing pass against the two-step pipeline.
+
+For every program, process_debug_states must return exactly what
+simplify_debug_states(filter_debug_states(...)) returns; the script stops
+with an AssertionError otherwise. The regression test against frozen
+copies of the original functions is tests/test_postprocess.py.
+Timings are per raw state and should stay flat as traces grow.
+"""
+import gc
+import json
+import time
+
+from python_debugger import (
+    create_tracer, run_traced, filter_debug_states, simplify_debug_states, process_debug_states
+)
+from watch import WatchList
+
+LOOP = """
+def walk(n):
+    s = 0
+    for i in range(n):
+        s += i % 3
+        if s > 10:
+            s = 0
+    return s
+
+print(walk({n}))
+"""
+PROGRAMS = {
+    'recursion': """
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n-1) + fib(n-2)
+
+print(fib(12))
+""",
+    'caught error': """
+def f(n):
+    for i in range(n):
+        pass
+    raise KeyError(n)
+
+try:
+    f(100)
+except KeyError:
+    pass
+""",
+    'uncaught error': """
+def divide(a, b):
+    return a / b
+
+for i in range(50):
+    total = i
+print(divide(10, 0))
+""",
+    'generator': """
+def g(n):
+    for i in range(n):
+        yield i * 2
+
+print(sum(g(100)))
+""",
+    'short': "x = 1\nprint(x)\n",
+}
+SIZES = [10 ** 3, 10 ** 4, 10 ** 5]
+
+
+def trace(code, watch=None):
+    tracer = create_tracer('settrace', watch=WatchList.from_spec(watch))
+    run_traced(code, None, tracer)
+    return tracer
+
+
+def timed(function, *args):
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        result = function(*args)
+        return time.perf_counter() - start, result
+    finally:
+        gc.enable()
+
+
+def two_step(states, snapshots):
+    return simplify_debug_states(filter_debug_states(states, snapshots), snapshots)
+
+
+def check(name, tracer):
+    expected = two_step(tracer.debug_states, tracer.snapshots)
+    actual = process_debug_states(tracer.debug_states, tracer.snapshots)
+    assert json.dumps(actual, default=str) == json.dumps(expected, default=str), f"{name}: outputs differ"
+
+
+def main():
+    for name, code in PROGRAMS.items():
+        check(name, trace(code))
+        check(f"{name} (watch)", trace(code, {'variables': ['i', 's'], 'when': 'i % 7 == 0'}))
+    print(f"fused output matches filter + simplify for {len(PROGRAMS)} programs")
+
+    print(f"{'iterations':>10} {'states':>8} {'two-step us/state':>18} {'fused us/state':>15}")
+    for n in SIZES:
+        tracer = trace(LOOP.format(n=n))
+        check(f"loop {n}", tracer)
+        states = len(tracer.debug_states)
+        before, _ = timed(two_step, tracer.debug_states, tracer.snapshots)
+        after, _ = timed(process_debug_states, tracer.debug_states, tracer.snapshots)
+        print(f"{n:>10} {states:>8} {before / states * 1e6:>18.2f} {after / states * 1e6:>15.2f}")
+
+
+if __name__ == '__main__':
+    main()
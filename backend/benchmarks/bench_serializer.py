@@ -0,0 +1,74 @@
+"""Measure value previews against full repr() for large locals.
+
+Each case serializes the same value on many consecutive steps, as the tracer
+does for a local that lives across a loop. Full repr() costs O(size) on every
+step; the capped serializer costs O(max_items), and cached previews of
+unchanged values cost close to nothing. A list that is appended to on every
+step shows the cost when previews must be rebuilt.
+"""
+import time
+
+from serializer import ValueSerializer
+
+SIZE = 100000
+STEPS = 200
+
+
+def full_repr(value):
+    # What the tracer did before: str() for objects, repr() for everything else
+    if isinstance(value, (int, float, bool, str, type(None))):
+        return value
+    if hasattr(value, '__dict__'):
+        return str(value)
+    return repr(value)
+
+
+def run(case, serialize):
+    make, mutate = case
+    value = make()
+    total_bytes = 0
+    start = time.perf_counter()
+    for step in range(STEPS):
+        if mutate is not None:
+            mutate(value, step)
+        preview = serialize(value)
+        total_bytes += len(str(preview))
+    return (time.perf_counter() - start) / STEPS, total_bytes / STEPS
+
+
+def int_list():
+    return list(range(SIZE))
+
+
+def str_dict():
+    return {f"key{i}": str(i) for i in range(SIZE)}
+
+
+def nested():
+    return [[i, [i, i + 1]] for i in range(SIZE // 10)]
+
+
+def long_string():
+    return 'x' * SIZE * 10
+
+
+# name -> (build the value, change it before each step or None)
+CASES = {
+    'list of ints': (int_list, None),
+    'growing list': (int_list, list.append),
+    'dict of strs': (str_dict, None),
+    'nested lists': (nested, None),
+    'long string': (long_string, None),
+}
+
+
+def main():
+    print(f"{'value':<14} {'repr us/step':>13} {'preview us/step':>16} {'repr bytes':>11} {'preview bytes':>14}")
+    for name, case in CASES.items():
+        before, before_bytes = run(case, full_repr)
+        after, after_bytes = run(case, ValueSerializer().serialize)
+        print(f"{name:<14} {before * 1e6:>13.1f} {after * 1e6:>16.1f} {before_bytes:>11.0f} {after_bytes:>14.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Compare trace memory of full per-step variable copies against delta snapshots.
+
+The 'dict/step' row is one variables dict per step, which is what the tracer
+kept before snapshots were delta-encoded. A keyframe interval of 1 stores
+every step in full, but in the flat snapshot columns.
+"""
+import sys
+import time
+import tracemalloc
+
+from python_debugger import SimpleTracer
+
+LOOP_PROGRAM = """
+def accumulate(n):
+    total = 0
+    squares = 0
+    evens = 0
+    odds = 0
+    largest = 0
+    label = 'running'
+    scale = 3
+    offset = 7
+    limit = n * 2
+    for i in range(n):
+        total += i
+        if i % 2 == 0:
+            evens += 1
+        else:
+            odds += 1
+    return total
+
+accumulate(20000)
+"""
+
+
+def trace_memory(keyframe_interval):
+    code_obj = compile(LOOP_PROGRAM, '<bench>', 'exec')
+    tracemalloc.start()
+    start = time.perf_counter()
+    tracer = SimpleTracer(keyframe_interval=keyframe_interval)
+    sys.settrace(tracer.trace_calls)
+    try:
+        exec(code_obj, {})
+    finally:
+        sys.settrace(None)
+    elapsed = time.perf_counter() - start
+    total_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # Rebuilding a step must give back the full variables
+    last_step = max(i for i, state in enumerate(tracer.debug_states) if 'snapshot' in state)
+    variables = tracer.variables_at(last_step)
+    assert variables['limit'] == 40000 and variables['i'] == 19999
+    snapshots = tracer.snapshots
+    dict_bytes = sys.getsizeof([None] * len(snapshots)) + sum(
+        sys.getsizeof(snapshots.materialize(index)) for index in range(len(snapshots))
+    )
+    return len(tracer.debug_states), snapshots.payload_size(), dict_bytes, total_bytes, elapsed
+
+
+def main():
+    print(f"{'keyframes':>10} {'states':>10} {'vars MB':>10} {'vs dict':>10} {'trace MB':>10} {'seconds':>10}")
+    for interval in (1, 8, 32, 128):
+        states, variables_bytes, dict_bytes, total_bytes, elapsed = trace_memory(interval)
+        if interval == 1:
+            print(f"{'dict/step':>10} {states:>10} {dict_bytes / 1e6:>10.2f} {1:>9.1f}x")
+        label = 'full' if interval == 1 else f"every {interval}"
+        print(f"{label:>10} {states:>10} {variables_bytes / 1e6:>10.2f} {dict_bytes / variables_bytes:>9.1f}x "
+              f"{total_bytes / 1e6:>10.2f} {elapsed:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""Compare response sizes of the default and compact (stack table) formats.
+
+For linear recursion every state carries the whole call stack in the default
+format, so the payload grows with depth squared; the compact format sends each
+frame once and should shrink the payload by roughly the depth. Each result is
+also expanded back and checked against the default format.
+"""
+import json
+
+from python_debugger import debug_python
+from stack_table import expand_result
+
+RECURSION = """
+def down(n):
+    if n == 0:
+        return 0
+    rest = down(n - 1)
+    return rest + 1
+
+print(down({depth}))
+"""
+DEPTHS = [10, 50, 200, 400]
+
+
+def main():
+    print(f"{'depth':>6} {'default KB':>11} {'compact KB':>11} {'ratio':>6}")
+    for depth in DEPTHS:
+        code = RECURSION.format(depth=depth)
+        limits = {'max_depth': depth + 10}
+        full = debug_python(code, limits=limits)
+        compact = debug_python(code, limits=limits, compact=True)
+        assert json.dumps(expand_result(compact), sort_keys=True) == json.dumps(full, sort_keys=True), \
+            f"depth {depth}: expanded compact result differs"
+
+        full_size = len(json.dumps(full))
+        compact_size = len(json.dumps(compact))
+        print(f"{depth:>6} {full_size / 1024:>11.0f} {compact_size / 1024:>11.0f} {full_size / compact_size:>6.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Bytes on the wire and encoding latency for each /api/debug response encoding.
+
+The baseline is what jsonify did: json.dumps of the whole payload, sent
+uncompressed (and, for reference, that string gzipped in one go). Every
+other row goes through PayloadEncoder, which feeds JSON to the compressor
+in chunks or packs MessagePack straight from the states.
+Each body is decoded again and compared with the payload.
+"""
+import gzip
+import json
+import time
+
+from python_debugger import debug_python
+from transport import PayloadEncoder, JSON_TYPE, MSGPACK_TYPE, brotli, msgpack
+
+PROGRAMS = {
+    'loop': """
+def walk(n):
+    total = 0
+    for i in range(n):
+        total += i % 7
+    return total
+
+print(walk(2000))
+""",
+    'recursion': """
+def down(n):
+    if n == 0:
+        return 0
+    return down(n - 1) + 1
+
+print(down(150))
+""",
+}
+REPEATS = 5
+
+
+def decode(body, media_type, coding):
+    if coding == 'gzip':
+        body = gzip.decompress(body)
+    elif coding == 'br':
+        body = brotli.decompress(body)
+    if media_type == MSGPACK_TYPE:
+        return msgpack.unpackb(body)
+    return json.loads(body)
+
+
+def timed(function):
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    encoder = PayloadEncoder(compress_min_bytes=0)
+    encodings = [(JSON_TYPE, None), (JSON_TYPE, 'gzip')]
+    if brotli is not None:
+        encodings.append((JSON_TYPE, 'br'))
+    if msgpack is not None:
+        encodings += [(MSGPACK_TYPE, None), (MSGPACK_TYPE, 'gzip')]
+        if brotli is not None:
+            encodings.append((MSGPACK_TYPE, 'br'))
+
+    print(f"{'program':<10} {'encoding':<22} {'KB':>9} {'ms':>8}")
+    for name, code in PROGRAMS.items():
+        payload = {'success': True, 'debugStates': debug_python(code, limits={'max_depth': 200})}
+        # Compare through JSON, which is what both formats are decoded into by clients
+        expected = json.loads(json.dumps(payload))
+
+        elapsed, body = timed(lambda: json.dumps(payload).encode('utf-8'))
+        print(f"{name:<10} {'json.dumps (before)':<22} {len(body) / 1024:>9.1f} {elapsed * 1000:>8.2f}")
+        elapsed, body = timed(lambda: gzip.compress(json.dumps(payload).encode('utf-8'), 6))
+        print(f"{name:<10} {'json.dumps + gzip':<22} {len(body) / 1024:>9.1f} {elapsed * 1000:>8.2f}")
+
+        for media_type, coding in encodings:
+            elapsed, (body, used) = timed(lambda: encoder.encode(payload, media_type, coding))
+            assert decode(body, media_type, used) == expected, f"{name}: {media_type} {coding} does not round-trip"
+            label = f"{media_type.split('/')[1]} {used}"
+            print(f"{name:<10} {label:<22} {len(body) / 1024:>9.1f} {elapsed * 1000:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Representative programs for the benchmark suite (see benchmarks.suite).
+
+Each entry is (source, stdin). Sizes are picked so every program records a
+few thousand to a few tens of thousands of states, well inside the default
+trace limits, and runs the same way on every Python version.
+"""
+
+CORPUS = {
+    'factorial': ("""
+def factorial(n):
+    if n <= 1:
+        return 1
+    return n * factorial(n - 1)
+
+for k in range(1, 60):
+    factorial(k)
+print(factorial(30))
+""", None),
+
+    'fib naive': ("""
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+
+print(fib(17))
+""", None),
+
+    'fib memoised': ("""
+memo = {}
+
+def fib(n):
+    if n < 2:
+        return n
+    if n not in memo:
+        memo[n] = fib(n - 1) + fib(n - 2)
+    return memo[n]
+
+for k in range(40):
+    memo.clear()
+    fib(30)
+print(fib(90))
+""", None),
+
+    'sorting': ("""
+def insertion_sort(items):
+    for i in range(1, len(items)):
+        key = items[i]
+        j = i - 1
+        while j >= 0 and items[j] > key:
+            items[j + 1] = items[j]
+            j -= 1
+        items[j + 1] = key
+    return items
+
+def merge_sort(items):
+    if len(items) <= 1:
+        return items
+    middle = len(items) // 2
+    left = merge_sort(items[:middle])
+    right = merge_sort(items[middle:])
+    merged = []
+    i = j = 0
+    while i < len(left) and j < len(right):
+        if left[i] <= right[j]:
+            merged.append(left[i])
+            i += 1
+        else:
+            merged.append(right[j])
+            j += 1
+    return merged + left[i:] + right[j:]
+
+data = [(i * 7919) % 211 for i in range(120)]
+print(insertion_sort(list(data))[:5], merge_sort(list(data))[-5:])
+""", None),
+
+    'nested loops': ("""
+def matrix_product(a, b):
+    n = len(a)
+    result = [[0] * n for _ in range(n)]
+    for i in range(n):
+        for j in range(n):
+            total = 0
+            for k in range(n):
+                total += a[i][k] * b[k][j]
+            result[i][j] = total
+    return result
+
+size = 10
+a = [[i + j for j in range(size)] for i in range(size)]
+print(matrix_product(a, a)[size - 1][size - 1])
+""", None),
+
+    'deep recursion': ("""
+def depth(n):
+    if n == 0:
+        return 0
+    return depth(n - 1) + 1
+
+for _ in range(4):
+    depth(400)
+print(depth(400))
+""", None),
+
+    'large containers': ("""
+grid = {}
+history = []
+for step in range(600):
+    key = step % 97
+    grid[key] = grid.get(key, []) + [step]
+    history.append(len(grid[key]))
+    if len(history) > 200:
+        history.pop(0)
+print(len(grid), sum(history))
+""", None),
+
+    'stdin heavy': ("""
+import sys
+
+total = 0
+words = {}
+for line in sys.stdin:
+    parts = line.split()
+    total += int(parts[0])
+    for word in parts[1:]:
+        words[word] = words.get(word, 0) + 1
+print(total, len(words))
+""", ''.join(f"{i} alpha{i % 13} beta{i % 7} gamma\n" for i in range(500))),
+}
@@ -0,0 +1,259 @@
+"""Tracer overhead and end-to-end latency over the benchmark corpus.
+
+    python -m benchmarks.suite [--output results.json] [--baseline benchmarks/baseline.json]
+                               [--save-baseline] [--tolerance 0.25] [--repeat 3]
+                               [--only NAME] [--url http://localhost:5000]
+
+For every program in benchmarks.corpus this records untraced and traced
+runtime, events per second of trace time, peak RSS, raw and kept state
+counts and response bytes of debug_python, then the latency and bytes of
+/api/debug (through the Flask test client, or a running server with --url).
+Each program is measured in a fresh process so peak RSS is its own.
+
+With --baseline every metric is compared with the stored run, and the exit
+status is 1 when one regresses: timings, ratios and sizes by more than
+--tolerance, state counts on any change. Timings only compare meaningfully
+on the machine that recorded the baseline; the overhead ratio, state counts
+and byte sizes travel better.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import urllib.request
+from contextlib import redirect_stdout, redirect_stderr
+from datetime import datetime, timezone
+
+from benchmarks.corpus import CORPUS
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_REPEAT = 3
+LIMITS = {'max_events': 200000, 'max_depth': 1000, 'max_seconds': 60}
+
+# Metric -> which direction is a regression: 'higher' values are worse, 'lower' values are worse, or any change
+METRICS = {
+    'untracedSeconds': 'higher',
+    'tracedSeconds': 'higher',
+    'traceSeconds': 'higher',
+    'overheadRatio': 'higher',
+    'eventsPerSecond': 'lower',
+    'peakRssBytes': 'higher',
+    'rawStates': 'changed',
+    'keptStates': 'changed',
+    'responseBytes': 'higher',
+    'gzipBytes': 'higher',
+    'httpSeconds': 'higher',
+    'httpBytes': 'higher',
+    'httpGzipBytes': 'higher',
+}
+
+
+def run_untraced(code, stdin):
+    program = compile(code, '<bench>', 'exec')
+    sys.stdin = io.StringIO(stdin or '')
+    try:
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            exec(program, {})
+            return time.perf_counter() - start
+    finally:
+        sys.stdin = sys.__stdin__
+
+
+def measure_program(name, repeat):
+    """Runs in a fresh process: debug_python figures for one corpus program"""
+    from python_debugger import debug_python
+    from transport import PayloadEncoder, JSON_TYPE
+    from worker_pool import current_rss
+
+    code, stdin = CORPUS[name]
+    start_rss = current_rss()
+    untraced = min(run_untraced(code, stdin) for _ in range(repeat))
+
+    best = None
+    for _ in range(repeat):
+        with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+            start = time.perf_counter()
+            result = debug_python(code, stdin, limits=LIMITS)
+            elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, result)
+    traced, result = best
+
+    encoder = PayloadEncoder(compress_min_bytes=0)
+    payload = {'success': True, 'debugStates': result}
+    trace_seconds = result['timings']['trace'] / 1000
+    return {
+        'untracedSeconds': round(untraced, 6),
+        'tracedSeconds': round(traced, 6),
+        'traceSeconds': round(trace_seconds, 6),
+        'overheadRatio': round(traced / untraced, 1) if untraced else None,
+        'eventsPerSecond': round(result['stateCounts']['raw'] / trace_seconds) if trace_seconds else None,
+        'startRssBytes': start_rss,
+        # ru_maxrss is in KB on Linux
+        'peakRssBytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'rawStates': result['stateCounts']['raw'],
+        'keptStates': result['stateCounts']['kept'],
+        'truncated': result['truncated'],
+        'responseBytes': len(encoder.encode(payload, JSON_TYPE)[0]),
+        'gzipBytes': len(encoder.encode(payload, JSON_TYPE, 'gzip')[0]),
+    }
+
+
+class TestClientTransport:
+    """POST /api/debug through the Flask test client, with the result cache off"""
+
+    def __init__(self):
+        os.environ['RESULT_CACHE_MAX_MB'] = '0'
+        os.environ.setdefault('WORKER_POOL_SIZE', '1')
+        with redirect_stdout(io.StringIO()):
+            import app
+        self.app = app
+        self.client = app.app.test_client()
+
+    def post(self, body, headers):
+        response = self.client.post('/api/debug', json=body, headers=headers)
+        assert response.status_code == 200, response.get_data(as_text=True)[:200]
+        return response.data
+
+    def close(self):
+        if self.app.pool is not None:
+            self.app.pool.shutdown()
+
+
+class UrlTransport:
+    """POST /api/debug to a running server"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/') + '/api/debug'
+
+    def post(self, body, headers):
+        request = urllib.request.Request(
+            self.url, data=json.dumps(body).encode('utf-8'),
+            headers=dict(headers, **{'Content-Type': 'application/json'}), method='POST'
+        )
+        with urllib.request.urlopen(request) as response:
+            return response.read()
+
+    def close(self):
+        pass
+
+
+def measure_http(transport, name, repeat):
+    code, stdin = CORPUS[name]
+    body = {'language': 'python', 'code': code, 'input': stdin or '', 'limits': {'maxEvents': LIMITS['max_events']}}
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = transport.post(body, {})
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    compressed = transport.post(body, {'Accept-Encoding': 'gzip'})
+    return {
+        'httpSeconds': round(best, 6),
+        'httpBytes': len(data),
+        'httpGzipBytes': len(compressed),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """(program, metric, baseline value, new value, relative change) for each regression"""
+    regressions = []
+    for name, metrics in results['programs'].items():
+        before = baseline.get('programs', {}).get(name)
+        if before is None:
+            continue
+        for metric, worse in METRICS.items():
+            old, new = before.get(metric), metrics.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else (0.0 if new == old else float('inf'))
+            if ((worse == 'changed' and new != old) or
+                    (worse == 'higher' and change > tolerance) or
+                    (worse == 'lower' and change < -tolerance)):
+                regressions.append((name, metric, old, new, change))
+    return regressions
+
+
+def print_table(results, baseline):
+    columns = [
+        ('tracedSeconds', 'traced ms', 1000), ('overheadRatio', 'overhead', 1),
+        ('eventsPerSecond', 'events/s', 1), ('peakRssBytes', 'peak MB', 1 / 2 ** 20),
+        ('keptStates', 'kept', 1), ('responseBytes', 'KB', 1 / 1024), ('httpSeconds', 'http ms', 1000),
+    ]
+    print(f"{'program':<17}" + ''.join(f"{label:>16}" for _, label, _ in columns))
+    for name, metrics in results['programs'].items():
+        before = (baseline or {}).get('programs', {}).get(name, {})
+        cells = []
+        for metric, _, scale in columns:
+            value = metrics.get(metric)
+            text = '-' if value is None else f"{value * scale:.1f}"
+            if before.get(metric):
+                text += f" {(value - before[metric]) / before[metric]:+.0%}"
+            cells.append(f"{text:>16}")
+        print(f"{name:<17}" + ''.join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="stored results to compare with")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="allowed relative slowdown")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--only', action='append', choices=sorted(CORPUS), help="measure only this program")
+    parser.add_argument('--url', help="measure a running server instead of the test client")
+    args = parser.parse_args()
+
+    names = args.only or list(CORPUS)
+    results = {
+        'createdAt': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'programs': {},
+    }
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1, maxtasksperchild=1) as processes:
+        for name in names:
+            results['programs'][name] = processes.apply(measure_program, (name, args.repeat))
+
+    transport = UrlTransport(args.url) if args.url else TestClientTransport()
+    try:
+        for name in names:
+            results['programs'][name].update(measure_http(transport, name, args.repeat))
+    finally:
+        transport.close()
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if baseline is None:
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name, metric, old, new, change in regressions:
+        print(f"REGRESSION {name}: {metric} {old} -> {new} ({change:+.0%})")
+    if not regressions:
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import time
+
+# Rough size of one recorded state without its variables
+STATE_OVERHEAD_BYTES = 400
+
+# Wall time is only read every this many events to keep the check cheap
+TIME_CHECK_INTERVAL = 64
+
+
+class TraceInterrupted(BaseException):
+    """
+    Raised inside the traced program to stop it, e.g. when a stream is closed.
+    A program can catch it with a bare except; the tracer then sets `rearm`,
+    called when the program drops the caught exception, to stop it again.
+    """
+    rearm = None
+
+    def __del__(self):
+        if self.rearm is not None:
+            self.rearm()
+
+
+class TraceBudgetExceeded(TraceInterrupted):
+    """Raised inside the traced program when a trace budget runs out"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class TraceBudget:
+    """
+    Limits on a single trace: recorded events, stack depth, wall time and
+    approximate bytes of recorded state. A limit of None means unlimited.
+    The tracer calls the check methods from its callbacks; when a limit is hit
+    they record why and raise TraceBudgetExceeded to stop the program.
+    """
+
+    def __init__(self, max_events=None, max_depth=None, max_seconds=None, max_bytes=None):
+        self.max_events = max_events
+        self.max_depth = max_depth
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.events = 0
+        self.depth = 0
+        self.bytes = 0
+        self.started_at = time.monotonic()
+        self.stopped_at = None
+        self.exceeded = None
+
+    @classmethod
+    def from_limits(cls, limits):
+        """Build a budget from a limits dict, or return None when there are no limits"""
+        if not limits:
+            return None
+        return cls(
+            max_events=limits.get('max_events'),
+            max_depth=limits.get('max_depth'),
+            max_seconds=limits.get('max_seconds'),
+            max_bytes=limits.get('max_bytes')
+        )
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.stopped_at = None
+
+    def stop(self):
+        if self.stopped_at is None:
+            self.stopped_at = time.monotonic()
+
+    def elapsed(self):
+        return (self.stopped_at or time.monotonic()) - self.started_at
+
+    def check_event(self, variable_bytes):
+        """Account for one recorded state, given the total bytes of recorded variables so far"""
+        self.events += 1
+        self.bytes = self.events * STATE_OVERHEAD_BYTES + variable_bytes
+
+        if self.max_events is not None and self.events >= self.max_events:
+            self._exceed('max_events')
+        if self.max_bytes is not None and self.bytes >= self.max_bytes:
+            self._exceed('max_bytes')
+        if self.max_seconds is not None and self.events % TIME_CHECK_INTERVAL == 0:
+            if self.elapsed() >= self.max_seconds:
+                self._exceed('max_seconds')
+
+    def check_depth(self, depth):
+        """Account for a new call at the given stack depth"""
+        if depth > self.depth:
+            self.depth = depth
+        if self.max_depth is not None and depth > self.max_depth:
+            self._exceed('max_depth')
+
+    def counters(self):
+        return {
+            'events': self.events,
+            'maxDepth': self.depth,
+            'seconds': round(self.elapsed(), 3),
+            'bytes': self.bytes
+        }
+
+    def truncation(self):
+        """Why the trace was cut short, with the counters reached, or None"""
+        if self.exceeded is None:
+            return None
+        limit = getattr(self, self.exceeded)
+        return {
+            'reason': self.exceeded,
+            'limit': limit,
+            'counters': self.counters()
+        }
+
+    def _exceed(self, reason):
+        self.exceeded = reason
+        self.stop()
+        raise TraceBudgetExceeded(reason)
@@ -0,0 +1,276 @@
+import json
+
+
+class CallNode:
+    """A single function call in the call tree"""
+    __slots__ = (
+        'call_id', 'parent_id', 'function', 'entry_line', 'stack_depth',
+        'children', 'entry_step', 'exit_step', 'return_value', 'args',
+        'first_state', 'last_state', 'subtree_size', 'subtree_depth'
+    )
+
+    def __init__(self, call_id, parent_id, function, entry_line, stack_depth, entry_step, args=None):
+        self.call_id = call_id
+        self.parent_id = parent_id
+        self.function = function
+        self.entry_line = entry_line
+        self.stack_depth = stack_depth
+        self.children = []
+        self.entry_step = entry_step
+        self.exit_step = None
+        self.return_value = None
+        self.args = args if args is not None else {}
+        # Set by CallTree.index_states: kept state indices of the call and the size of its subtree
+        self.first_state = None
+        self.last_state = None
+        self.subtree_size = 1
+        self.subtree_depth = 0
+
+    def to_dict(self):
+        """Convert the node to the callHierarchy entry format"""
+        return {
+            'call_id': self.call_id,
+            'parent_id': self.parent_id,
+            'function': self.function,
+            'entry_line': self.entry_line,
+            'stack_depth': self.stack_depth,
+            'children': list(self.children),
+            'entry_step': self.entry_step,
+            'exit_step': self.exit_step,
+            'return_value': self.return_value,
+            'args': self.args,
+            'first_state': self.first_state,
+            'last_state': self.last_state,
+            'subtree_size': self.subtree_size,
+            'subtree_depth': self.subtree_depth
+        }
+
+
+class CallTree:
+    """Call hierarchy indexed by call id, so every operation is O(1)"""
+
+    def __init__(self):
+        self.nodes = {}  # call_id -> CallNode, in call order
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes.values())
+
+    def __contains__(self, call_id):
+        return call_id in self.nodes
+
+    def get(self, call_id):
+        return self.nodes.get(call_id)
+
+    def add_call(self, call_id, parent_id, function, entry_line, stack_depth, entry_step, args=None):
+        """Register a new call and link it to its parent"""
+        node = CallNode(call_id, parent_id, function, entry_line, stack_depth, entry_step, args)
+        self.nodes[call_id] = node
+
+        if parent_id is not None:
+            parent = self.nodes.get(parent_id)
+            if parent is not None:
+                parent.children.append(call_id)
+
+        return node
+
+    def finish_call(self, call_id, exit_step, return_value=None):
+        """Record the step index and return value of a finished call"""
+        node = self.nodes.get(call_id)
+        if node is not None:
+            node.exit_step = exit_step
+            node.return_value = return_value
+        return node
+
+    def index_states(self, state_call_ids):
+        """
+        Index the calls against the kept states, given the callId of each
+        state in order: sets first_state/last_state and the subtree size and
+        depth of every node, and returns the callIndex of a result,
+        {'positions': {call_id: position in callHierarchy},
+         'stateCalls': [position of the call of each state, or None]},
+        so clients find the call of a step and the steps of a call in O(1).
+        """
+        positions = {call_id: position for position, call_id in enumerate(self.nodes)}
+        nodes = self.nodes
+        state_calls = []
+        for step, call_id in enumerate(state_call_ids):
+            node = nodes.get(call_id) if call_id is not None else None
+            if node is None:
+                state_calls.append(None)
+                continue
+            if node.first_state is None:
+                node.first_state = step
+            node.last_state = step
+            state_calls.append(positions[call_id])
+
+        # Children are always registered after their parent, so one reverse pass sums the subtrees
+        for node in reversed(nodes.values()):
+            size, depth = 1, 0
+            for child_id in node.children:
+                child = nodes[child_id]
+                size += child.subtree_size
+                depth = max(depth, child.subtree_depth + 1)
+            node.subtree_size = size
+            node.subtree_depth = depth
+        return {'positions': positions, 'stateCalls': state_calls}
+
+    def to_hierarchy(self):
+        """Build the callHierarchy list returned by debug_python"""
+        return [node.to_dict() for node in self.nodes.values()]
+
+
+class CallDag:
+    """
+    The call tree with structurally identical subtrees merged, for programs
+    like naive recursion that repeat the same calls many times. Calls with
+    the same function, arguments, return value and (recursively) children
+    share one node that counts how often it ran, and runs of identical
+    children are sent once with a repeat count, so the size grows with the
+    distinct subproblems instead of the total calls. Arguments and return
+    values are compared by their previews, so values that only differ past
+    the preview limits are merged too.
+    With `max_depth`, nodes deeper than that from a root are left out and
+    the nodes at the limit summarize what they hide.
+    """
+
+    REPEATED_LIMIT = 10  # Subproblems listed in 'repeated'
+
+    def __init__(self, max_depth=None):
+        self.max_depth = max_depth
+
+    @classmethod
+    def from_options(cls, options):
+        """
+        None/False for the plain callHierarchy, True or e.g. {"maxDepth": 4}
+        for a CallDag. Raises ValueError for malformed options.
+        """
+        if options is None or options is False:
+            return None
+        if options is True:
+            return cls()
+        if not isinstance(options, dict):
+            raise ValueError("callDag must be true, false or an object")
+        max_depth = options.get('maxDepth')
+        if max_depth is not None and (isinstance(max_depth, bool) or not isinstance(max_depth, int) or max_depth < 0):
+            raise ValueError("callDag.maxDepth must be a non-negative integer")
+        return cls(max_depth)
+
+    def build(self, tree, state_call_ids=()):
+        """
+        The callDag section of a result from a finished CallTree and the
+        callId of each kept state: {'nodes', 'roots', 'stateNodes',
+        'totalCalls', 'distinctCalls', 'maxDepth', 'repeated'}. Node ids are
+        positions in 'nodes'; children and roots are [node id, repeat count]
+        runs, and 'stateNodes' holds the node of each state's call (its
+        nearest shown ancestor when the call is past maxDepth).
+        """
+        merged = {}  # call_id -> index in `distinct`
+        keys = {}    # Subtree key -> index in `distinct`
+        distinct = []
+        # Children are always registered after their parent, so a reverse pass meets them first
+        for node in reversed(list(tree)):
+            runs = repeat_runs(merged[child_id] for child_id in node.children)
+            key = (
+                node.function, node.entry_line, node.exit_step is not None,
+                tuple((name, preview_key(value)) for name, value in node.args.items()),
+                preview_key(node.return_value),
+                tuple(map(tuple, runs))
+            )
+            index = keys.get(key)
+            if index is None:
+                index = keys[key] = len(distinct)
+                size, depth = 1, 0
+                for child, count in runs:
+                    size += count * distinct[child]['subtree_size']
+                    depth = max(depth, distinct[child]['subtree_depth'] + 1)
+                distinct.append({
+                    'function': node.function,
+                    'entry_line': node.entry_line,
+                    'args': node.args,
+                    'return_value': node.return_value,
+                    'finished': node.exit_step is not None,
+                    'children': runs,
+                    'calls': 0,
+                    'subtree_size': size,
+                    'subtree_depth': depth
+                })
+            distinct[index]['calls'] += 1
+            merged[node.call_id] = index
+
+        roots = repeat_runs(merged[node.call_id] for node in tree if node.parent_id not in tree)
+
+        # Number the shown nodes breadth first, so each is first reached at its smallest depth
+        ids = {}  # index in `distinct` -> node id
+        nodes = []
+        frontier = [index for index, _ in roots]
+        depth = 0
+        while frontier:
+            next_frontier = []
+            for index in frontier:
+                if index in ids:
+                    continue
+                ids[index] = len(nodes)
+                entry = dict(distinct[index], id=len(nodes))
+                nodes.append(entry)
+                if self.max_depth is not None and depth >= self.max_depth and entry['children']:
+                    entry['hidden'] = {'calls': entry['subtree_size'] - 1, 'depth': entry['subtree_depth']}
+                    entry['children'] = []
+                else:
+                    next_frontier.extend(child for child, _ in entry['children'])
+            frontier = next_frontier
+            depth += 1
+        for entry in nodes:
+            entry['children'] = [[ids[child], count] for child, count in entry['children']]
+
+        shown = {}  # call_id -> node id of the call, or of its nearest shown ancestor
+        for node in tree:
+            node_id = ids.get(merged[node.call_id])
+            shown[node.call_id] = node_id if node_id is not None else shown.get(node.parent_id)
+
+        repeated = sorted(
+            (index for index, entry in enumerate(distinct) if entry['calls'] > 1 and entry['subtree_size'] > 1),
+            key=lambda index: (distinct[index]['calls'] - 1) * distinct[index]['subtree_size'],
+            reverse=True
+        )[:self.REPEATED_LIMIT]
+        return {
+            'nodes': nodes,
+            'roots': [[ids[index], count] for index, count in roots],
+            'stateNodes': [shown.get(call_id) for call_id in state_call_ids],
+            'totalCalls': len(tree),
+            'distinctCalls': len(distinct),
+            'maxDepth': self.max_depth,
+            # Subproblems solved more than once: where memoisation would save the most calls
+            'repeated': [
+                {
+                    'node': ids.get(index),  # None when past maxDepth
+                    'function': distinct[index]['function'],
+                    'args': distinct[index]['args'],
+                    'calls': distinct[index]['calls'],
+                    'savedCalls': (distinct[index]['calls'] - 1) * distinct[index]['subtree_size']
+                }
+                for index in repeated
+            ]
+        }
+
+
+def preview_key(value):
+    """Hashable key of a value preview; structured previews are compared as JSON"""
+    try:
+        hash(value)
+    except TypeError:
+        return json.dumps(value, sort_keys=True, default=str)
+    return (type(value), value)  # So that 1, 1.0 and True stay apart
+
+
+def repeat_runs(items):
+    """Consecutive equal items as [item, count] pairs"""
+    runs = []
+    for item in items:
+        if runs and runs[-1][0] == item:
+            runs[-1][1] += 1
+        else:
+            runs.append([item, 1])
+    return runs
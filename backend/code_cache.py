@@ -0,0 +1,67 @@
+import ast
+import hashlib
+import linecache
+import threading
+from collections import OrderedDict
+
+# Compiled programs kept for reuse, least recently used dropped first
+CODE_CACHE_SIZE = 256
+
+
+class CompiledProgram:
+    """A parsed and compiled program: its source, synthetic filename, AST and code object"""
+    __slots__ = ('source', 'filename', 'tree', 'code')
+
+    def __init__(self, source, filename, tree, code):
+        self.source = source
+        self.filename = filename
+        self.tree = tree
+        self.code = code
+
+
+class CodeCache:
+    """
+    Compiled programs keyed by a hash of their source.
+    Each program is parsed once, compiled from that AST under a synthetic
+    filename, and registered with linecache so tracebacks still show its
+    source lines without a file on disk.
+    """
+
+    def __init__(self, max_size=CODE_CACHE_SIZE):
+        self.max_size = max_size
+        self._programs = OrderedDict()  # Source hash -> CompiledProgram
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, source):
+        """The CompiledProgram for `source`. Raises SyntaxError (or ValueError) like compile()"""
+        digest = hashlib.sha256(source.encode('utf-8', 'surrogatepass')).hexdigest()
+        with self._lock:
+            program = self._programs.get(digest)
+            if program is not None:
+                self._programs.move_to_end(digest)
+                self.hits += 1
+        if program is None:
+            # Failed compiles are not kept, so every run reports a fresh exception
+            # No angle brackets: clean_variables drops values that look like <...> reprs,
+            # which would hide the file in syntax error messages
+            filename = f"debugged-{digest[:12]}.py"
+            tree = ast.parse(source, filename)
+            program = CompiledProgram(source, filename, tree, compile(tree, filename, 'exec'))
+            with self._lock:
+                self.misses += 1
+                self._programs[digest] = program
+                if len(self._programs) > self.max_size:
+                    _, evicted = self._programs.popitem(last=False)
+                    linecache.cache.pop(evicted.filename, None)
+        # Registered on every use, in case the traced program cleared linecache
+        linecache.cache[program.filename] = (len(source), None, source.splitlines(True), program.filename)
+        return program
+
+
+code_cache = CodeCache()
+
+
+def compile_program(source):
+    return code_cache.compile(source)
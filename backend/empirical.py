@@ -0,0 +1,238 @@
+import io
+import math
+import sys
+import time
+from contextlib import redirect_stdout, redirect_stderr
+
+from budgets import TraceInterrupted
+
+MIN_SIZES = 3
+MAX_SIZES = 20
+MAX_SIZE = 10 ** 7
+DEFAULT_MAX_STEPS = 5000000  # Line events per input size before larger sizes are skipped
+DEFAULT_MAX_SECONDS = 5.0    # Wall time for all sizes together
+
+# Growth classes tried by fit_growth, simplest first: (label, g(n))
+GROWTH_CLASSES = [
+    ('O(1)', None),
+    ('O(log n)', lambda n: math.log2(n) if n > 1 else 0.0),
+    ('O(n)', lambda n: float(n)),
+    ('O(n log n)', lambda n: n * math.log2(n) if n > 1 else 0.0),
+    ('O(n^2)', lambda n: float(n) ** 2),
+    ('O(n^3)', lambda n: float(n) ** 3),
+]
+
+
+class EmpiricalSpec:
+    """
+    What to measure: call `function` once per input size n with the arguments
+    given by the `args` expression (evaluated with n bound, default "n"),
+    e.g. {"function": "sort", "sizes": [100, 200, 400, 800], "args": "list(range(n, 0, -1))"}.
+    """
+
+    def __init__(self, function, sizes, args='n'):
+        self.function = function
+        self.sizes = sorted(set(sizes))
+        self.args = args
+        try:
+            self.args_code = compile(f"({args},)", '<empirical>', 'eval')
+        except SyntaxError as e:
+            raise ValueError(f"Invalid empirical.args {args!r}: {e.msg}")
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Build a spec from a request's `empirical` object, or return None when
+        it is not given. Raises ValueError for malformed entries.
+        """
+        if not spec:
+            return None
+        if not isinstance(spec, dict):
+            raise ValueError("empirical must be an object")
+
+        function = spec.get('function')
+        if not isinstance(function, str) or not function.isidentifier():
+            raise ValueError("empirical.function must be a function name")
+
+        sizes = spec.get('sizes')
+        if (not isinstance(sizes, list) or
+                not all(isinstance(n, int) and not isinstance(n, bool) and 0 <= n <= MAX_SIZE for n in sizes)):
+            raise ValueError(f"empirical.sizes must be a list of integers between 0 and {MAX_SIZE}")
+        if not MIN_SIZES <= len(set(sizes)) <= MAX_SIZES:
+            raise ValueError(f"empirical.sizes must have between {MIN_SIZES} and {MAX_SIZES} distinct sizes")
+
+        args = spec.get('args', 'n')
+        if not isinstance(args, str):
+            raise ValueError("empirical.args must be an expression string")
+        return cls(function, sizes, args)
+
+
+class StepLimitReached(TraceInterrupted):
+    """Raised inside the measured call when it runs past its step or time limit"""
+
+
+class CountingTracer:
+    """
+    Minimal settrace tracer that only counts line events and tracks the
+    deepest call stack of the debugged program's own code.
+    """
+
+    def __init__(self, is_user_code, max_steps, deadline):
+        self.is_user_code = is_user_code
+        self.max_steps = max_steps
+        self.deadline = deadline
+        self.steps = 0
+        self.depth = 0
+        self.max_depth = 0
+
+    def trace_calls(self, frame, event, arg):
+        if event != 'call' or not self.is_user_code(frame.f_code.co_filename):
+            return None
+        self.depth += 1
+        if self.depth > self.max_depth:
+            self.max_depth = self.depth
+        return self.trace_lines
+
+    def trace_lines(self, frame, event, arg):
+        if event == 'line':
+            self.steps += 1
+            if self.steps > self.max_steps or (self.steps & 1023 == 0 and time.monotonic() > self.deadline):
+                raise StepLimitReached()
+        elif event == 'return':
+            self.depth -= 1
+        return self.trace_lines
+
+
+def fit_growth(sizes, values):
+    """
+    Fit values ≈ a·g(n) + b for each growth class (and c^n in log space),
+    returning {'class', 'confidence', 'error', 'fits'}. `error` is the RMS
+    residual relative to the mean value. Confidence combines the best fit's R²
+    with how clearly it beats the next class, so near-ties score low.
+    """
+    mean = sum(values) / len(values)
+    total = sum((v - mean) ** 2 for v in values)
+    fits = []
+    for label, growth in GROWTH_CLASSES:
+        fitted = fit_linear([growth(n) for n in sizes], values) if growth else None
+        if fitted is None:
+            predicted = [mean] * len(values)  # Constant, or a class that doesn't grow with the data
+            growing = False
+        else:
+            a, b = fitted
+            predicted = [a * growth(n) + b for n in sizes]
+            growing = True
+        fits.append((label, residual(values, predicted), growing))
+
+    exponential = fit_exponential(sizes, values)
+    if exponential is not None:
+        base, scale = exponential
+        label = 'O(2^n)' if abs(base - 2) < 0.05 else f"O({base:.2f}^n)"
+        fits.append((label, residual(values, [scale * base ** n for n in sizes]), True))
+
+    # Ties go to the simpler class, which comes first
+    best = min(range(len(fits)), key=lambda i: (fits[i][1], i))
+    label, squared_error, _ = fits[best]
+    # Classes that didn't grow with the data are the same fit as O(1)
+    others = [fit[1] for i, fit in enumerate(fits) if i != best and (fit[2] or i == 0)]
+    runner_up = min(others) if others else None
+
+    r_squared = 1.0 if total == 0 else max(0.0, 1 - squared_error / total)
+    if runner_up is None or (runner_up == 0 and squared_error == 0):
+        separation = 1.0 if runner_up is None else 0.0
+    else:
+        separation = 1 - squared_error / runner_up
+    scale = abs(mean) or 1.0
+    return {
+        'class': label,
+        'confidence': round(r_squared * separation, 3),
+        'error': round(math.sqrt(squared_error / len(values)) / scale, 4),
+        'fits': {fit[0]: round(math.sqrt(fit[1] / len(values)) / scale, 4) for fit in fits}
+    }
+
+
+def fit_linear(xs, ys):
+    """Least-squares (a, b) for ys ≈ a·xs + b, or None when a would not be positive"""
+    count = len(xs)
+    mean_x = sum(xs) / count
+    mean_y = sum(ys) / count
+    spread = sum((x - mean_x) ** 2 for x in xs)
+    if spread == 0:
+        return None
+    a = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread
+    if a <= 0:
+        return None
+    return a, mean_y - a * mean_x
+
+
+def fit_exponential(sizes, values):
+    """(base, scale) for values ≈ scale·base^n, fitted on log values, or None"""
+    if min(values) <= 0 or max(sizes) > 1000:
+        return None
+    fitted = fit_linear(list(sizes), [math.log(v) for v in values])
+    if fitted is None or fitted[0] < math.log(1.1):
+        return None  # Barely growing, the polynomial classes describe it better
+    if fitted[0] * max(sizes) + fitted[1] > 700:
+        return None  # Predictions would overflow a float
+    return math.exp(fitted[0]), math.exp(fitted[1])
+
+
+def residual(values, predicted):
+    return sum((v - p) ** 2 for v, p in zip(values, predicted))
+
+
+def measure(program, spec, input_data, is_user_code, max_steps=DEFAULT_MAX_STEPS, max_seconds=DEFAULT_MAX_SECONDS):
+    """
+    For each input size, run the program's top level in fresh globals (output
+    discarded, so state like memo tables doesn't leak between sizes), then call
+    spec.function under a CountingTracer. Returns {'function', 'samples',
+    'time', 'space'} with one sample per completed size; sizes after the first
+    that hits a limit are skipped.
+    """
+    result = {'function': spec.function, 'samples': [], 'time': None, 'space': None}
+    deadline = time.monotonic() + max_seconds
+    previous_trace = sys.gettrace()
+
+    def traced(tracer, function, *args):
+        sys.settrace(tracer.trace_calls)
+        try:
+            return function(*args)
+        finally:
+            sys.settrace(previous_trace)
+
+    try:
+        with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+            for size in spec.sizes:
+                global_vars = {'__file__': program.filename}
+                sys.stdin = io.StringIO(input_data or '')
+                # Also counted, only so a runaway top level still stops at the limits
+                traced(CountingTracer(is_user_code, max_steps, deadline), exec, program.code, global_vars)
+                function = global_vars.get(spec.function)
+                if not callable(function):
+                    result['error'] = f"{spec.function} is not a function defined by the program"
+                    break
+
+                args = eval(spec.args_code, global_vars, {'n': size})
+                tracer = CountingTracer(is_user_code, max_steps, deadline)
+                started = time.perf_counter()
+                traced(tracer, function, *args)
+                result['samples'].append({
+                    'size': size,
+                    'steps': tracer.steps,
+                    'maxDepth': tracer.max_depth,
+                    'seconds': round(time.perf_counter() - started, 6)
+                })
+    except StepLimitReached:
+        result['stoppedAt'] = size
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        sys.settrace(previous_trace)
+        sys.stdin = sys.__stdin__
+
+    samples = result['samples']
+    if len(samples) >= MIN_SIZES:
+        sizes = [sample['size'] for sample in samples]
+        result['time'] = fit_growth(sizes, [sample['steps'] for sample in samples])
+        result['space'] = fit_growth(sizes, [sample['maxDepth'] for sample in samples])
+    return result
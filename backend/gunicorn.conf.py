@@ -0,0 +1,74 @@
+"""
+Gunicorn settings for serving the API in production:
+
+    gunicorn -c gunicorn.conf.py
+
+Each gunicorn worker is one API process with its own trace worker pool and
+result cache, so scale with threads first. On SIGTERM a worker stops
+reporting ready on /api/health, finishes the requests it has and drains
+its trace pool, all within graceful_timeout minus DRAIN_MARGIN_SECONDS
+counted from the signal, so the arbiter never kills it mid-drain.
+"""
+import math
+import os
+import signal
+import time
+
+
+
+def seconds_setting(name, default):
+    """Whole seconds (rounded up) from an environment variable, which may be written as e.g. 30.0"""
+    value = os.getenv(name)
+    if value is None:
+        return math.ceil(default)
+    try:
+        return math.ceil(float(value))
+    except ValueError:
+        raise ValueError(f"{name} must be a number of seconds, got {value!r}") from None
+
+
+wsgi_app = 'app:app'
+bind = f"{os.getenv('FLASK_HOST', '0.0.0.0')}:{os.getenv('FLASK_PORT', 5000)}"
+
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+worker_class = 'gthread'
+# Enough threads for every pool slot and queue place, plus a few for health checks and sessions
+threads = int(os.getenv('GUNICORN_THREADS', 32))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Longer than WORKER_JOB_TIMEOUT, so a stuck trace is killed by the pool rather than the whole worker
+job_timeout = seconds_setting('WORKER_JOB_TIMEOUT', 30)
+timeout = seconds_setting('GUNICORN_TIMEOUT', job_timeout * 2)
+graceful_timeout = seconds_setting('GUNICORN_GRACEFUL_TIMEOUT', job_timeout + 5)
+# Left of graceful_timeout for stopping the pool's processes once the drain wait is over
+DRAIN_MARGIN_SECONDS = 3
+
+# Request line and headers; body size is limited by MAX_REQUEST_MB in app.py
+limit_request_line = int(os.getenv('GUNICORN_LIMIT_REQUEST_LINE', 4094))
+limit_request_fields = int(os.getenv('GUNICORN_LIMIT_REQUEST_FIELDS', 100))
+limit_request_field_size = int(os.getenv('GUNICORN_LIMIT_REQUEST_FIELD_SIZE', 8190))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+
+
+def drain_deadline():
+    return time.monotonic() + max(0, graceful_timeout - DRAIN_MARGIN_SECONDS)
+
+
+def post_worker_init(worker):
+    from app import begin_drain
+    handle_exit = worker.handle_exit
+
+    def handle_exit_draining(sig, frame):
+        # The arbiter's graceful_timeout runs from this signal, so the drain budget does too
+        worker.drain_deadline = drain_deadline()
+        begin_drain()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, handle_exit_draining)
+
+
+def worker_exit(server, worker):
+    from app import drain
+    deadline = getattr(worker, 'drain_deadline', None) or drain_deadline()
+    drain(max(0, deadline - time.monotonic()))
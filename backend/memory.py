@@ -0,0 +1,183 @@
+import tracemalloc
+
+DEFAULT_SAMPLE_EVERY = 100      # Events between samples of traced memory
+DEFAULT_MAX_OVERHEAD_MB = 64    # tracemalloc's own memory before it is switched off
+MAX_SAMPLE_EVERY = 100000
+MAX_OVERHEAD_MB = 1024
+
+
+class MemoryFrame:
+    __slots__ = ('call_id', 'function', 'entry', 'peak', 'allocated', 'line')
+
+    def __init__(self, call_id, function, entry):
+        self.call_id = call_id
+        self.function = function
+        self.entry = entry        # Program bytes when the call started
+        self.peak = entry         # Highest program bytes seen while it ran
+        self.allocated = 0        # Bytes allocated by its own lines
+        self.line = None
+
+
+class MemoryTracker:
+    """
+    Attributes the debugged program's memory to lines and calls with
+    tracemalloc. Like Profiler, the tracer calls pause() when an event starts
+    and resume() when it is done, and only the change in traced memory between
+    resume() and the next pause() counts as the program's, so recorded states
+    and snapshots are left out. Traced memory is sampled every `sample_every`
+    events, and tracing stops (with `stoppedAtStep` set) once tracemalloc's
+    own bookkeeping passes `max_overhead_mb`.
+    When tracemalloc was already running, its peak is left alone and peaks
+    only count the memory in use at each pause().
+    """
+
+    def __init__(self, sample_every=DEFAULT_SAMPLE_EVERY, max_overhead_mb=DEFAULT_MAX_OVERHEAD_MB):
+        self.sample_every = sample_every
+        self.max_overhead_bytes = int(max_overhead_mb * 1024 * 1024)
+        self.current = 0             # Program bytes allocated and still alive
+        self.peak = 0
+        self.events = 0
+        self.samples = []            # {'step', 'currentBytes', 'peakBytes'}
+        self.lines = {}              # (function, line) -> [hits, allocated, freed]
+        self.calls = {}              # call_id -> (function, allocated, net, peak)
+        self.stopped_at_step = None
+        self._stack = []
+        self._resumed_at = None      # Traced bytes at resume()
+        self._started = False
+
+    @classmethod
+    def from_options(cls, options):
+        """
+        Build a tracker from a request's `memory` value: true, or an object
+        with sampleEvery and maxOverheadMb. Returns None when it is off and
+        raises ValueError for bad values.
+        """
+        if options is None or options is False:
+            return None
+        if options is True:
+            return cls()
+        if not isinstance(options, dict):
+            raise ValueError("memory must be true, false or an object")
+        sample_every = options.get('sampleEvery', DEFAULT_SAMPLE_EVERY)
+        if not isinstance(sample_every, int) or isinstance(sample_every, bool) or not 1 <= sample_every <= MAX_SAMPLE_EVERY:
+            raise ValueError(f"memory.sampleEvery must be an integer between 1 and {MAX_SAMPLE_EVERY}")
+        max_overhead_mb = options.get('maxOverheadMb', DEFAULT_MAX_OVERHEAD_MB)
+        if not isinstance(max_overhead_mb, (int, float)) or isinstance(max_overhead_mb, bool) or not 0 < max_overhead_mb <= MAX_OVERHEAD_MB:
+            raise ValueError(f"memory.maxOverheadMb must be a number between 0 and {MAX_OVERHEAD_MB}")
+        return cls(sample_every, max_overhead_mb)
+
+    def start(self):
+        """Start tracemalloc, unless something else already runs it"""
+        if tracemalloc.is_tracing():
+            return
+        tracemalloc.start(1)  # One frame per trace keeps its overhead lowest
+        self._started = True
+
+    def stop(self):
+        self._resumed_at = None
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+    @property
+    def tracing(self):
+        return self._started or (self.stopped_at_step is None and tracemalloc.is_tracing())
+
+    def pause(self):
+        if self._resumed_at is None:
+            return
+        traced, peak = tracemalloc.get_traced_memory()
+        if not self._started:
+            peak = traced  # The peak belongs to whoever started tracemalloc and was not reset
+        # Highest point since resume(), in program bytes
+        high = self.current + max(0, peak - self._resumed_at)
+        self._account(traced - self._resumed_at, high)
+        self._resumed_at = None
+
+    def resume(self):
+        if not self.tracing:
+            return
+        if self._started:
+            # Only our own tracemalloc session's peak may be reset
+            tracemalloc.reset_peak()
+        self._resumed_at = tracemalloc.get_traced_memory()[0]
+
+    def _account(self, delta, high):
+        self.current += delta
+        if high > self.peak:
+            self.peak = high
+        if not self._stack:
+            return
+        frame = self._stack[-1]
+        if high > frame.peak:
+            frame.peak = high
+        if delta > 0:
+            frame.allocated += delta
+        if frame.line is not None:
+            stats = frame.line
+            if delta > 0:
+                stats[1] += delta
+            else:
+                stats[2] -= delta
+
+    def call(self, call_id, function):
+        self._stack.append(MemoryFrame(call_id, function, self.current))
+
+    def line(self, line_no, step):
+        self.events += 1
+        if self._stack:
+            frame = self._stack[-1]
+            stats = self.lines.get((frame.function, line_no))
+            if stats is None:
+                stats = self.lines[(frame.function, line_no)] = [0, 0, 0]
+            stats[0] += 1
+            frame.line = stats
+        if self.events % self.sample_every == 0:
+            self.sample(step)
+
+    def ret(self):
+        if not self._stack:
+            return
+        frame = self._stack.pop()
+        self.calls[frame.call_id] = (frame.function, frame.allocated, self.current - frame.entry, frame.peak - frame.entry)
+        if self._stack and frame.peak > self._stack[-1].peak:
+            self._stack[-1].peak = frame.peak
+
+    def sample(self, step):
+        if not self.tracing:
+            return
+        self.samples.append({'step': step, 'currentBytes': self.current, 'peakBytes': self.peak})
+        if self._started and tracemalloc.get_tracemalloc_memory() > self.max_overhead_bytes:
+            self.stopped_at_step = step
+            self.stop()
+
+    def finish(self):
+        """Close frames left open by an interrupted trace"""
+        while self._stack:
+            self.ret()
+
+    def to_dict(self):
+        """The `memory` section of a debug result"""
+        self.finish()
+        lines = [{
+            'function': function,
+            'line': line,
+            'hits': hits,
+            'allocatedBytes': allocated,
+            'freedBytes': freed
+        } for (function, line), (hits, allocated, freed) in self.lines.items()]
+        lines.sort(key=lambda stats: stats['allocatedBytes'], reverse=True)
+        return {
+            'peakBytes': self.peak,
+            'currentBytes': self.current,
+            'sampleEvery': self.sample_every,
+            'samples': self.samples,
+            'stoppedAtStep': self.stopped_at_step,
+            'lines': lines,
+            # allocatedBytes: by the call's own lines; netBytes: still alive when it
+            # returned, children included; peakBytes: highest point above its entry
+            'calls': {
+                call_id: {'function': function, 'allocatedBytes': allocated, 'netBytes': net, 'peakBytes': peak}
+                for call_id, (function, allocated, net, peak) in self.calls.items()
+            }
+        }
@@ -0,0 +1,224 @@
+import gc
+from time import perf_counter_ns
+
+# Programs traced once per tracer class to measure the cost of each kind of event:
+# a loop with only line events, and the same loop calling a function
+CALIBRATION_LOOPS = 2000
+CALIBRATION_LINES = """
+total = 0
+for i in range(%d):
+    total += i
+""" % CALIBRATION_LOOPS
+CALIBRATION_CALLS = """
+def step(i):
+    return i
+
+total = 0
+for i in range(%d):
+    total += step(i)
+""" % CALIBRATION_LOOPS
+CALIBRATION_REPEATS = 3
+
+_calibrated = {}  # Tracer class -> {event kind: overhead in ns}
+
+
+class ProfileFrame:
+    __slots__ = ('call_id', 'function', 'path', 'start', 'child', 'line', 'line_start', 'line_child')
+
+    def __init__(self, call_id, function, path, start):
+        self.call_id = call_id
+        self.function = function
+        self.path = path          # Collapsed stack, e.g. "<module>;main;fib"
+        self.start = start
+        self.child = 0            # Time spent in calls made from this frame
+        self.line = None
+        self.line_start = start
+        self.line_child = 0       # Time spent in calls made from the current line
+
+
+class Profiler:
+    """
+    Line and call timings for a traced run, on a clock that only advances
+    while the program itself runs. The tracer calls pause() when an event
+    starts and resume() when it is done with it, so snapshot and serialization
+    work is left out; the remaining fixed cost of each event (the trace
+    dispatch itself) is measured once by calibrate() and subtracted. Garbage
+    collections are left out too, since most of the garbage is the tracer's.
+    Times are per line (hits, self and total) and per call, and self times
+    are also summed per stack of function names for flame graphs.
+    """
+
+    def __init__(self, overhead_ns=None):
+        self.overhead_ns = overhead_ns or {}  # Event kind -> ns subtracted from the time before it
+        self.clock = 0               # Program time in ns
+        self.events = 0
+        self._resumed_at = None
+        self._stack = []
+        self.lines = {}              # (function, line) -> [hits, self_ns, total_ns]
+        self.calls = {}              # call_id -> (function, self_ns, total_ns)
+        self.collapsed = {}          # Stack path -> self_ns
+        self.gc_ns = 0               # Collections while the program was running
+        self._gc_started_at = None
+
+    def start(self):
+        gc.callbacks.append(self._on_gc)
+
+    def stop(self):
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+
+    def _on_gc(self, phase, info):
+        now = perf_counter_ns()
+        if phase == 'start' and self._resumed_at is not None:
+            self.clock += max(0, now - self._resumed_at)
+            self._resumed_at = None
+            self._gc_started_at = now
+        elif phase == 'stop' and self._gc_started_at is not None:
+            self.gc_ns += now - self._gc_started_at
+            self._gc_started_at = None
+            self._resumed_at = perf_counter_ns()
+
+    def pause(self, kind='line'):
+        now = perf_counter_ns()
+        if self._resumed_at is not None:
+            self.clock += max(0, now - self._resumed_at - self.overhead_ns.get(kind, 0))
+        self._resumed_at = None
+        self._gc_started_at = None
+        self.events += 1
+
+    def resume(self):
+        self._resumed_at = perf_counter_ns()
+
+    def call(self, call_id, function):
+        parent = self._stack[-1] if self._stack else None
+        path = f"{parent.path};{function}" if parent else function
+        self._stack.append(ProfileFrame(call_id, function, path, self.clock))
+
+    def line(self, line_no):
+        if not self._stack:
+            return
+        frame = self._stack[-1]
+        self._close_line(frame)
+        frame.line = line_no
+        frame.line_start = self.clock
+        frame.line_child = 0
+        stats = self.lines.get((frame.function, line_no))
+        if stats is None:
+            stats = self.lines[(frame.function, line_no)] = [0, 0, 0]
+        stats[0] += 1
+
+    def ret(self):
+        if not self._stack:
+            return
+        frame = self._stack.pop()
+        self._close_line(frame)
+        total = self.clock - frame.start
+        own = total - frame.child
+        self.calls[frame.call_id] = (frame.function, own, total)
+        self.collapsed[frame.path] = self.collapsed.get(frame.path, 0) + own
+        if self._stack:
+            parent = self._stack[-1]
+            parent.child += total
+            parent.line_child += total
+
+    def finish(self):
+        """Close frames left open by an interrupted trace"""
+        while self._stack:
+            self.ret()
+
+    def _close_line(self, frame):
+        if frame.line is None:
+            return
+        total = self.clock - frame.line_start
+        stats = self.lines[(frame.function, frame.line)]
+        stats[1] += total - frame.line_child
+        stats[2] += total
+
+    def to_dict(self):
+        """The `profile` section of a debug result"""
+        self.finish()
+        lines = [{
+            'function': function,
+            'line': line,
+            'hits': hits,
+            'selfNs': own,
+            'totalNs': total
+        } for (function, line), (hits, own, total) in self.lines.items()]
+        lines.sort(key=lambda stats: stats['selfNs'], reverse=True)
+        return {
+            'totalNs': self.clock,
+            'events': self.events,
+            'overheadNs': self.overhead_ns,
+            'gcNs': self.gc_ns,
+            'lines': lines,
+            'calls': {
+                call_id: {'function': function, 'selfNs': own, 'totalNs': total}
+                for call_id, (function, own, total) in self.calls.items()
+            },
+            # Brendan Gregg's collapsed format, in microseconds of self time
+            'collapsed': [f"{path} {own // 1000}" for path, own in sorted(self.collapsed.items())]
+        }
+
+
+def calibrate(tracer_class):
+    """
+    Fixed cost in ns that each kind of traced event adds to the profiled clock,
+    measured by timing the calibration programs with and without
+    `tracer_class` and cached per class. Must be called while no tracer is
+    running.
+    """
+    overhead = _calibrated.get(tracer_class)
+    if overhead is not None:
+        return overhead
+
+    line_cost, line_events = excess_time(tracer_class, CALIBRATION_LINES)
+    per_line = max(0, line_cost / line_events['line'])
+    call_cost, call_events = excess_time(tracer_class, CALIBRATION_CALLS)
+    # Whatever the line events don't explain is split between calls and returns
+    per_call = max(0, (call_cost - per_line * call_events['line']) / (call_events['call'] + call_events['return']))
+    overhead = _calibrated[tracer_class] = {
+        'line': int(per_line),
+        'call': int(per_call),
+        'return': int(per_call),
+        'exception': int(per_line),
+    }
+    return overhead
+
+
+def excess_time(tracer_class, source):
+    """(extra ns the tracer adds to the profiled clock, event counts by kind) for a program"""
+    code = compile(source, '<profile-calibration>', 'exec')
+    untraced = min(timed_exec(code) for _ in range(CALIBRATION_REPEATS))
+
+    best = None
+    for _ in range(CALIBRATION_REPEATS):
+        profiler = CountingProfiler()
+        tracer = tracer_class(profiler=profiler)
+        profiler.start()
+        tracer.start()
+        try:
+            exec(code, {})
+        finally:
+            tracer.stop()
+            profiler.stop()
+        if best is None or profiler.clock < best.clock:
+            best = profiler
+    return best.clock - untraced, best.kinds
+
+
+def timed_exec(code):
+    start = perf_counter_ns()
+    exec(code, {})
+    return perf_counter_ns() - start
+
+
+class CountingProfiler(Profiler):
+    """Profiler without overhead correction that counts events by kind"""
+
+    def __init__(self):
+        super().__init__()
+        self.kinds = {'call': 0, 'line': 0, 'return': 0, 'exception': 0}
+
+    def pause(self, kind='line'):
+        super().pause(kind)
+        self.kinds[kind] += 1
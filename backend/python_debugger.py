@@ -1,236 +1,805 @@
 import sys
-import tempfile
 import subprocess
 import traceback
 import json
 import io
 import uuid
+import itertools
+import inspect
+import queue
+import threading
+import time
 from contextlib import redirect_stdout, redirect_stderr
+from call_tree import CallTree, CallDag
+from snapshots import SnapshotStore, DEFAULT_KEYFRAME_INTERVAL
+from trace_buffer import TraceBuffer, STEP, RETURN, EXCEPTION, WATCHED, CAPTURED
+from budgets import TraceBudget, TraceInterrupted
+from watch import WatchList
+from serializer import ValueSerializer
+from code_cache import compile_program
+from stack_table import compact_result
+from empirical import EmpiricalSpec, measure, DEFAULT_MAX_SECONDS
+import profiler
+import memory
+from profiler import Profiler, calibrate
+from memory import MemoryTracker
+
+# Debugger code that can run inside the traced program (e.g. the profiler's gc callback)
+DEBUGGER_FILES = {__file__, profiler.__file__, memory.__file__}
+
+def is_user_code(filename):
+    """Whether a code object belongs to the debugged program rather than a library or the debugger"""
+    return not ('<frozen' in filename or '/lib/' in filename or filename in DEBUGGER_FILES)
 
 class SimpleTracer:
-    def __init__(self):
-        self.debug_states = []
+    def __init__(self, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, listener=None, budget=None, watch=None, serializer=None, profiler=None, memory=None, buffer=None):
+        self.debug_states = buffer if buffer is not None else TraceBuffer()  # Raw states, as columns
+        self.listener = listener  # Called with every recorded state, e.g. for streaming
+        self.listened = None      # Last state passed to the listener
+        self.budget = budget      # Optional TraceBudget enforced from the callbacks
+        self.watch = watch        # Optional WatchList limiting which steps capture variables
+        self.serializer = serializer or ValueSerializer()  # Size-capped previews of values
+        self.profiler = profiler  # Optional Profiler timing lines and calls between events
+        self.memory = memory      # Optional MemoryTracker attributing allocations to lines and calls
+        self.timings = {}         # Seconds spent in each pipeline stage, e.g. 'compile' and 'trace'
+        self.cancelled = False    # Set when the program is stopped; every later event stops it again
+        self.thread_id = None     # Thread being traced, between start and stop
+        self.base_frame = None    # Frame that started tracing, below the program's frames
+        self.snapshots = SnapshotStore(keyframe_interval)  # Delta-encoded step variables
         self.current_call_stack = []
         self.call_stack_ids = {}  # To track parent-child relationships
-        self.call_history = []    # To track call hierarchy
+        self.call_tree = CallTree()  # To track call hierarchy
         self.line_execution_count = {}
         self.call_id_counter = 0  # For generating unique call IDs
 
+    def cancel(self):
+        """Stop the traced program at its next event"""
+        self.cancelled = True
+
+    def interruption(self, exception=None):
+        """
+        A TraceInterrupted to raise from a callback, e.g. the TraceBudgetExceeded
+        of a budget that ran out. The tracer stays cancelled, so a program that
+        catches it is stopped again by its next event.
+        """
+        self.cancelled = True
+        if exception is None:
+            exception = TraceInterrupted()
+        exception.rearm = self.rearm
+        return exception
+
+    def rearm(self):
+        """
+        Called when the program drops a TraceInterrupted it caught. Raising it
+        from the trace function unset tracing, so install it again, with opcode
+        events on the program's frames: the instruction right after the handler
+        raises again, outside the try block that caught it.
+        """
+        if threading.get_ident() != self.thread_id:
+            return
+        frame = sys._getframe(2)  # The frame that dropped the exception
+        while frame is not None and frame is not self.base_frame:
+            if is_user_code(frame.f_code.co_filename):
+                frame.f_trace = self.trace_lines
+                frame.f_trace_opcodes = True
+            frame = frame.f_back
+        # Last, so no call made here is traced
+        sys.settrace(self.trace_calls)
+
+    def record_state(self, state):
+        """Record a state given as a dict (the callbacks add columns to debug_states directly)"""
+        self.notify(self.debug_states.append(state))
+
+    def notify(self, step):
+        if self.listener is not None:
+            self.listened = self.debug_states[step]
+            self.listener(self.listened)
+
+    def add_output(self, output, error):
+        """Attach the captured output to the last state, including the listener's copy"""
+        fields = {'output': output}
+        if error:
+            fields['error_output'] = error
+        self.debug_states.update(-1, fields)
+        if self.listened is not None:
+            self.listened.update(fields)
+
+    def start(self):
+        """Install the tracer on the current thread"""
+        self.thread_id = threading.get_ident()
+        self.base_frame = sys._getframe(1)
+        sys.settrace(self.trace_calls)
+
+    def stop(self):
+        sys.settrace(None)
+        self.thread_id = None
+        self.base_frame = None
+
     def trace_calls(self, frame, event, arg):
         """Trace function calls"""
+        if self.cancelled:
+            raise self.interruption()
+        
         if event == 'call':
-            func_name = frame.f_code.co_name
-            line_no = frame.f_lineno
-            filename = frame.f_code.co_filename
-            
             # Skip library code
-            if '<frozen' in filename or '/lib/' in filename:
+            if not is_user_code(frame.f_code.co_filename):
                 return None
-            
-            # Generate unique call ID for this function call
-            self.call_id_counter += 1
-            call_id = f"{func_name}_{self.call_id_counter}"
-            
-            # Determine parent call ID
-            parent_id = None
-            if self.current_call_stack:
-                parent_id = self.current_call_stack[-1].get('call_id')
-            
-            # Add to call stack
-            call_info = {
-                'function': func_name,
-                'line': line_no,
-                'file': filename,
-                'call_id': call_id,
-                'parent_id': parent_id,
-                'stack_depth': len(self.current_call_stack)
-            }
-            
-            self.current_call_stack.append(call_info)
-            self.call_history.append({
-                'call_id': call_id,
-                'parent_id': parent_id,
-                'function': func_name,
-                'entry_line': line_no,
-                'stack_depth': len(self.current_call_stack) - 1,
-                'children': []
-            })
-            
-            # Update parent's children list
-            if parent_id:
-                for call in self.call_history:
-                    if call['call_id'] == parent_id:
-                        call['children'].append(call_id)
-                        break
+            try:
+                self.on_call(frame)
+            except TraceInterrupted:
+                # Not bound to a name: a frame holding it would keep it alive after the program drops it
+                raise self.interruption(sys.exc_info()[1])
                 
         return self.trace_lines
         
     def trace_lines(self, frame, event, arg):
         """Trace line execution"""
-        if event == 'line':
-            filename = frame.f_code.co_filename
+        if self.cancelled:
+            raise self.interruption()
+        
+        try:
+            if event == 'line':
+                # Skip library code
+                if not is_user_code(frame.f_code.co_filename):
+                    return
+                self.on_line(frame)
+            elif event == 'return':
+                self.on_return(frame, arg)
+            elif event == 'exception':
+                self.on_exception(frame, arg)
             
-            # Skip library code
-            if '<frozen' in filename or '/lib/' in filename:
-                return
-                
+            self.check_budget()
+        except TraceInterrupted:
+            raise self.interruption(sys.exc_info()[1])
+        return self.trace_lines
+
+    def check_budget(self):
+        # At most one state is recorded per event
+        if self.budget is not None and len(self.debug_states) > self.budget.events:
+            self.budget.check_event(self.snapshots.bytes_recorded)
+
+    def on_call(self, frame):
+        """A function of the debugged program was entered"""
+        if self.profiler is not None:
+            self.profiler.pause('call')
+        if self.memory is not None:
+            self.memory.pause()
+        func_name = frame.f_code.co_name
+        line_no = frame.f_lineno
+        filename = frame.f_code.co_filename
+        
+        # Generate unique call ID for this function call
+        self.call_id_counter += 1
+        call_id = f"{func_name}_{self.call_id_counter}"
+        
+        # Determine parent call ID
+        parent_id = None
+        parent_index = -1
+        if self.current_call_stack:
+            parent_id = self.current_call_stack[-1].get('call_id')
+            parent_index = self.current_call_stack[-1]['index']
+        
+        # Add to call stack
+        call_info = {
+            'function': func_name,
+            'line': line_no,
+            'file': filename,
+            'call_id': call_id,
+            'parent_id': parent_id,
+            'stack_depth': len(self.current_call_stack),
+            'index': self.debug_states.add_call(call_id, parent_index, func_name, line_no)  # In the buffer's call table
+        }
+        
+        self.current_call_stack.append(call_info)
+        self.call_tree.add_call(
+            call_id,
+            parent_id,
+            func_name,
+            line_no,
+            len(self.current_call_stack) - 1,
+            len(self.debug_states),
+            self.capture_args(frame)
+        )
+        if self.memory is not None:
+            self.memory.call(call_id, func_name)
+            self.memory.resume()
+        if self.profiler is not None:
+            self.profiler.call(call_id, func_name)
+            self.profiler.resume()
+        
+        if self.budget is not None:
+            self.budget.check_depth(len(self.current_call_stack))
+
+    def on_line(self, frame, line_no=None):
+        """A new line of the debugged program is about to run"""
+        if self.profiler is not None:
+            self.profiler.pause('line')
+        if self.memory is not None:
+            self.memory.pause()
+        filename = frame.f_code.co_filename
+        if line_no is None:
             line_no = frame.f_lineno
+        func_name = frame.f_code.co_name
+        
+        # Collect local variables, or only what the watch list asks for where it matches
+        if self.watch is None:
+            variables = self.capture_variables(frame.f_locals.items())
+        elif self.watch.matches(frame, line_no):
+            variables = self.capture_variables(self.watch.capture(frame))
+        else:
+            variables = None
+        
+        # Get current call info (the call stack itself is rebuilt from the call when needed)
+        current_call_info = self.current_call_stack[-1] if self.current_call_stack else None
+        call_id = current_call_info.get('call_id') if current_call_info else None
+        call_index = current_call_info['index'] if current_call_info else -1
+        
+        # Add to debug states (variables are stored as a delta against the previous step)
+        snapshot = -1 if variables is None else self.snapshots.record(call_id, variables)
+        flags = 0
+        if self.watch is not None:
+            flags = WATCHED | (CAPTURED if variables is not None else 0)
+        step = self.debug_states.add(line_no, func_name, call_index, len(self.current_call_stack), STEP, snapshot, flags)
+        if self.listener is not None:
+            self.notify(step)
+        
+        # Track line execution count (for handling recursion)
+        line_key = f"{filename}:{line_no}"
+        self.line_execution_count[line_key] = self.line_execution_count.get(line_key, 0) + 1
+        if self.memory is not None:
+            self.memory.line(line_no, step)
+            self.memory.resume()
+        if self.profiler is not None:
+            self.profiler.line(line_no)
+            self.profiler.resume()
+
+    def capture_variables(self, items):
+        """Serializable copy of (name, value) pairs"""
+        variables = {}
+        serialize = self.serializer.serialize
+        for name, value in items:
+            try:
+                # Convert values to capped previews to ensure they're serializable
+                variables[name] = serialize(value)
+            except:
+                variables[name] = "Error: Unparseable value"
+        return variables
+
+    def capture_args(self, frame):
+        """Argument values (including *args and **kwargs) of a frame that was just entered"""
+        code = frame.f_code
+        count = code.co_argcount + code.co_kwonlyargcount
+        count += bool(code.co_flags & inspect.CO_VARARGS) + bool(code.co_flags & inspect.CO_VARKEYWORDS)
+        if not count:
+            return {}
+        frame_locals = frame.f_locals
+        # Comprehensions take their iterator as the hidden argument '.0'
+        names = [name for name in code.co_varnames[:count] if name.isidentifier() and name in frame_locals]
+        return self.capture_variables((name, frame_locals[name]) for name in names)
+
+    def on_return(self, frame, arg):
+        """A traced frame is returning `arg` (None when unwinding)"""
+        if self.profiler is not None:
+            self.profiler.pause('return')
+        if self.memory is not None:
+            self.memory.pause()
+        if self.current_call_stack:
             func_name = frame.f_code.co_name
+            line_no = frame.f_lineno
             
-            # Collect local variables
-            variables = {}
-            for name, value in frame.f_locals.items():
+            # Collect return value
+            return_value = None
+            if arg is not None:
                 try:
-                    # Convert values to strings to ensure they're serializable
-                    if isinstance(value, (int, float, bool, str, type(None))):
-                        variables[name] = value
-                    elif hasattr(value, '__dict__'):
-                        variables[name] = str(value)
-                    else:
-                        variables[name] = repr(value)
+                    return_value = self.serializer.serialize(arg, use_str=False)
                 except:
-                    variables[name] = "Error: Unparseable value"
-            
-            # Get current call info
-            current_call_info = self.current_call_stack[-1] if self.current_call_stack else None
-            call_id = current_call_info.get('call_id') if current_call_info else None
-            parent_id = current_call_info.get('parent_id') if current_call_info else None
-            stack_depth = len(self.current_call_stack)
+                    return_value = "Error: Unparseable return value"
             
-            # Get full call stack info
-            call_stack = []
-            for call in self.current_call_stack:
-                call_stack.append({
-                    'function': call['function'],
-                    'line': call['line'],
-                    'call_id': call['call_id'],
-                    'parent_id': call['parent_id'],
-                })
+            # Get call info before popping from stack
+            current_call_info = self.current_call_stack[-1]
+            call_id = current_call_info.get('call_id')
+            stack_depth = len(self.current_call_stack) - 1  # -1 because we're returning
             
-            # Add to debug states
-            self.debug_states.append({
-                'lineNumber': line_no,
-                'functionName': func_name,
-                'variables': variables,
-                'callStack': call_stack,
-                'callId': call_id,
-                'parentId': parent_id,
-                'stackDepth': stack_depth,
-                'eventType': 'step'
-            })
+            # Add return event
+            step = self.debug_states.add(
+                line_no, func_name, current_call_info['index'], stack_depth, RETURN,
+                extras={'variables': {'return_value': return_value}, 'returnValue': return_value}
+            )
+            if self.listener is not None:
+                self.notify(step)
+            self.call_tree.finish_call(call_id, step, return_value)
             
-            # Track line execution count (for handling recursion)
-            line_key = f"{filename}:{line_no}"
-            self.line_execution_count[line_key] = self.line_execution_count.get(line_key, 0) + 1
-        
-        elif event == 'return':
-            if self.current_call_stack:
-                func_name = frame.f_code.co_name
-                line_no = frame.f_lineno
-                
-                # Collect return value
-                return_value = None
-                if arg is not None:
-                    try:
-                        if isinstance(arg, (int, float, bool, str, type(None))):
-                            return_value = arg
-                        else:
-                            return_value = repr(arg)
-                    except:
-                        return_value = "Error: Unparseable return value"
-                
-                # Get call info before popping from stack
-                current_call_info = self.current_call_stack[-1]
-                call_id = current_call_info.get('call_id')
-                parent_id = current_call_info.get('parent_id')
-                stack_depth = len(self.current_call_stack) - 1  # -1 because we're returning
-                
-                # Add return event
-                self.debug_states.append({
-                    'lineNumber': line_no,
-                    'functionName': func_name,
-                    'variables': {'return_value': return_value},
-                    'callStack': list(self.current_call_stack),  # Copy before popping
-                    'callId': call_id,
-                    'parentId': parent_id,
-                    'stackDepth': stack_depth,
-                    'eventType': 'return',
-                    'returnValue': return_value
-                })
-                
-                # Now pop from call stack
-                self.current_call_stack.pop()
-                
-        elif event == 'exception':
-            exc_type, exc_value, exc_traceback = arg
-            variables = {'exception_type': exc_type.__name__, 'exception_message': str(exc_value)}
-            
-            # Get current call info
-            current_call_info = self.current_call_stack[-1] if self.current_call_stack else None
-            call_id = current_call_info.get('call_id') if current_call_info else None
-            parent_id = current_call_info.get('parent_id') if current_call_info else None
-            stack_depth = len(self.current_call_stack)
-            
-            self.debug_states.append({
-                'lineNumber': frame.f_lineno,
-                'functionName': frame.f_code.co_name,
-                'variables': variables,
-                'callStack': list(self.current_call_stack),
-                'callId': call_id,
-                'parentId': parent_id,
-                'stackDepth': stack_depth,
-                'eventType': 'exception',
-                'error': True
-            })
+            # Now pop from call stack
+            self.current_call_stack.pop()
+            self.snapshots.end_frame(call_id)
+            if self.memory is not None:
+                self.memory.ret()
+            if self.profiler is not None:
+                self.profiler.ret()
+        if self.memory is not None:
+            self.memory.resume()
+        if self.profiler is not None:
+            self.profiler.resume()
+
+    def on_exception(self, frame, arg):
+        """An exception was raised in a traced frame; `arg` is (type, value, traceback)"""
+        if self.profiler is not None:
+            self.profiler.pause('exception')
+        if self.memory is not None:
+            self.memory.pause()
+        exc_type, exc_value, exc_traceback = arg
+        variables = {'exception_type': exc_type.__name__, 'exception_message': self.serializer.text(str(exc_value))}
         
-        return self.trace_lines
+        # Get current call info
+        current_call_info = self.current_call_stack[-1] if self.current_call_stack else None
+        call_index = current_call_info['index'] if current_call_info else -1
+        
+        step = self.debug_states.add(
+            frame.f_lineno, frame.f_code.co_name, call_index, len(self.current_call_stack), EXCEPTION,
+            extras={'variables': variables, 'error': True}
+        )
+        if self.listener is not None:
+            self.notify(step)
+        if self.memory is not None:
+            self.memory.resume()
+        if self.profiler is not None:
+            self.profiler.resume()
+
+    def variables_at(self, step):
+        """Full variables of a recorded step, rebuilt on demand"""
+        return state_variables(self.debug_states[step], self.snapshots)
+
+# sys.monitoring (PEP 669) is available from Python 3.12
+MONITORING_AVAILABLE = hasattr(sys, 'monitoring')
+TRACER_ENGINES = ('auto', 'settrace', 'monitoring')
+
+class MonitoringTracer(SimpleTracer):
+    """
+    SimpleTracer driven by sys.monitoring instead of sys.settrace.
+    Only function starts and exceptions are watched globally. Each code object
+    is classified once: library code gets DISABLE and never reports again, while
+    line, jump and return events are switched on locally for the debugged
+    program's own code. Events are mapped onto the settrace ones, so both
+    engines record exactly the same states.
+    """
+
+    def __init__(self, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, listener=None, budget=None, watch=None, serializer=None, profiler=None, memory=None, buffer=None):
+        super().__init__(keyframe_interval, listener, budget, watch, serializer, profiler, memory, buffer)
+        self.tool_id = None
+        self.callbacks = {}
+        self.user_code = {}     # Code object -> whether its frames are traced
+        self.offset_lines = {}  # (code, offset) -> line, for backward jumps
+
+    def start(self):
+        monitoring = sys.monitoring
+        events = monitoring.events
+        free = free_monitoring_tools()
+        if not free:
+            raise RuntimeError("No free sys.monitoring tool id")
+        self.tool_id = monitoring.DEBUGGER_ID if monitoring.DEBUGGER_ID in free else free[0]
+        self.thread_id = threading.get_ident()
+        monitoring.use_tool_id(self.tool_id, 'visual-debugger')
+
+        self.callbacks = {
+            events.PY_START: self._on_start,
+            events.PY_RESUME: self._on_start,
+            events.PY_THROW: self._on_start,
+            events.LINE: self._on_line,
+            events.JUMP: self._on_jump,
+            events.PY_RETURN: self._on_return,
+            events.PY_YIELD: self._on_return,
+            events.PY_UNWIND: self._on_unwind,
+            events.RAISE: self._on_raise,
+            events.STOP_ITERATION: self._on_raise,
+        }
+        for event, callback in self.callbacks.items():
+            monitoring.register_callback(self.tool_id, event, callback)
+        monitoring.set_events(self.tool_id, events.PY_START | events.PY_THROW | events.PY_UNWIND | events.RAISE)
+
+    def stop(self):
+        if self.tool_id is None:
+            return
+        monitoring = sys.monitoring
+        self._disable()
+        for event in self.callbacks:
+            monitoring.register_callback(self.tool_id, event, None)
+        monitoring.free_tool_id(self.tool_id)
+        self.tool_id = None
+        self.thread_id = None
+
+    def rearm(self):
+        pass  # Events stay on after an interruption, the next one raises again
+
+    def _disable(self):
+        # Like settrace after an error in the trace function, nothing more is recorded
+        monitoring = sys.monitoring
+        monitoring.set_events(self.tool_id, 0)
+        for code, traced in self.user_code.items():
+            if traced:
+                monitoring.set_local_events(self.tool_id, code, 0)
+
+    def _enter(self):
+        # Events from other threads are ignored, settrace only covers the tracing thread
+        if threading.get_ident() != self.thread_id:
+            return False
+        if self.cancelled:
+            raise self.interruption()
+        return True
 
-def debug_python(code, input_data=None):
-    """Debug Python code using sys.settrace"""
+    def _handle(self, handler, *args):
+        try:
+            handler(*args)
+            self.check_budget()
+        except TraceInterrupted:
+            raise self.interruption(sys.exc_info()[1])
+        except BaseException:
+            self._disable()
+            raise
+
+    def _on_start(self, code, offset, *exception):
+        if threading.get_ident() != self.thread_id:
+            return None
+        traced = self.user_code.get(code)
+        if traced is None:
+            traced = self.user_code[code] = is_user_code(code.co_filename)
+            if not traced:
+                return sys.monitoring.DISABLE
+            events = sys.monitoring.events
+            sys.monitoring.set_local_events(
+                self.tool_id, code,
+                events.PY_RESUME | events.PY_RETURN | events.PY_YIELD |
+                events.LINE | events.JUMP | events.STOP_ITERATION
+            )
+        elif not traced:
+            return sys.monitoring.DISABLE
+        # Library and debugger code (e.g. the stop() after an interruption) is never interrupted
+        if self.cancelled:
+            raise self.interruption()
+        try:
+            self.on_call(sys._getframe(1))
+        except TraceInterrupted:
+            raise self.interruption(sys.exc_info()[1])
+        except BaseException:
+            self._disable()
+            raise
+        return None
+
+    def _on_line(self, code, line_no):
+        if self._enter():
+            self._handle(self.on_line, sys._getframe(1), line_no)
+
+    def _on_jump(self, code, offset, destination):
+        # settrace also reports a line when a loop jumps back within the same line
+        if destination > offset:
+            return sys.monitoring.DISABLE
+        line_no = self._line_at(code, destination)
+        if line_no != self._line_at(code, offset):
+            return sys.monitoring.DISABLE
+        if self._enter():
+            self._handle(self.on_line, sys._getframe(1), line_no)
+        return None
+
+    def _on_return(self, code, offset, value):
+        if self._enter():
+            self._handle(self.on_return, sys._getframe(1), value)
+
+    def _on_unwind(self, code, offset, exception):
+        # Once stopped, the exception on its way out is left alone
+        if self.user_code.get(code) and not self.cancelled and self._enter():
+            self._handle(self.on_return, sys._getframe(1), None)
+
+    def _on_raise(self, code, offset, exception):
+        if self.user_code.get(code) and not self.cancelled and self._enter():
+            arg = (type(exception), exception, exception.__traceback__)
+            self._handle(self.on_exception, sys._getframe(1), arg)
+
+    def _line_at(self, code, offset):
+        key = (code, offset)
+        line_no = self.offset_lines.get(key)
+        if line_no is None:
+            for start, end, line_no in code.co_lines():
+                if start <= offset < end:
+                    break
+            else:
+                line_no = None
+            self.offset_lines[key] = line_no
+        return line_no
+
+def free_monitoring_tools():
+    return [tool for tool in range(6) if sys.monitoring.get_tool(tool) is None]
+
+def create_tracer(engine='auto', **kwargs):
+    """
+    Build a tracer for the given engine: 'settrace', 'monitoring' (Python 3.12+)
+    or 'auto', which uses sys.monitoring when it is available.
+    """
+    if engine not in TRACER_ENGINES:
+        raise ValueError(f"Unknown tracer engine: {engine}")
+    if engine == 'monitoring' and not MONITORING_AVAILABLE:
+        raise ValueError("The monitoring engine needs Python 3.12 or newer")
+    if engine == 'settrace' or not MONITORING_AVAILABLE:
+        return SimpleTracer(**kwargs)
+    if engine == 'auto' and not free_monitoring_tools():
+        # Another tool (or a concurrent trace) holds every id
+        return SimpleTracer(**kwargs)
+    return MonitoringTracer(**kwargs)
+
+def state_variables(state, snapshots=None):
+    """Return the variables of a raw debug state, rebuilding them from snapshots if needed"""
+    if 'variables' in state:
+        return state['variables']
+    return snapshots.materialize(state['snapshot'])
+
+def debug_python(code, input_data=None, limits=None, engine='auto', watch=None, values=None, compact=False, empirical=None, profile=False, memory=None, call_dag=None):
+    """
+    Debug Python code using sys.settrace or sys.monitoring (see create_tracer).
+    `limits` may set max_events, max_depth, max_seconds and max_bytes; when one
+    is reached the partial trace is returned with a `truncated` description.
+    Its spill_steps moves the raw trace to a memory-mapped file once it gets
+    longer (see TraceBuffer).
+    `watch` is an optional watch spec (see WatchList.from_spec) that limits
+    variable capture to matching steps, and `values` sets the preview limits
+    and format of variable values (see ValueSerializer.from_options).
+    With `compact`, call stacks are sent once in a `stackTable` and states
+    refer to them by `stackId` (see stack_table.compact_states).
+    `empirical` (see EmpiricalSpec.from_spec) adds measured growth classes
+    to the complexity analysis, `profile` adds a `profile` section with
+    line and call timings (see Profiler), and `memory` a `memory` section
+    with allocations per line and call (see MemoryTracker.from_options).
+    Every result has `timings` (milliseconds per stage) and `stateCounts`,
+    and a `callIndex` of the calls against the states (see
+    CallTree.index_states); callHierarchy entries carry the call's `args`.
+    With `call_dag` (see CallDag.from_options) both are replaced by a
+    `callDag` that merges repeated subtrees.
+    """
     
-    complexity = analyze_complexity(code)
-    # Save code to a temporary file
-    with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as temp_file:
-        temp_file.write(code)
-        temp_filename = temp_file.name
+    started = time.perf_counter()
+    complexity = analyze_complexity(code, parsed_tree(code))
+    complexity_seconds = time.perf_counter() - started
+    spec = EmpiricalSpec.from_spec(empirical)
+    dag = CallDag.from_options(call_dag)
+    
+    # Set up the tracer
+    tracer = create_tracer(
+        engine,
+        budget=TraceBudget.from_limits(limits),
+        watch=WatchList.from_spec(watch),
+        serializer=ValueSerializer.from_options(values),
+        buffer=TraceBuffer.from_limits(limits)
+    )
+    if profile:
+        tracer.profiler = Profiler(calibrate(type(tracer)))
+    tracer.memory = MemoryTracker.from_options(memory)
+    tracer.timings['complexity'] = complexity_seconds
+    run_traced(code, input_data, tracer)
+    if spec is not None:
+        started = time.perf_counter()
+        complexity['empirical'] = empirical_complexity(code, input_data, spec, limits)
+        tracer.timings['empirical'] = time.perf_counter() - started
+    
+    # Filter debug states to reduce noise and simplify them to the essential information
+    started = time.perf_counter()
+    simplified_states = process_debug_states(tracer.debug_states, tracer.snapshots)
+    tracer.timings['states'] = time.perf_counter() - started
+    
+    # Add call hierarchy information and complexity analysis
+    started = time.perf_counter()
+    result = {'debugStates': simplified_states}
+    result.update(call_sections(tracer.call_tree, [state.get('callId') for state in simplified_states], dag))
+    tracer.timings['calls'] = time.perf_counter() - started
+    result['complexity'] = complexity  # include the time/space analysis
+    result['truncated'] = tracer.budget.truncation() if tracer.budget else None
+    if tracer.profiler is not None:
+        result['profile'] = tracer.profiler.to_dict()
+    if tracer.memory is not None:
+        result['memory'] = tracer.memory.to_dict()
+    result['stateCounts'] = {'raw': len(tracer.debug_states), 'kept': len(simplified_states)}
+    tracer.debug_states.close()
+
+    
+    print(f"Debug completed - {len(simplified_states)} states")
+    if compact:
+        started = time.perf_counter()
+        result = compact_result(result)
+        tracer.timings['compact'] = time.perf_counter() - started
+    result['timings'] = timings_ms(tracer.timings)
+    return result
+
+def call_sections(call_tree, state_call_ids, dag=None):
+    """callHierarchy and callIndex of a result, or only callDag when `dag` is set"""
+    if dag is not None:
+        return {'callDag': dag.build(call_tree, state_call_ids)}
+    call_index = call_tree.index_states(state_call_ids)  # Fills in the index fields of the hierarchy
+    return {'callHierarchy': call_tree.to_hierarchy(), 'callIndex': call_index}
+
+def timings_ms(timings):
+    """Stage timings in seconds as rounded milliseconds, for responses"""
+    return {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()}
+
+STREAM_CHUNK_SIZE = 50
+STREAM_FLUSH_INTERVAL = 0.05  # Seconds before a partial chunk is sent
+STREAM_QUEUE_SIZE = 10000     # Raw states buffered before the traced program waits
+
+_STREAM_END = object()
+
+def stream_debug_python(code, input_data=None, limits=None, engine='auto', watch=None, values=None, empirical=None, profile=False, memory=None, call_dag=None, chunk_size=STREAM_CHUNK_SIZE, flush_interval=STREAM_FLUSH_INTERVAL):
+    """
+    Debug Python code while streaming simplified states as they are produced.
+    Yields {'type': 'states', ...} frames in chunks, followed by a final
+    {'type': 'summary', ...} frame with complexity, call hierarchy and output.
+    Closing the generator stops the traced program.
+    """
+    started = time.perf_counter()
+    complexity = analyze_complexity(code, parsed_tree(code))
+    complexity_seconds = time.perf_counter() - started
+    spec = EmpiricalSpec.from_spec(empirical)
+    dag = CallDag.from_options(call_dag)
+    raw_states = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    run_result = {}
+    
+    def put(item):
+        # Block while the consumer catches up, unless it has gone away
+        while True:
+            try:
+                raw_states.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if tracer.cancelled:
+                    raise TraceInterrupted()
+    
+    tracer = create_tracer(
+        engine,
+        listener=put,
+        budget=TraceBudget.from_limits(limits),
+        watch=WatchList.from_spec(watch),
+        serializer=ValueSerializer.from_options(values),
+        buffer=TraceBuffer.from_limits(limits)
+    )
+    if profile:
+        tracer.profiler = Profiler(calibrate(type(tracer)))
+    tracer.memory = MemoryTracker.from_options(memory)
+    tracer.timings['complexity'] = complexity_seconds
+    
+    def run():
+        try:
+            run_result['output'], run_result['error'] = run_traced(code, input_data, tracer)
+        finally:
+            try:
+                put(_STREAM_END)
+            except TraceInterrupted:
+                pass
+    
+    def produced_states():
+        while True:
+            try:
+                item = raw_states.get(timeout=flush_interval)
+            except queue.Empty:
+                yield None  # Heartbeat so partial chunks still get sent
+                continue
+            if item is _STREAM_END:
+                return
+            yield item
+    
+    thread = threading.Thread(target=run, name='debug-stream', daemon=True)
+    thread.start()
+    
+    try:
+        simplified = iter_simplify_debug_states(
+            iter_filter_debug_states(produced_states(), tracer.snapshots),
+            tracer.snapshots
+        )
+        
+        chunk = []
+        sent = 0
+        state_call_ids = []  # For the call index in the summary
+        last_flush = time.monotonic()
+        for state in simplified:
+            if state is not None:
+                chunk.append(state)
+                state_call_ids.append(state.get('callId'))
+            if chunk and (len(chunk) >= chunk_size or time.monotonic() - last_flush >= flush_interval):
+                yield {'type': 'states', 'from': sent, 'states': chunk}
+                sent += len(chunk)
+                chunk = []
+                last_flush = time.monotonic()
+        
+        if chunk:
+            yield {'type': 'states', 'from': sent, 'states': chunk}
+            sent += len(chunk)
+        
+        thread.join()
+        if spec is not None:
+            started = time.perf_counter()
+            complexity['empirical'] = empirical_complexity(code, input_data, spec, limits)
+            tracer.timings['empirical'] = time.perf_counter() - started
+        call_tree = tracer.call_tree
+        summary = {
+            'type': 'summary',
+            'totalStates': sent,
+            'totalCalls': len(call_tree),
+            'maxStackDepth': max((node.stack_depth for node in call_tree), default=0)
+        }
+        started = time.perf_counter()
+        summary.update(call_sections(call_tree, state_call_ids, dag))
+        tracer.timings['calls'] = time.perf_counter() - started
+        summary['complexity'] = complexity
+        summary['output'] = run_result.get('output', '')
+        summary['errorOutput'] = run_result.get('error', '')
+        summary['truncated'] = tracer.budget.truncation() if tracer.budget else None
+        if tracer.profiler is not None:
+            summary['profile'] = tracer.profiler.to_dict()
+        if tracer.memory is not None:
+            summary['memory'] = tracer.memory.to_dict()
+        summary['stateCounts'] = {'raw': len(tracer.debug_states), 'kept': sent}
+        summary['timings'] = timings_ms(tracer.timings)
+        yield summary
+    finally:
+        # Stops the program if the client went away before it finished
+        tracer.cancel()
+        if not thread.is_alive():
+            tracer.debug_states.close()
+
+def empirical_complexity(code, input_data, spec, limits=None):
+    """Step counts and stack depths of spec.function over its input sizes, with fitted growth classes"""
+    try:
+        program = compile_program(code)
+    except (SyntaxError, ValueError) as e:
+        return {'function': spec.function, 'samples': [], 'time': None, 'space': None, 'error': str(e)}
+    max_seconds = (limits or {}).get('max_seconds') or DEFAULT_MAX_SECONDS
+    return measure(program, spec, input_data, is_user_code, max_seconds=max_seconds)
 
+def run_traced(code, input_data, tracer):
+    """Run the code under `tracer`, attaching the captured output to the last state"""
     # Capture stdout and stderr
     output_buffer = io.StringIO()
     error_buffer = io.StringIO()
     
-    # Set up the tracer
-    tracer = SimpleTracer()
-    
     # Run the code with the tracer
+    trace_started = None
     try:
         with redirect_stdout(output_buffer), redirect_stderr(error_buffer):
             # Prepare input if provided
             if input_data:
                 sys.stdin = io.StringIO(input_data)
             
+            # Compile before tracing starts, once per distinct source
+            started = time.perf_counter()
+            program = compile_program(code)
+            tracer.timings['compile'] = time.perf_counter() - started
+            global_vars = {'__file__': program.filename}
+            
             # Set up the trace function
-            sys.settrace(tracer.trace_calls)
+            if tracer.budget is not None:
+                tracer.budget.start()
+            if tracer.profiler is not None:
+                tracer.profiler.start()
+            if tracer.memory is not None:
+                tracer.memory.start()
+                tracer.memory.resume()
+            trace_started = time.perf_counter()
+            tracer.start()
             
             # Execute the code
-            with open(temp_filename, 'r') as f:
-                code_obj = compile(f.read(), temp_filename, 'exec')
-                global_vars = {'__file__': temp_filename}
-                exec(code_obj, global_vars)
+            exec(program.code, global_vars)
             
             # Turn off tracing
-            sys.settrace(None)
+            tracer.stop()
             
+    except TraceInterrupted:
+        # Tracing was cancelled or ran out of budget, keep the partial trace as it is
+        tracer.stop()
     except Exception as e:
         # Capture any exceptions
         error_msg = traceback.format_exc()
         print(f"Error executing code: {error_msg}")
+        tracer.stop()
         
         # Add the error state if it hasn't been added by the tracer
         if not tracer.debug_states or not tracer.debug_states[-1].get('error'):
-            tracer.debug_states.append({
+            tracer.record_state({
                 'lineNumber': -1,
                 'functionName': 'main',
-                'variables': {'exception': str(e)},
+                'variables': {'exception': tracer.serializer.text(str(e))},
                 'callStack': [],
                 'callId': None,
                 'parentId': None,
@@ -239,15 +808,21 @@ def debug_python(code, input_data=None):
                 'error': True,
                 'errorDetails': {
                     'type': type(e).__name__,
-                    'message': str(e),
+                    'message': tracer.serializer.text(str(e)),
                     'traceback': error_msg
                 }
             })
     finally:
         # Clean up
-        import os
-        os.unlink(temp_filename)
-        sys.settrace(None)
+        tracer.stop()
+        if tracer.budget is not None:
+            tracer.budget.stop()
+        if tracer.profiler is not None:
+            tracer.profiler.stop()
+        if tracer.memory is not None:
+            tracer.memory.stop()
+        if trace_started is not None:
+            tracer.timings['trace'] = time.perf_counter() - trace_started
         
         # Reset stdin if we modified it
         if input_data:
@@ -259,167 +834,334 @@ def debug_python(code, input_data=None):
     
     # Add output to the last debug state
     if tracer.debug_states:
-        tracer.debug_states[-1]['output'] = output
-        if error:
-            tracer.debug_states[-1]['error_output'] = error
+        tracer.add_output(output, error)
+
+    return output, error
+
+def process_debug_states(debug_states, snapshots=None):
+    """
+    Filter, de-duplicate and simplify raw debug states in a single pass.
+    Gives the same result as simplify_debug_states(filter_debug_states(...)),
+    but each state is visited a constant number of times, its variables are
+    rebuilt at most once, and steps that share a call stack share its
+    simplified copy.
+    """
+    # Few states or an error: the selection is small, use the reference steps
+    if len(debug_states) <= 10:
+        return simplify_debug_states(debug_states, snapshots)
+    if has_error_states(debug_states):
+        return simplify_debug_states(select_error_states(debug_states), snapshots)
     
-    # Filter debug states to reduce noise
-    filtered_states = filter_debug_states(tracer.debug_states)
+    # No error states, so there is nothing to de-duplicate
+    simplified = []
+    stack_cache = [None, None]
     
-    # Simplify states to only include essential information
-    simplified_states = simplify_debug_states(filtered_states)
+    prev_line = None
+    prev_func = None
+    prev_vars = {}
+    prev_event_type = None
+    last_kept = None
+    pending = None
+    pending_vars = None
     
-    # Add call hierarchy information
-    # Add call hierarchy information and complexity analysis
-    result = {
-    'debugStates': simplified_states,
-    'callHierarchy': tracer.call_history,
-    'complexity': complexity  # include the time/space analysis
-}
-
+    def keep(state):
+        nonlocal prev_line, prev_func, prev_vars, prev_event_type, pending_vars
+        line = state['lineNumber']
+        func = state['functionName']
+        event_type = state.get('eventType', 'step')
+        
+        # Same rules as iter_filter_debug_states
+        keep_state = (
+            event_type != prev_event_type or
+            event_type in ('return', 'exception') or
+            line != prev_line or
+            func != prev_func or
+            last_kept is None
+        )
+        if not keep_state:
+            pending_vars = state_variables(state, snapshots)
+            keep_state = has_vars_changed(prev_vars, pending_vars)
+        
+        if keep_state:
+            if pending_vars is None:
+                pending_vars = state_variables(state, snapshots)
+            prev_line = line
+            prev_func = func
+            prev_vars = pending_vars
+            prev_event_type = event_type
+        return keep_state
     
-    print(f"Debug completed - {len(simplified_states)} states")
-    return result
+    def emit(state):
+        simple_state = simplify_state(state, snapshots, pending_vars, stack_cache)
+        if simple_state is not None:
+            simplified.append(simple_state)
+    
+    for state in debug_states:
+        if pending is not None and keep(pending):
+            last_kept = pending
+            emit(pending)
+        pending = state
+        pending_vars = None
+    
+    # Always include the last state
+    if keep(pending) or last_kept != pending:
+        emit(pending)
+    
+    return simplified
 
-def filter_debug_states(debug_states):
+def filter_debug_states(debug_states, snapshots=None):
     """Filter debug states to reduce noise and focus on important states"""
     if len(debug_states) <= 10:  # If there are very few states, return them all
         return debug_states
     
     # Check if there's an error state
-    has_error = any(state.get('error', False) for state in debug_states)
+    has_error = has_error_states(debug_states)
     
     if has_error:
-        # For error cases, only keep the most relevant states
-        filtered = []
-        user_code_only = []
-        
-        # First, filter to only keep user code (not traceback/internal code)
-        for state in debug_states:
-            # Skip internal Python functions used for traceback
-            if state['functionName'] in ['format_exc', 'format_exception', 'lazycache', 'checkcache']:
-                continue
-                
-            # Skip Python machinery
-            if state['functionName'].startswith('_') or state['functionName'] in ['<listcomp>', 'decode', '__init__']:
-                continue
-                
-            # Keep user code states
-            user_code_only.append(state)
-        
-        # For error cases, just take first few states and the error state
-        for i, state in enumerate(user_code_only):
-            # Keep the first few states of execution
-            if i < 5:
-                filtered.append(state)
-            
-            # Always keep error states
-            if state.get('error', False):
-                filtered.append(state)
-        
-        return filtered
+        return select_error_states(debug_states)
     
     # For non-error cases, use normal filtering logic
+    return list(iter_filter_debug_states(debug_states, snapshots))
+
+def has_error_states(debug_states):
+    """Whether any state is an error state (a TraceBuffer counts them as they are recorded)"""
+    if isinstance(debug_states, TraceBuffer):
+        return debug_states.errors > 0
+    return any(state.get('error', False) for state in debug_states)
+
+def select_error_states(debug_states):
+    """For error cases, keep the first few user code states and the error states"""
     filtered = []
+    user_code_only = []
+    
+    # First, filter to only keep user code (not traceback/internal code)
+    for state in debug_states:
+        # Skip internal Python functions used for traceback
+        if state['functionName'] in ['format_exc', 'format_exception', 'lazycache', 'checkcache']:
+            continue
+            
+        # Skip Python machinery
+        if state['functionName'].startswith('_') or state['functionName'] in ['<listcomp>', 'decode', '__init__']:
+            continue
+            
+        # Keep user code states
+        user_code_only.append(state)
+    
+    # For error cases, just take first few states and the error state
+    for i, state in enumerate(user_code_only):
+        # Keep the first few states of execution
+        if i < 5:
+            filtered.append(state)
+        
+        # Always keep error states
+        if state.get('error', False):
+            filtered.append(state)
+    
+    return filtered
+
+def dedupe_error_states(debug_states):
+    """Remove duplicate error states, keeping only the last one per function"""
+    error_funcs_seen = set()
+    kept = []
+    for state in reversed(debug_states):
+        if state.get('error', False):
+            if state['functionName'] in error_funcs_seen:
+                continue
+            error_funcs_seen.add(state['functionName'])
+        kept.append(state)
+    kept.reverse()
+    return kept
+
+def iter_filter_debug_states(debug_states, snapshots=None):
+    """
+    Incremental filter_debug_states for states that may still be produced.
+    Applies the same rules one state at a time, holding back a single state
+    so the last one can always be kept. Once an error state shows up, the
+    remaining states are filtered with the error rules (user code error states
+    only), since the earlier states have already been emitted.
+    A None item is a heartbeat from a live stream and is passed straight through.
+    """
+    states = iter(debug_states)
+    
+    # If there are very few states, return them all
+    head = []
+    for state in states:
+        if state is None:
+            continue
+        head.append(state)
+        if len(head) > 10:
+            break
+    if len(head) <= 10:
+        yield from head
+        return
+    
     prev_line = None
     prev_func = None
     prev_vars = {}
     prev_event_type = None
+    last_kept = None
+    in_error = False
     
-    for state in debug_states:
+    def keep(state):
+        nonlocal prev_line, prev_func, prev_vars, prev_event_type, in_error
+        
+        if state.get('error', False):
+            in_error = True
+        if in_error:
+            func = state['functionName']
+            if func in ['format_exc', 'format_exception', 'lazycache', 'checkcache']:
+                return False
+            if func.startswith('_') or func in ['<listcomp>', 'decode', '__init__']:
+                return False
+            return state.get('error', False)
+        
         line = state['lineNumber']
         func = state['functionName']
         event_type = state.get('eventType', 'step')
-        vars_changed = has_vars_changed(prev_vars, state['variables'])
         
-        # Always keep function entry/exit points and exception states
+        # Always keep function entry/exit points and exception states.
+        # Variables are compared last since they may need to be rebuilt from snapshots.
         keep_state = (
             event_type != prev_event_type or  # Event type changed
             event_type in ('return', 'exception') or  # Always keep returns and exceptions
             line != prev_line or  # Line number changed
             func != prev_func or  # Function changed
-            vars_changed or  # Variables changed significantly
-            state.get('error', False) or  # Error states
-            len(filtered) == 0  # First state
+            last_kept is None or  # First state
+            has_vars_changed(prev_vars, state_variables(state, snapshots))  # Variables changed significantly
         )
         
         if keep_state:
-            filtered.append(state)
             prev_line = line
             prev_func = func
-            prev_vars = state['variables'].copy()
+            prev_vars = state_variables(state, snapshots).copy()
             prev_event_type = event_type
+        return keep_state
+    
+    pending = None
+    for state in itertools.chain(head, states):
+        if state is None:
+            yield None
+            continue
+        if pending is not None and keep(pending):
+            last_kept = pending
+            yield pending
+        pending = state
     
     # Always include the last state
-    if debug_states and (not filtered or filtered[-1] != debug_states[-1]):
-        filtered.append(debug_states[-1])
-        
-    return filtered
+    if keep(pending) or (not in_error and (last_kept is None or last_kept != pending)):
+        yield pending
 
-def simplify_debug_states(debug_states):
+def simplify_debug_states(debug_states, snapshots=None):
     """Extract only essential information from debug states"""
     simplified = []
     
     # Remove duplicate error states (keep only the last one)
-    error_funcs_seen = set()
-    filtered_states = []
+    for state in dedupe_error_states(debug_states):
+        simple_state = simplify_state(state, snapshots)
+        if simple_state is not None:
+            simplified.append(simple_state)
     
-    for state in reversed(debug_states):
-        # For error states, only keep one per function
-        if state.get('error', False):
-            if state['functionName'] not in error_funcs_seen:
-                filtered_states.insert(0, state)
-                error_funcs_seen.add(state['functionName'])
-        else:
-            filtered_states.insert(0, state)
+    return simplified
+
+def iter_simplify_debug_states(debug_states, snapshots=None):
+    """
+    Incremental simplify_debug_states.
+    Error states are held back until the next step event so that only the last
+    error state per function is kept within each exception.
+    A None item is a heartbeat from a live stream and is passed straight through.
+    """
+    held = []
     
-    for state in filtered_states:
-        # Skip internal Python machinery states
-        if state['functionName'] in ['decode', '__init__', '__new__'] or state['functionName'].startswith('_'):
+    for state in debug_states:
+        if state is None:
+            yield None
             continue
-            
-        # Create a simplified state with all necessary information for visualization
-        simple_state = {
-            'line': state['lineNumber'],
-            'function': state['functionName'],
-            'variables': clean_variables(state['variables']),
-            'callId': state.get('callId'),
-            'parentId': state.get('parentId'),
-            'stackDepth': state.get('stackDepth', 0),
-            'eventType': state.get('eventType', 'step')
-        }
         
-        # Add full call stack info with parent-child relationships
-        if 'callStack' in state and state['callStack']:
+        if held or state.get('error', False):
+            if state.get('error', False) or state.get('eventType', 'step') != 'step':
+                held.append(state)
+                continue
+            yield from flush_held_states(held, snapshots)
+            held = []
+        
+        simple_state = simplify_state(state, snapshots)
+        if simple_state is not None:
+            yield simple_state
+    
+    yield from flush_held_states(held, snapshots)
+
+def flush_held_states(held, snapshots):
+    """Simplify held back states, keeping only the last error state per function"""
+    for state in dedupe_error_states(held):
+        simple_state = simplify_state(state, snapshots)
+        if simple_state is not None:
+            yield simple_state
+
+def simplify_state(state, snapshots=None, variables=None, stack_cache=None):
+    """
+    Simplified form of a single debug state, or None if it should be skipped.
+    `variables` may pass the state's already rebuilt variables, and
+    `stack_cache` a [raw, simplified] pair reused while steps share a call stack.
+    """
+    # Skip internal Python machinery states
+    if state['functionName'] in ['decode', '__init__', '__new__'] or state['functionName'].startswith('_'):
+        return None
+        
+    if variables is None:
+        variables = state_variables(state, snapshots)
+    
+    # Create a simplified state with all necessary information for visualization
+    simple_state = {
+        'line': state['lineNumber'],
+        'function': state['functionName'],
+        'variables': clean_variables(variables),
+        'callId': state.get('callId'),
+        'parentId': state.get('parentId'),
+        'stackDepth': state.get('stackDepth', 0),
+        'eventType': state.get('eventType', 'step')
+    }
+    
+    # In watch mode, say whether this step's variables were captured
+    if 'captured' in state:
+        simple_state['captured'] = state['captured']
+    
+    # Add full call stack info with parent-child relationships
+    if 'callStack' in state and state['callStack']:
+        call_stack = state['callStack']
+        if stack_cache is not None and stack_cache[0] is call_stack:
+            simple_state['callStack'] = stack_cache[1]
+        else:
             # Simplify callStack to contain only essential info
             simple_state['callStack'] = [{
                 'function': call['function'],
                 'line': call['line'],
                 'call_id': call.get('call_id'),
                 'parent_id': call.get('parent_id')
-            } for call in state['callStack']]
-        
-        # Add return value if present
-        if 'returnValue' in state:
-            simple_state['returnValue'] = state['returnValue']
-        
-        # Add error information if present
-        if state.get('error', False):
-            simple_state['error'] = True
-            if 'errorDetails' in state:
-                simple_state['errorMessage'] = state['errorDetails']['message']
-            elif 'exception_message' in state['variables']:
-                simple_state['errorMessage'] = state['variables']['exception_message']
-        
-        # Add output only to the last state
-        if 'output' in state and state['output']:
-            simple_state['output'] = state['output']
-        
-        # Only add the state if it has useful information
-        if simple_state['variables'] or state.get('error', False) or state.get('eventType') != 'step':
-            simplified.append(simple_state)
+            } for call in call_stack]
+            if stack_cache is not None:
+                stack_cache[:] = [call_stack, simple_state['callStack']]
     
-    return simplified
+    # Add return value if present
+    if 'returnValue' in state:
+        simple_state['returnValue'] = state['returnValue']
+    
+    # Add error information if present
+    if state.get('error', False):
+        simple_state['error'] = True
+        if 'errorDetails' in state:
+            simple_state['errorMessage'] = state['errorDetails']['message']
+        elif 'exception_message' in variables:
+            simple_state['errorMessage'] = variables['exception_message']
+    
+    # Add output only to the last state
+    if 'output' in state and state['output']:
+        simple_state['output'] = state['output']
+    
+    # Only add the state if it has useful information
+    # (steps skipped by a watch list are kept so the executed lines stay visible)
+    if simple_state['variables'] or state.get('error', False) or state.get('eventType') != 'step' or state.get('captured') is False:
+        return simple_state
+    return None
 
 def clean_variables(variables):
     """Clean variable values to make them simpler"""
@@ -531,10 +1273,18 @@ def has_vars_changed(prev_vars, current_vars):
 
 import ast
 
-def analyze_complexity(code):
+def parsed_tree(code):
+    """The AST run_traced will compile the code from, or None when it doesn't parse"""
+    try:
+        return compile_program(code).tree
+    except (SyntaxError, ValueError):
+        return None
+
+def analyze_complexity(code, tree=None):
     """
     Analyze time and space complexity using AST.
     Detects real recursion and nested loops robustly.
+    `tree` is the already parsed code, when the caller has it.
     """
     complexity = {
         "time": "O(1)",
@@ -545,11 +1295,12 @@ def analyze_complexity(code):
         "source": "ast-heuristic"
     }
 
-    try:
-        tree = ast.parse(code)
-    except Exception as e:
-        print(f"AST parse error: {e}")
-        return complexity
+    if tree is None:
+        try:
+            tree = ast.parse(code)
+        except Exception as e:
+            print(f"AST parse error: {e}")
+            return complexity
 
     recursive_funcs = set()
     exponential_recursions = set()
@@ -0,0 +1,517 @@
+import io
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import redirect_stdout, redirect_stderr
+from multiprocessing.connection import Connection
+
+from budgets import TraceBudget, TraceBudgetExceeded
+from code_cache import compile_program
+from serializer import ValueSerializer
+from python_debugger import is_user_code, clean_variables
+from batch import user_traceback
+
+# Checkpoints are forked copies of the traced program, so replays need fork() and a fork server
+REPLAY_AVAILABLE = (
+    sys.platform.startswith('linux') and hasattr(os, 'fork') and
+    'forkserver' in multiprocessing.get_all_start_methods()
+)
+
+EVENT_TYPES = ('call', 'line', 'return', 'exception')
+EVENT_CODES = {event: code for code, event in enumerate(EVENT_TYPES)}
+EVICTION_POLICIES = ('thin', 'oldest')
+
+DEFAULT_INTERVAL = 1000       # Steps between checkpoints
+DEFAULT_MAX_CHECKPOINTS = 32  # Checkpoint processes kept per recording
+DEFAULT_REPLAY_SECONDS = 10.0
+
+
+class ReplayError(Exception):
+    """A recording could not be made or a step could not be replayed"""
+
+
+class CheckpointPolicy:
+    """
+    How often the recorder forks a checkpoint and which checkpoint goes once
+    there are more than `max_checkpoints`, e.g.
+    {"interval": 500, "maxCheckpoints": 16, "eviction": "thin"}.
+    'thin' drops the checkpoint closest to the one before it, so the rest
+    stay spread over the whole run (like doubling the interval); 'oldest'
+    drops the earliest, keeping checkpoints dense near the end. The
+    checkpoint at step 0 is never dropped, so every step stays reachable.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, max_checkpoints=DEFAULT_MAX_CHECKPOINTS, eviction='thin'):
+        self.interval = interval
+        self.max_checkpoints = max_checkpoints
+        self.eviction = eviction
+
+    @classmethod
+    def from_options(cls, options):
+        """Build a policy from request options (None for the defaults). Raises ValueError for malformed options"""
+        if options is None:
+            return cls()
+        if not isinstance(options, dict):
+            raise ValueError("checkpoints must be an object")
+        values = {}
+        # Step 0 and the newest checkpoint are always kept, so fewer than two leaves nothing to evict
+        for field, name, minimum in (('interval', 'interval', 1), ('maxCheckpoints', 'max_checkpoints', 2)):
+            value = options.get(field)
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+                raise ValueError(f"checkpoints.{field} must be an integer of at least {minimum}")
+            values[name] = value
+        eviction = options.get('eviction', 'thin')
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError(f"checkpoints.eviction must be one of {', '.join(EVICTION_POLICIES)}")
+        return cls(eviction=eviction, **values)
+
+    def to_dict(self):
+        return {'interval': self.interval, 'maxCheckpoints': self.max_checkpoints, 'eviction': self.eviction}
+
+    def victim(self, steps):
+        """Which checkpoint to drop, given the steps of the current ones in order (the newest is kept too)"""
+        if self.eviction == 'oldest' or len(steps) <= 3:
+            return steps[1]
+        gaps = [(steps[index] - steps[index - 1], steps[index]) for index in range(1, len(steps) - 1)]
+        return min(gaps)[1]
+
+
+class Checkpoint:
+    """A forked copy of the program paused at `step`, waiting for replay requests on `conn`"""
+    __slots__ = ('step', 'pid', 'conn', 'stdin_position', 'output_length', 'replays')
+
+    def __init__(self, step, pid, conn, stdin_position, output_length):
+        self.step = step
+        self.pid = pid
+        self.conn = conn
+        self.stdin_position = stdin_position
+        self.output_length = output_length
+        self.replays = 0
+
+    def to_dict(self):
+        return {
+            'step': self.step,
+            'stdinPosition': self.stdin_position,
+            'outputLength': self.output_length,
+            'replays': self.replays
+        }
+
+    def close(self):
+        try:
+            self.conn.close()
+            os.kill(self.pid, signal.SIGKILL)
+            os.waitpid(self.pid, 0)
+        except (OSError, ChildProcessError):
+            pass
+
+
+class Recorder:
+    """
+    Runs the program once under a light tracer that keeps only the line,
+    event, depth and function of every step in arrays, forking a
+    Checkpoint every `policy.interval` steps. stdin and captured output
+    are in-process buffers, so a checkpoint holds their positions too.
+    To replay step k the nearest earlier checkpoint forks again and that
+    copy runs on, counting steps, until it reaches k and sends the full
+    frame state. Runs inside the recorder process (see recorder_main).
+    """
+
+    def __init__(self, conn, policy, budget=None, serializer=None):
+        self.conn = conn  # To the ReplaySession in the API process
+        self.policy = policy
+        self.budget = budget
+        self.serializer = serializer or ValueSerializer()
+        # Timeline columns, one entry per step
+        self.lines = array('i')
+        self.events = array('b')
+        self.depths = array('i')
+        self.function_ids = array('i')
+        self.functions = []       # Interned function names, indexed by function_ids
+        self.function_index = {}
+        self.steps = 0
+        self.depth = 0
+        self.checkpoints = OrderedDict()  # Step -> Checkpoint, in step order
+        self.filename = None
+        self.stdin = None
+        self.output = None
+        self.target = None       # Set in a replay copy: the step to stop at
+        self.replay_conn = None  # ... and where to send its state
+
+    def trace_calls(self, frame, event, arg):
+        if event == 'call':
+            if not is_user_code(frame.f_code.co_filename):
+                return None
+            self.depth += 1
+            if self.budget is not None:
+                self.budget.check_depth(self.depth)
+            self.step(frame, event, arg)
+        return self.trace_lines
+
+    def trace_lines(self, frame, event, arg):
+        if event == 'line' or event == 'exception':
+            self.step(frame, event, arg)
+        elif event == 'return':
+            self.step(frame, event, arg)
+            self.depth -= 1
+        return self.trace_lines
+
+    def step(self, frame, event, arg):
+        step = self.steps
+        self.steps += 1
+        if self.target is not None:
+            if step == self.target:
+                self.send_state(frame, event, arg, step)
+            return
+
+        self.lines.append(frame.f_lineno)
+        self.events.append(EVENT_CODES[event])
+        self.depths.append(self.depth)
+        name = frame.f_code.co_name
+        function_id = self.function_index.get(name)
+        if function_id is None:
+            function_id = self.function_index[name] = len(self.functions)
+            self.functions.append(name)
+        self.function_ids.append(function_id)
+
+        if step % self.policy.interval == 0:
+            self.checkpoint(step)
+            if self.target == step:
+                # A replay of the checkpoint's own step
+                self.send_state(frame, event, arg, step)
+                return
+        if self.budget is not None:
+            self.budget.check_event(0)
+
+    def checkpoint(self, step):
+        """Fork a checkpoint at `step`. Returns in the recorder, and in replay copies of the checkpoint"""
+        recorder_end, checkpoint_end = socket.socketpair()
+        pid = os.fork()
+        if pid:
+            checkpoint_end.close()
+            self.checkpoints[step] = Checkpoint(
+                step, pid, Connection(recorder_end.detach()), self.stdin.tell(), self.output.tell()
+            )
+            if len(self.checkpoints) > self.policy.max_checkpoints:
+                self.checkpoints.pop(self.policy.victim(list(self.checkpoints))).close()
+            return
+
+        # In the checkpoint: drop the recorder's connections so they close when it exits
+        recorder_end.close()
+        self.conn.close()
+        for checkpoint in self.checkpoints.values():
+            checkpoint.conn.close()
+        self.checkpoints = OrderedDict()
+        self.serve_replays(Connection(checkpoint_end.detach()))
+
+    def serve_replays(self, conn):
+        """Checkpoint loop: fork a copy for each replay request. Returns only in such a copy"""
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                os._exit(0)
+            if message[0] != 'replay':
+                os._exit(0)
+            _, target, seconds = message
+            pid = os.fork()
+            if pid == 0:
+                # Stop even if this checkpoint is killed while the copy still runs
+                signal.signal(signal.SIGALRM, signal.SIG_DFL)
+                signal.setitimer(signal.ITIMER_REAL, seconds)
+                self.target = target
+                self.replay_conn = conn
+                self.budget = None
+                return
+            status = wait_exit(pid, seconds)
+            if status is None:
+                conn.send(('error', f"Replay to step {target} took longer than {seconds:g}s"))
+            elif status != 0:
+                conn.send(('error', f"Replay to step {target} exited with status {status}"))
+
+    def send_state(self, frame, event, arg, step):
+        """In a replay copy: send the full state at `step` and exit"""
+        try:
+            message = ('state', self.frame_state(frame, event, arg, step))
+        except Exception as e:
+            message = ('error', f"Could not capture step {step}: {type(e).__name__}: {e}")
+        try:
+            self.replay_conn.send(message)
+        finally:
+            os._exit(0)
+
+    def frame_state(self, frame, event, arg, step):
+        """Every frame of the program with its variables, plus the output so far"""
+        frames = []
+        while frame is not None:
+            # The program's frames, without the recorder's own below them
+            if frame.f_code.co_filename == self.filename:
+                frames.append(frame)
+            frame = frame.f_back
+        frames.reverse()
+
+        call_stack = [
+            {
+                'function': frame.f_code.co_name,
+                'line': frame.f_lineno,
+                'variables': clean_variables(self.capture_variables(frame.f_locals))
+            }
+            for frame in frames
+        ]
+        state = {
+            'step': step,
+            'lineNumber': call_stack[-1]['line'],
+            'functionName': call_stack[-1]['function'],
+            'eventType': event,
+            'stackDepth': self.depth,
+            'variables': call_stack[-1]['variables'],
+            'callStack': call_stack,
+            'output': self.output.getvalue(),
+            'stdinPosition': self.stdin.tell()
+        }
+        if event == 'return':
+            state['returnValue'] = self.serializer.serialize(arg, use_str=False)
+        elif event == 'exception':
+            state['error'] = True
+            state['exception'] = {'type': arg[0].__name__, 'message': self.serializer.text(str(arg[1]))}
+        return state
+
+    def capture_variables(self, frame_locals):
+        variables = {}
+        for name, value in list(frame_locals.items()):
+            try:
+                variables[name] = self.serializer.serialize(value)
+            except Exception:
+                variables[name] = "Error: Unparseable value"
+        return variables
+
+    def record(self, code, input_data):
+        """Run the program once, recording the timeline. Returns the recording summary"""
+        program = compile_program(code)
+        self.filename = program.filename
+        self.stdin = sys.stdin = io.StringIO(input_data or '')
+        self.output = io.StringIO()
+        error_output = io.StringIO()
+        error = None
+        if self.budget is not None:
+            self.budget.start()
+        try:
+            with redirect_stdout(self.output), redirect_stderr(error_output):
+                sys.settrace(self.trace_calls)
+                try:
+                    exec(program.code, {'__file__': program.filename})
+                finally:
+                    sys.settrace(None)
+        except TraceBudgetExceeded:
+            pass
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                error = f"SystemExit: {e.code}"
+        except BaseException as e:
+            error = user_traceback(e, program.filename)
+        finally:
+            sys.stdin = sys.__stdin__
+
+        if self.target is not None:
+            # A replay copy that ran off the end of the program
+            self.replay_conn.send(('error', f"The program ended before step {self.target}"))
+            os._exit(0)
+        if self.budget is not None:
+            self.budget.stop()
+
+        return {
+            'totalSteps': self.steps,
+            'output': self.output.getvalue(),
+            'errorOutput': error_output.getvalue(),
+            'error': error,
+            'truncated': self.budget.truncation() if self.budget is not None else None,
+            'policy': self.policy.to_dict()
+        }
+
+    def timeline(self):
+        """The recorded steps as columns; functionIds index into functions"""
+        return {
+            'lines': self.lines,
+            'events': self.events,
+            'depths': self.depths,
+            'functionIds': self.function_ids,
+            'functions': self.functions
+        }
+
+    def replay(self, step, seconds):
+        """Ask the nearest checkpoint at or before `step` for the state at `step`"""
+        if not 0 <= step < self.steps:
+            return ('error', f"Step {step} out of range")
+        steps = list(self.checkpoints)
+        checkpoint = self.checkpoints[steps[bisect_right(steps, step) - 1]]
+        checkpoint.replays += 1
+        started = time.perf_counter()
+        try:
+            checkpoint.conn.send(('replay', step, seconds))
+            if not checkpoint.conn.poll(seconds + 1):
+                return ('error', f"Checkpoint at step {checkpoint.step} did not answer")
+            message = checkpoint.conn.recv()
+        except (EOFError, OSError):
+            # Lost its process, e.g. to the OOM killer; the step 0 checkpoint is still tried next time
+            if checkpoint.step:
+                self.checkpoints.pop(checkpoint.step).close()
+            return ('error', f"Checkpoint at step {checkpoint.step} is gone")
+        if message[0] == 'state':
+            message[1]['replay'] = {
+                'fromStep': checkpoint.step,
+                'steps': step - checkpoint.step,
+                'seconds': round(time.perf_counter() - started, 6)
+            }
+        return message
+
+    def serve(self):
+        """Answer the ReplaySession until it closes, then stop the checkpoints"""
+        try:
+            while True:
+                try:
+                    message = self.conn.recv()
+                except (EOFError, OSError):
+                    break
+                if message[0] == 'replay':
+                    self.conn.send(self.replay(message[1], message[2]))
+                elif message[0] == 'checkpoints':
+                    self.conn.send(('checkpoints', [checkpoint.to_dict() for checkpoint in self.checkpoints.values()]))
+                else:
+                    break
+        finally:
+            for checkpoint in self.checkpoints.values():
+                checkpoint.close()
+
+
+def wait_exit(pid, seconds):
+    """Exit status of child `pid`, or None after killing it once it runs past `seconds`"""
+    try:
+        fd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        fd = None
+    if fd is not None:
+        try:
+            finished = select.select([fd], [], [], seconds)[0]
+        finally:
+            os.close(fd)
+    else:
+        deadline = time.monotonic() + seconds
+        while not os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) and time.monotonic() < deadline:
+            time.sleep(0.005)
+        finished = time.monotonic() < deadline
+    if not finished:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        return None
+    return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+
+def recorder_main(conn, code, input_data, limits, checkpoints, values):
+    """Recorder process: record the program, then serve replays until the session closes"""
+    limits = limits or {}
+    # Recording keeps no variables, so only events, depth and time are limited
+    budget = TraceBudget(limits.get('max_events'), limits.get('max_depth'), limits.get('max_seconds'))
+    recorder = Recorder(conn, CheckpointPolicy.from_options(checkpoints), budget, ValueSerializer.from_options(values))
+    try:
+        summary = recorder.record(code, input_data)
+    except Exception as e:
+        conn.send(('error', f"{type(e).__name__}: {e}"))
+        return
+    conn.send(('recorded', summary, recorder.timeline()))
+    recorder.serve()
+
+
+class ReplaySession:
+    """
+    A recorded run held by its recorder process (see Recorder), from the
+    API side. Calls are serialized, since the recorder answers one request
+    at a time; close() stops the recorder and its checkpoints.
+    """
+
+    def __init__(self, session_id, process, conn, summary, timeline):
+        self.session_id = session_id
+        self.process = process
+        self.conn = conn
+        self.summary = summary
+        self.timeline = timeline
+        self.created_at = time.monotonic()
+        self.last_access = self.created_at
+        self._lock = threading.Lock()
+
+    @classmethod
+    def record(cls, session_id, code, input_data=None, limits=None, checkpoints=None, values=None, timeout=30):
+        """Start a recorder process and wait up to `timeout` seconds for the recording"""
+        context = multiprocessing.get_context('forkserver')
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(
+            target=recorder_main,
+            args=(child_conn, code, input_data, limits, checkpoints, values),
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        try:
+            if not parent_conn.poll(timeout):
+                raise ReplayError(f"Recording took longer than {timeout:g}s")
+            message = parent_conn.recv()
+        except (EOFError, OSError):
+            message = ('error', "Recorder process exited unexpectedly")
+        except BaseException:
+            process.kill()
+            raise
+        if message[0] != 'recorded':
+            process.kill()
+            process.join()
+            raise ReplayError(message[1])
+        return cls(session_id, process, parent_conn, message[1], message[2])
+
+    def timeline_range(self, start, end):
+        """Columns of the timeline for steps [start, end), clamped to the recording"""
+        total = self.summary['totalSteps']
+        start = max(0, min(start, total))
+        end = max(start, min(end, total))
+        columns = {name: self.timeline[name][start:end].tolist() for name in ('lines', 'events', 'depths', 'functionIds')}
+        columns['functions'] = self.timeline['functions']
+        columns['eventTypes'] = EVENT_TYPES
+        return start, end, columns
+
+    def state(self, step, seconds=DEFAULT_REPLAY_SECONDS):
+        """Full state at `step`, replayed from the nearest checkpoint. Raises ReplayError"""
+        message = self._request(('replay', step, seconds), seconds + 5)
+        if message[0] != 'state':
+            raise ReplayError(message[1])
+        return message[1]
+
+    def checkpoints(self):
+        return self._request(('checkpoints',), 5)[1]
+
+    def close(self):
+        try:
+            with self._lock:
+                self.conn.send(('close',))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+    def _request(self, message, timeout):
+        with self._lock:
+            try:
+                self.conn.send(message)
+                if not self.conn.poll(timeout):
+                    raise ReplayError("Recorder did not answer")
+                return self.conn.recv()
+            except (EOFError, OSError):
+                raise ReplayError("Recorder process is gone")
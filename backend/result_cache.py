@@ -0,0 +1,248 @@
+import ast
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+# Bump when the shape of debug results changes so old disk entries are ignored
+CACHE_FORMAT_VERSION = 2
+
+# Modules whose results depend on the clock, randomness, the environment or the outside world
+NONDETERMINISTIC_MODULES = {
+    'time', 'datetime', 'calendar', 'random', 'secrets', 'uuid', 'os', 'platform',
+    'socket', 'ssl', 'http', 'urllib', 'subprocess', 'threading', 'multiprocessing',
+    'asyncio', 'tempfile', 'pathlib', 'shutil', 'glob', 'importlib', 'ctypes',
+}
+# Builtins that read files or run code the cache check cannot see
+NONDETERMINISTIC_BUILTINS = {'open', 'eval', 'exec', 'compile', '__import__', 'globals', 'vars', 'id', 'hash'}
+# Default reprs like <Node object at 0x7f...> show memory addresses that change on every run
+MEMORY_ADDRESS = re.compile(r' at 0x[0-9a-fA-F]+')
+
+
+def is_cacheable(code):
+    """
+    Whether a program is expected to trace the same way on every run: it must
+    not import modules that read time, randomness or the environment, or call
+    builtins like open() and eval(). Programs that don't parse are cacheable,
+    since they always fail the same way.
+    Set iteration order also depends on the hash seed, which the caller has to
+    pin (see WorkerPool), and memory addresses in default reprs can only be
+    seen in the result (see is_reproducible).
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return True
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            if any(alias.name.split('.')[0] in NONDETERMINISTIC_MODULES for alias in node.names):
+                return False
+        elif isinstance(node, ast.ImportFrom):
+            if node.level == 0 and (node.module or '').split('.')[0] in NONDETERMINISTIC_MODULES:
+                return False
+        elif isinstance(node, ast.Name) and node.id in NONDETERMINISTIC_BUILTINS:
+            return False
+    return True
+
+
+def is_reproducible(result):
+    """Whether a debug result holds nothing that differs between runs, such as memory addresses"""
+    return MEMORY_ADDRESS.search(json.dumps(result, default=str)) is None
+
+
+def without_volatile_fields(result):
+    """
+    Copy of a debug result for a cached body, which is served again on later
+    requests: without the fields measured anew on every run, i.e. the stage
+    `timings`, the `seconds` of each complexity.empirical sample and of the
+    truncation counters. The response's request_id is left out of cached
+    bodies as well; it is in the X-Request-ID header.
+    """
+    result = dict(result)
+    result.pop('timings', None)
+    empirical = (result.get('complexity') or {}).get('empirical')
+    if empirical and empirical.get('samples'):
+        samples = [{name: value for name, value in sample.items() if name != 'seconds'} for sample in empirical['samples']]
+        result['complexity'] = dict(result['complexity'], empirical=dict(empirical, samples=samples))
+    truncated = result.get('truncated')
+    if truncated and 'seconds' in truncated.get('counters', {}):
+        counters = {name: value for name, value in truncated['counters'].items() if name != 'seconds'}
+        result['truncated'] = dict(truncated, counters=counters)
+    return result
+
+
+def cache_key(code, input_data, options):
+    """Hash of everything that determines a debug result"""
+    material = json.dumps({
+        'format': CACHE_FORMAT_VERSION,
+        'python': sys.version,
+        'code': code,
+        'input': input_data,
+        'options': options,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Encoded debug responses keyed by cache_key() plus their representation.
+    Recent entries live in memory, least recently used dropped first once
+    their total size passes `max_bytes`. With `disk_dir` set, every entry is
+    also written there so it survives restarts; the directory is trimmed
+    oldest-first to `disk_max_bytes`.
+    """
+
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()  # Key -> bytes
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.skipped = 0  # Results that were not stored, e.g. for reading the clock
+
+        self._disk_bytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_files())
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 or bool(self.disk_dir)
+
+    def get(self, key):
+        """The stored body for `key`, or None"""
+        return self.lookup([key])[1]
+
+    def lookup(self, keys):
+        """(key, body) for the first of `keys` that is stored, or (None, None); counts one hit or miss"""
+        with self._lock:
+            for key in keys:
+                body = self._entries.get(key)
+                if body is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return key, body
+
+        for key in keys:
+            body = self._read_disk(key)
+            if body is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self._remember(key, body)
+                return key, body
+
+        with self._lock:
+            self.misses += 1
+        return None, None
+
+    def put(self, key, body):
+        with self._lock:
+            self._remember(key, body)
+        self._write_disk(key, body)
+
+    def skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'diskHits': self.disk_hits,
+                'misses': self.misses,
+                'skipped': self.skipped,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'maxBytes': self.max_bytes,
+                'diskBytes': self._disk_bytes if self.disk_dir else None,
+            }
+
+    def _remember(self, key, body):
+        # Entries larger than a quarter of the budget would evict too much; they stay on disk only
+        if len(body) > self.max_bytes // 4:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._entries[key] = body
+        self._bytes += len(body)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + '.body')
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+            os.utime(path)  # Mark as recently used for trimming
+            return body
+        except OSError:
+            return None
+
+    def _write_disk(self, key, body):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            existed = os.path.exists(path)
+            # Write to a temporary name first so readers never see a partial file
+            partial = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(partial, 'wb') as f:
+                f.write(body)
+            os.replace(partial, path)
+        except OSError as e:
+            print(f"Result cache: could not write {path}: {e}")
+            return
+        with self._lock:
+            if not existed:
+                self._disk_bytes += len(body)
+            over = self._disk_bytes > self.disk_max_bytes
+        if over:
+            self._trim_disk()
+
+    def _disk_files(self):
+        """(mtime, path, size) for every entry on disk"""
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith('.body'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                files.append((info.st_mtime, path, info.st_size))
+        return files
+
+    def _trim_disk(self):
+        # Drop down to 90% of the budget so the directory isn't rescanned on every write
+        files = sorted(self._disk_files())
+        total = sum(size for _, _, size in files)
+        target = self.disk_max_bytes * 0.9
+        for _, path, size in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+        with self._lock:
+            self._disk_bytes = total
@@ -0,0 +1,300 @@
+import functools
+import itertools
+from collections import OrderedDict, defaultdict, deque
+from collections.abc import ItemsView, KeysView, Mapping, Sequence, Set
+
+DEFAULT_MAX_ITEMS = 100
+DEFAULT_MAX_DEPTH = 3
+DEFAULT_MAX_STRING = 1000
+
+# Upper bounds for limits requested by a client
+LIMIT_CAPS = {
+    'max_items': 10000,
+    'max_depth': 20,
+    'max_string': 100000,
+}
+# Request field for each limit
+OPTION_FIELDS = {
+    'maxItems': 'max_items',
+    'maxDepth': 'max_depth',
+    'maxString': 'max_string',
+}
+VALUE_FORMATS = ('text', 'structured')
+
+# Previews kept for reuse, least recently used dropped first
+CACHE_SIZE = 4096
+
+# Values that are never changed in place, so a preview stays valid for the object's lifetime
+IMMUTABLE_ATOMS = (int, float, bool, complex, str, bytes, type(None))
+
+# How a container is previewed: (mapping, opening, closing, text when empty or None, mutable)
+BUILTIN_SHAPES = {
+    list: (False, '[', ']', None, True),
+    tuple: (False, '(', ')', None, False),
+    set: (False, '{', '}', 'set()', True),
+    frozenset: (False, 'frozenset({', '})', 'frozenset()', False),
+    dict: (True, '{', '}', None, True),
+}
+# Sequences whose repr() is cheap or not an item list, previewed with repr()
+NOT_CONTAINERS = (str, bytes, bytearray, memoryview, range)
+
+
+@functools.lru_cache(maxsize=256)
+def type_shape(kind):
+    """
+    Preview shape of a container type, None for types previewed with repr().
+    Subclasses keep their base's brackets while they keep its repr; other
+    mappings, sets and sequences (deque, Counter, OrderedDict, abc
+    containers) are shown as TypeName({...}) or TypeName([...]).
+    """
+    shape = BUILTIN_SHAPES.get(kind)
+    if shape is not None:
+        return shape
+    if issubclass(kind, NOT_CONTAINERS):
+        return None
+    name = kind.__name__
+    for base in (list, tuple, dict):
+        if issubclass(kind, base) and kind.__repr__ is base.__repr__:
+            return BUILTIN_SHAPES[base]
+    if issubclass(kind, (set, frozenset)) and kind.__repr__ in (set.__repr__, frozenset.__repr__):
+        return False, f"{name}({{", '})', f"{name}()", issubclass(kind, set)
+    if issubclass(kind, tuple):
+        return None  # Named tuples and the like have their own repr and are small
+    if issubclass(kind, Mapping):
+        return True, f"{name}({{", '})', f"{name}()", True
+    if issubclass(kind, (KeysView, ItemsView)):
+        return False, f"{name}([", '])', None, True
+    if issubclass(kind, Set):
+        return False, f"{name}({{", '})', f"{name}()", True
+    if issubclass(kind, Sequence):
+        return False, f"{name}([", '])', None, True
+    return None
+
+
+def container_shape(value):
+    """Preview shape of a value, with the arguments deque and defaultdict add to their repr"""
+    kind = type(value)
+    shape = BUILTIN_SHAPES.get(kind)
+    if shape is not None:
+        return shape
+    shape = type_shape(kind)
+    if shape is None:
+        return None
+    if isinstance(value, deque) and value.maxlen is not None:
+        mapping, opening, _, empty, mutable = shape
+        return mapping, opening, f"], maxlen={value.maxlen})", empty, mutable
+    if isinstance(value, defaultdict):
+        _, _, closing, _, mutable = shape
+        return True, f"{kind.__name__}({value.default_factory!r}, {{", closing, None, mutable
+    return shape
+
+
+class ValueSerializer:
+    """
+    Size-capped previews of traced values.
+    Lists, tuples, sets, dicts and other sequences, sets and mappings
+    (deque, defaultdict, Counter, ...) show at most `max_items` elements and
+    `max_depth` levels, strings at most `max_string` characters, and anything
+    cut short reports its full length. In 'text' format a value becomes the
+    string repr() would give when nothing is cut (other containers are shown
+    as TypeName([...]) or TypeName({...}), which is their repr() for deque,
+    defaultdict and set subclasses); in 'structured' format it
+    becomes a JSON-ready dict with its type, length and shown items.
+    Previews of immutable values are cached by identity; previews of lists,
+    dicts and sets are reused while their length and shown elements are the
+    same objects as before, so an unchanged 100k-element list costs
+    O(max_items) per step instead of a full repr.
+    """
+
+    def __init__(self, max_items=DEFAULT_MAX_ITEMS, max_depth=DEFAULT_MAX_DEPTH, max_string=DEFAULT_MAX_STRING,
+                 value_format='text'):
+        self.max_items = max_items
+        self.max_depth = max_depth
+        self.max_string = max_string
+        self.structured = value_format == 'structured'
+        self._cache = OrderedDict()  # Cache key -> (value, length, shown elements or None, preview)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_options(cls, options):
+        """
+        Build a serializer from a request's `values` object ({maxItems, maxDepth,
+        maxString, format}), clamping limits to LIMIT_CAPS. Raises ValueError for
+        malformed options.
+        """
+        if not options:
+            return cls()
+        if not isinstance(options, dict):
+            raise ValueError("values must be an object")
+
+        kwargs = {}
+        for field, name in OPTION_FIELDS.items():
+            value = options.get(field)
+            if value is None:
+                continue
+            if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+                raise ValueError(f"values.{field} must be a positive integer")
+            kwargs[name] = min(value, LIMIT_CAPS[name])
+
+        value_format = options.get('format', 'text')
+        if value_format not in VALUE_FORMATS:
+            raise ValueError(f"values.format must be one of {', '.join(VALUE_FORMATS)}")
+        return cls(value_format=value_format, **kwargs)
+
+    def serialize(self, value, use_str=True):
+        """
+        Preview of a variable or return value. Primitives are kept as they are;
+        objects with a __dict__ are shown with str() when `use_str` is set,
+        like the tracer always did for locals, and with repr() otherwise.
+        """
+        if isinstance(value, (int, float, bool, type(None))):
+            return value
+        if isinstance(value, str):
+            if len(value) <= self.max_string:
+                return value
+            return self._cached(('str', id(value)), value, lambda: self._string(value, top_level=True))
+        if container_shape(value) is not None:
+            return self._preview(value, 0, set())
+        if use_str and hasattr(value, '__dict__'):
+            return self._other(str(value), type(value))
+        return self._other(repr(value), type(value))
+
+    def text(self, value):
+        """A plain string (e.g. an exception message) capped to max_string characters"""
+        return self._string(value, top_level=True)
+
+    def _preview(self, value, depth, path):
+        kind = type(value)
+        if kind in IMMUTABLE_ATOMS:
+            if kind is str:
+                return self._string(value)
+            if self.structured and kind is not bytes and kind is not complex:
+                return value
+            return self._other(repr(value), kind)
+        shape = container_shape(value)
+        if shape is None:
+            return self._other(repr(value), kind)
+
+        key = id(value)
+        if key in path:
+            # Self-referencing container, shown like repr() does
+            if self.structured:
+                return {'type': kind.__name__, 'recursive': True}
+            return f"{shape[1]}...{shape[2]}"
+
+        mapping = shape[0]
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] is value and self._still_valid(value, mapping, cached[1], cached[2]):
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached[3]
+        self.misses += 1
+
+        path.add(key)
+        try:
+            preview, shown, stable = self._container(value, shape, depth, path)
+        except Exception:
+            if kind in BUILTIN_SHAPES:
+                raise
+            # A user container whose len() or iteration fails, shown the way it shows itself
+            return self._other(repr(value), kind)
+        finally:
+            path.discard(key)
+
+        if stable:
+            self._store(key, value, shown if shape[4] else None, preview)
+        return preview
+
+    def _cached(self, key, value, build):
+        """Preview of an immutable value, built once per object"""
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] is value:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached[3]
+        self.misses += 1
+        preview = build()
+        self._store(key, value, None, preview)
+        return preview
+
+    def _store(self, key, value, shown, preview):
+        self._cache[key] = (value, len(value), shown, preview)
+        self._cache.move_to_end(key)
+        if len(self._cache) > CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    def _container(self, value, shape, depth, path):
+        """Build a container preview, returning (preview, shown elements, stable)"""
+        kind = type(value)
+        mapping, opening, closing, empty, _ = shape
+        length = len(value)
+        if depth >= self.max_depth and length:
+            if self.structured:
+                return {'type': kind.__name__, 'length': length, 'truncated': True}, None, False
+            return f"{opening}... ({length} items){closing}", None, False
+
+        if mapping:
+            shown = tuple(itertools.islice(value.items(), self.max_items))
+            elements = [item for pair in shown for item in pair]
+        else:
+            shown = tuple(itertools.islice(value, self.max_items))
+            elements = shown
+        # Only previews built from immutable elements can be reused by identity
+        stable = all(type(element) in IMMUTABLE_ATOMS for element in elements)
+        truncated = length > len(shown)
+
+        if mapping:
+            items = [(self._preview(k, depth + 1, path), self._preview(v, depth + 1, path)) for k, v in shown]
+        else:
+            items = [self._preview(item, depth + 1, path) for item in shown]
+
+        if self.structured:
+            preview = {
+                'type': kind.__name__,
+                'length': length,
+                'items': [list(item) for item in items] if mapping else items,
+                'truncated': truncated
+            }
+            return preview, shown, stable
+
+        if mapping:
+            parts = [f"{k}: {v}" for k, v in items]
+        else:
+            parts = list(items)
+        if truncated:
+            parts.append(f"... ({length} items)")
+        elif opening == '(' and length == 1:
+            return f"({parts[0]},)", shown, stable
+        elif not parts and empty is not None:
+            return empty, shown, stable
+        return opening + ', '.join(parts) + closing, shown, stable
+
+    def _still_valid(self, value, mapping, length, shown):
+        if shown is None:
+            return True  # Immutable
+        if len(value) != length:
+            return False
+        if mapping:
+            current = itertools.islice(value.items(), len(shown))
+            return all(k is old_k and v is old_v for (k, v), (old_k, old_v) in zip(current, shown))
+        return all(item is old for item, old in zip(itertools.islice(value, len(shown)), shown))
+
+    def _string(self, value, top_level=False):
+        length = len(value)
+        if length <= self.max_string:
+            return value if top_level or self.structured else repr(value)
+        head = value[:self.max_string]
+        if self.structured:
+            return {'type': 'str', 'length': length, 'value': head, 'truncated': True}
+        if top_level:
+            return f"{head}... ({length} chars)"
+        return f"{repr(head)}... ({length} chars)"
+
+    def _other(self, text, kind):
+        if len(text) <= self.max_string:
+            return {'type': kind.__name__, 'repr': text} if self.structured else text
+        head = text[:self.max_string]
+        if self.structured:
+            return {'type': kind.__name__, 'repr': head, 'length': len(text), 'truncated': True}
+        return f"{head}... ({len(text)} chars)"
@@ -0,0 +1,148 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class TraceSession:
+    """A finished debug_python result kept on the server for paged retrieval"""
+    __slots__ = ('session_id', 'result', 'call_index', 'created_at', 'last_access')
+
+    def __init__(self, session_id, result):
+        self.session_id = session_id
+        self.result = result
+        self.call_index = {call['call_id']: call for call in result.get('callHierarchy', [])}
+        self.created_at = time.monotonic()
+        self.last_access = self.created_at
+
+    @property
+    def states(self):
+        return self.result.get('debugStates', [])
+
+    def summary(self):
+        """Small description of the trace that is cheap to send up front"""
+        states = self.states
+        last_state = states[-1] if states else {}
+        hierarchy = self.result.get('callHierarchy', [])
+        call_dag = self.result.get('callDag')
+        return {
+            'totalStates': len(states),
+            'totalCalls': call_dag['totalCalls'] if call_dag else len(hierarchy),
+            'rootCalls': [call['call_id'] for call in hierarchy if call.get('parent_id') is None],
+            'maxStackDepth': max((call.get('stack_depth', 0) for call in hierarchy), default=0),
+            'complexity': self.result.get('complexity'),
+            'output': last_state.get('output', ''),
+            'error': bool(last_state.get('error', False))
+        }
+
+    def states_range(self, start, end):
+        """Slice of simplified states, clamped to the trace bounds"""
+        states = self.states
+        start = max(0, min(start, len(states)))
+        end = max(start, min(end, len(states)))
+        return start, end, states[start:end]
+
+    def call_subtree(self, call_id, max_depth=None):
+        """Calls below `call_id` in breadth-first order, optionally limited in depth"""
+        root = self.call_index.get(call_id)
+        if root is None:
+            return None
+
+        calls = []
+        frontier = [root]
+        depth = 0
+        while frontier:
+            calls.extend(frontier)
+            if max_depth is not None and depth >= max_depth:
+                break
+            frontier = [
+                self.call_index[child]
+                for call in frontier
+                for child in call.get('children', [])
+                if child in self.call_index
+            ]
+            depth += 1
+        return calls
+
+
+class SessionStore:
+    """
+    Bounded in-memory store of trace sessions with idle TTL and LRU eviction.
+    Sessions that hold resources (see replay.ReplaySession) are closed when
+    they are evicted, expire or are deleted.
+    """
+
+    def __init__(self, max_sessions=50, ttl_seconds=600):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()  # Least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            evicted = self._evict_expired(time.monotonic())
+            count = len(self._sessions)
+        close_sessions(evicted)
+        return count
+
+    def create(self, result):
+        """Store a debug result and return its session"""
+        return self.add(TraceSession(uuid.uuid4().hex, result))
+
+    def add(self, session):
+        """Store a session that has session_id, created_at and last_access"""
+        with self._lock:
+            evicted = self._evict_expired(session.created_at)
+            self._sessions[session.session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                evicted.append(self._sessions.popitem(last=False)[1])
+        close_sessions(evicted)
+        return session
+
+    def get(self, session_id):
+        """Return a live session and mark it as recently used, or None"""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if now - session.last_access <= self.ttl_seconds:
+                session.last_access = now
+                self._sessions.move_to_end(session_id)
+                return session
+            del self._sessions[session_id]
+        close_sessions([session])
+        return None
+
+    def delete(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        close_sessions([session])
+        return True
+
+    def clear(self):
+        """Drop every session, e.g. on shutdown"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        close_sessions(sessions)
+
+    def _evict_expired(self, now):
+        """Remove expired sessions and return them, to be closed outside the lock"""
+        # Sessions are ordered by last access, so expired ones are at the front
+        evicted = []
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_access <= self.ttl_seconds:
+                break
+            evicted.append(self._sessions.popitem(last=False)[1])
+        return evicted
+
+
+def close_sessions(sessions):
+    for session in sessions:
+        close = getattr(session, 'close', None)
+        if close is not None:
+            close()
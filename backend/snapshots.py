@@ -0,0 +1,150 @@
+import sys
+from array import array
+
+DEFAULT_KEYFRAME_INTERVAL = 32
+MATERIALIZE_CACHE_FRAMES = 64
+
+# Marks a variable that went out of scope inside a delta
+REMOVED = object()
+
+
+class SnapshotStore:
+    """
+    Delta-encoded variable snapshots.
+    Each step only stores the variables that changed since the previous step
+    of the same frame, plus a full keyframe every `keyframe_interval` steps of
+    that frame, so any step can be rebuilt by replaying at most that many deltas.
+
+    Snapshots are kept in typed columns rather than one object per step: the
+    frame they belong to, the index of the previous snapshot of that frame
+    (-1 for keyframes) and where their changes start in two flat change
+    columns, the interned variable name and the value of each change. A
+    keyframe lists every variable of its step, a delta only the changed ones,
+    with REMOVED as the value of a variable that went out of scope.
+    """
+
+    def __init__(self, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.frame_ids = array('i')
+        self.prev_indexes = array('i')
+        self.starts = array('i')  # First change of each snapshot, its last one is before the next start
+        self.names = array('i')   # Name id of each change
+        self.values = []          # Value of each change
+        self.name_list = []       # Name id -> variable name
+        self.bytes_recorded = 0  # Approximate size of the recorded values
+        self._name_ids = {}
+        self._frame_count = 0
+        self._frames = {}  # frame_key -> [last_index, last_variables, steps_since_keyframe, frame id]
+        self._cache = {}   # frame id -> (index, variables) of recently materialized steps
+
+    def __len__(self):
+        return len(self.prev_indexes)
+
+    def record(self, frame_key, variables):
+        """Store the variables of a step and return its snapshot index"""
+        index = len(self.prev_indexes)
+        frame = self._frames.get(frame_key)
+        self.starts.append(len(self.values))
+
+        if frame is None or frame[2] + 1 >= self.keyframe_interval:
+            if frame is None:
+                frame = self._frames[frame_key] = [index, variables, 0, self._frame_count]
+                self._frame_count += 1
+            prev_index = -1
+            self._add_changes(variables.keys(), variables.values())
+            frame[0] = index
+            frame[1] = variables
+            frame[2] = 0
+            self.bytes_recorded += sys.getsizeof(variables) + sum(map(sys.getsizeof, variables.values()))
+        else:
+            last_index, last_variables, since_keyframe, _ = frame
+            changes = []
+            new_names = 0
+            for name, value in variables.items():
+                if name in last_variables:
+                    old = last_variables[name]
+                    if old is value or (type(old) is type(value) and old == value):
+                        continue
+                else:
+                    new_names += 1
+                changes.append(name)
+                changes.append(value)
+
+            if len(variables) - new_names != len(last_variables):
+                for name in last_variables:
+                    if name not in variables:
+                        changes.append(name)
+                        changes.append(REMOVED)
+
+            prev_index = last_index
+            if changes:
+                self.bytes_recorded += sys.getsizeof(changes) + sum(map(sys.getsizeof, changes[1::2]))
+                self._add_changes(changes[0::2], changes[1::2])
+            frame[0] = index
+            frame[1] = variables
+            frame[2] = since_keyframe + 1
+
+        self.frame_ids.append(frame[3])
+        self.prev_indexes.append(prev_index)
+        return index
+
+    def _add_changes(self, names, values):
+        name_ids = self._name_ids
+        for name in names:
+            name_id = name_ids.get(name)
+            if name_id is None:
+                name_id = name_ids[name] = len(self.name_list)
+                self.name_list.append(name)
+            self.names.append(name_id)
+        self.values.extend(values)
+
+    def end_frame(self, frame_key):
+        """Forget the live state of a frame once it has returned"""
+        self._frames.pop(frame_key, None)
+
+    def materialize(self, index):
+        """Rebuild the full variables dict of a snapshot in O(keyframe_interval)"""
+        frame_id = self.frame_ids[index]
+        cached = self._cache.get(frame_id)
+
+        # Walk back to the nearest keyframe (or an already rebuilt step)
+        chain = []
+        current = index
+        variables = {}
+        while True:
+            if cached is not None and cached[0] == current:
+                variables = dict(cached[1])
+                break
+            chain.append(current)
+            current = self.prev_indexes[current]
+            if current < 0:
+                break
+
+        starts, names, values, name_list = self.starts, self.names, self.values, self.name_list
+        last = len(starts) - 1
+        for step in reversed(chain):
+            end = starts[step + 1] if step < last else len(values)
+            for i in range(starts[step], end):
+                if values[i] is REMOVED:
+                    variables.pop(name_list[names[i]], None)
+                else:
+                    variables[name_list[names[i]]] = values[i]
+
+        # Sequential reads of a frame then only replay a single delta
+        self._cache.pop(frame_id, None)
+        self._cache[frame_id] = (index, variables)
+        if len(self._cache) > MATERIALIZE_CACHE_FRAMES:
+            del self._cache[next(iter(self._cache))]
+
+        return dict(variables)
+
+    def payload_size(self):
+        """Approximate bytes held by the stored snapshots (the values themselves are shared with the program)"""
+        return (
+            sys.getsizeof(self.frame_ids) +
+            sys.getsizeof(self.prev_indexes) +
+            sys.getsizeof(self.starts) +
+            sys.getsizeof(self.names) +
+            sys.getsizeof(self.values) +
+            sys.getsizeof(self.name_list)
+        )
@@ -0,0 +1,86 @@
+STACK_FRAME_FIELDS = ('function', 'line', 'call_id', 'parent_id')
+
+
+def compact_states(states):
+    """
+    Replace each state's `callStack` list with a `stackId` into a shared table.
+    Every table entry is one frame ({function, line, call_id, parent_id}) plus
+    `parent`, the index of the entry below it or None for the outermost frame,
+    so an entry stands for the whole stack that ends in it: each distinct frame
+    and stack prefix is sent once, and a state costs one integer instead of
+    O(depth) dicts. Returns (states, table).
+    """
+    table = []
+    interned = {}    # (parent index, frame fields) -> index
+    by_list = {}     # id(callStack) -> index; consecutive steps share one list
+    compacted = []
+    for state in states:
+        call_stack = state.get('callStack')
+        if call_stack is None:
+            compacted.append(state)
+            continue
+
+        stack_id = by_list.get(id(call_stack))
+        if stack_id is None:
+            stack_id = None
+            for frame in call_stack:
+                key = (stack_id,) + tuple(frame.get(field) for field in STACK_FRAME_FIELDS)
+                index = interned.get(key)
+                if index is None:
+                    index = interned[key] = len(table)
+                    entry = {field: frame.get(field) for field in STACK_FRAME_FIELDS}
+                    entry['parent'] = stack_id
+                    table.append(entry)
+                stack_id = index
+            by_list[id(call_stack)] = stack_id
+
+        compact = {name: value for name, value in state.items() if name != 'callStack'}
+        compact['stackId'] = stack_id
+        compacted.append(compact)
+    return compacted, table
+
+
+def expand_states(states, table):
+    """Inverse of compact_states: states with their `callStack` lists rebuilt from `table`"""
+    stacks = {}  # Stack id -> expanded list, shared by the states that use it
+
+    def stack(stack_id):
+        # Walk down to the nearest stack already expanded, then build back up
+        missing = []
+        while stack_id is not None and stack_id not in stacks:
+            missing.append(stack_id)
+            stack_id = table[stack_id]['parent']
+        expanded = stacks[stack_id] if stack_id is not None else []
+        for index in reversed(missing):
+            frame = {field: table[index][field] for field in STACK_FRAME_FIELDS}
+            expanded = stacks[index] = expanded + [frame]
+        return expanded
+
+    expanded_states = []
+    for state in states:
+        if 'stackId' not in state:
+            expanded_states.append(state)
+            continue
+        expanded = {name: value for name, value in state.items() if name != 'stackId'}
+        expanded['callStack'] = stack(state['stackId'])
+        expanded_states.append(expanded)
+    return expanded_states
+
+
+def compact_result(result):
+    """A debug_python result in the compact format (see compact_states)"""
+    states, table = compact_states(result['debugStates'])
+    compact = dict(result)
+    compact['debugStates'] = states
+    compact['stackTable'] = table
+    compact['format'] = 'compact'
+    return compact
+
+
+def expand_result(result):
+    """A compact debug_python result turned back into the default format"""
+    if result.get('format') != 'compact':
+        return result
+    expanded = {name: value for name, value in result.items() if name not in ('stackTable', 'format')}
+    expanded['debugStates'] = expand_states(result['debugStates'], result['stackTable'])
+    return expanded
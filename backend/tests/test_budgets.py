@@ -0,0 +1,46 @@
+import io
+from contextlib import redirect_stdout
+
+import pytest
+
+from python_debugger import MONITORING_AVAILABLE, debug_python
+
+# Every line of the loop is inside the try, so the budget trips inside it;
+# without a second stop the program would run on untraced and print 'finished'
+SWALLOWING = """
+def step(n):
+    return n + 1
+
+n = 0
+while True:
+    try:
+        n = step(n)
+        if n > 2000000:
+            break
+    except BaseException:
+        pass
+print('finished', n)
+"""
+
+ENGINES = ['settrace', pytest.param('monitoring', marks=pytest.mark.skipif(
+    not MONITORING_AVAILABLE, reason="sys.monitoring needs Python 3.12"))]
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('limits, reason', [
+    ({'max_events': 200}, 'max_events'),
+    ({'max_seconds': 0.2, 'max_events': 10 ** 9}, 'max_seconds'),
+])
+def test_budget_stops_a_program_that_swallows_the_interruption(engine, limits, reason):
+    with redirect_stdout(io.StringIO()):
+        result = debug_python(SWALLOWING, limits=limits, engine=engine)
+    assert result['truncated']['reason'] == reason
+    assert 'finished' not in result['debugStates'][-1].get('output', '')
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_program_within_budget_runs_to_the_end(engine):
+    with redirect_stdout(io.StringIO()):
+        result = debug_python(SWALLOWING.replace('2000000', '20'), limits={'max_events': 10 ** 6}, engine=engine)
+    assert result['truncated'] is None
+    assert result['debugStates'][-1]['output'] == 'finished 21\n'
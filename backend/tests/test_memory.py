@@ -0,0 +1,34 @@
+import tracemalloc
+
+from memory import MemoryTracker
+
+
+def test_foreign_tracemalloc_session_is_left_alone():
+    tracemalloc.start()
+    try:
+        tracker = MemoryTracker()
+        tracker.start()
+        block = bytearray(4 * 1024 * 1024)
+        del block
+        owner_peak = tracemalloc.get_traced_memory()[1]
+        tracker.resume()
+        small = bytearray(1024)
+        tracker.pause()
+        tracker.stop()
+        # The owner's peak survives and tracing is still on
+        assert tracemalloc.get_traced_memory()[1] >= owner_peak >= 4 * 1024 * 1024
+        assert tracemalloc.is_tracing()
+        assert tracker.peak >= len(small)
+    finally:
+        tracemalloc.stop()
+
+
+def test_own_session_is_stopped():
+    tracker = MemoryTracker()
+    tracker.start()
+    tracker.resume()
+    data = [0] * 10000
+    tracker.pause()
+    tracker.stop()
+    assert not tracemalloc.is_tracing()
+    assert tracker.peak >= 10000 * 8 and data
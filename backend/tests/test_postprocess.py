@@ -0,0 +1,244 @@
+"""process_debug_states against frozen copies of the original two-step pipeline.
+
+filter_debug_states, simplify_debug_states, clean_variables and
+has_vars_changed below are the functions as they were before the fused
+pass, unchanged except that they read each raw state with its variables
+already rebuilt from the snapshots. They must not be edited to follow
+later changes of python_debugger: a difference here is a behavior change.
+"""
+import io
+from contextlib import redirect_stdout
+
+import pytest
+
+from python_debugger import create_tracer, run_traced, process_debug_states, state_variables
+
+PROGRAMS = {
+    'loop': """
+def walk(n):
+    s = 0
+    for i in range(n):
+        s += i % 3
+        if s > 10:
+            s = 0
+    return s
+
+print(walk(300))
+""",
+    'recursion': """
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n-1) + fib(n-2)
+
+print(fib(10))
+""",
+    'caught error': """
+def f(n):
+    for i in range(n):
+        pass
+    raise KeyError(n)
+
+try:
+    f(20)
+except KeyError:
+    pass
+""",
+    'uncaught error': """
+def divide(a, b):
+    return a / b
+
+for i in range(20):
+    total = i
+print(divide(10, 0))
+""",
+    'nested error': """
+def a(n):
+    return b(n) + 1
+
+def b(n):
+    return [1, 2][n]
+
+for i in range(12):
+    x = i
+a(5)
+""",
+    'syntax error': "def f(:\n    return 1\n",
+    'generator': """
+def g(n):
+    for i in range(n):
+        yield i * 2
+
+print(sum(g(30)))
+""",
+    'class': """
+class Counter:
+    def __init__(self):
+        self.count = 0
+
+    def add(self, n):
+        self.count += n
+        return self.count
+
+c = Counter()
+for i in range(15):
+    c.add(i)
+print(c.count)
+""",
+    'short': "x = 1\nprint(x)\n",
+}
+
+
+def raw_states(code):
+    tracer = create_tracer('settrace')
+    with redirect_stdout(io.StringIO()):
+        run_traced(code, None, tracer)
+    return tracer
+
+
+def baseline_filter_debug_states(debug_states):
+    if len(debug_states) <= 10:
+        return debug_states
+
+    has_error = any(state.get('error', False) for state in debug_states)
+
+    if has_error:
+        filtered = []
+        user_code_only = []
+        for state in debug_states:
+            if state['functionName'] in ['format_exc', 'format_exception', 'lazycache', 'checkcache']:
+                continue
+            if state['functionName'].startswith('_') or state['functionName'] in ['<listcomp>', 'decode', '__init__']:
+                continue
+            user_code_only.append(state)
+        for i, state in enumerate(user_code_only):
+            if i < 5:
+                filtered.append(state)
+            if state.get('error', False):
+                filtered.append(state)
+        return filtered
+
+    filtered = []
+    prev_line = None
+    prev_func = None
+    prev_vars = {}
+    prev_event_type = None
+
+    for state in debug_states:
+        line = state['lineNumber']
+        func = state['functionName']
+        event_type = state.get('eventType', 'step')
+        vars_changed = baseline_has_vars_changed(prev_vars, state['variables'])
+        keep_state = (
+            event_type != prev_event_type or
+            event_type in ('return', 'exception') or
+            line != prev_line or
+            func != prev_func or
+            vars_changed or
+            state.get('error', False) or
+            len(filtered) == 0
+        )
+        if keep_state:
+            filtered.append(state)
+            prev_line = line
+            prev_func = func
+            prev_vars = state['variables'].copy()
+            prev_event_type = event_type
+
+    if debug_states and (not filtered or filtered[-1] != debug_states[-1]):
+        filtered.append(debug_states[-1])
+    return filtered
+
+
+def baseline_simplify_debug_states(debug_states):
+    simplified = []
+    error_funcs_seen = set()
+    filtered_states = []
+
+    for state in reversed(debug_states):
+        if state.get('error', False):
+            if state['functionName'] not in error_funcs_seen:
+                filtered_states.insert(0, state)
+                error_funcs_seen.add(state['functionName'])
+        else:
+            filtered_states.insert(0, state)
+
+    for state in filtered_states:
+        if state['functionName'] in ['decode', '__init__', '__new__'] or state['functionName'].startswith('_'):
+            continue
+        simple_state = {
+            'line': state['lineNumber'],
+            'function': state['functionName'],
+            'variables': baseline_clean_variables(state['variables']),
+            'callId': state.get('callId'),
+            'parentId': state.get('parentId'),
+            'stackDepth': state.get('stackDepth', 0),
+            'eventType': state.get('eventType', 'step')
+        }
+        if 'callStack' in state and state['callStack']:
+            simple_state['callStack'] = [{
+                'function': call['function'],
+                'line': call['line'],
+                'call_id': call.get('call_id'),
+                'parent_id': call.get('parent_id')
+            } for call in state['callStack']]
+        if 'returnValue' in state:
+            simple_state['returnValue'] = state['returnValue']
+        if state.get('error', False):
+            simple_state['error'] = True
+            if 'errorDetails' in state:
+                simple_state['errorMessage'] = state['errorDetails']['message']
+            elif 'exception_message' in state['variables']:
+                simple_state['errorMessage'] = state['variables']['exception_message']
+        if 'output' in state and state['output']:
+            simple_state['output'] = state['output']
+        if simple_state['variables'] or state.get('error', False) or state.get('eventType') != 'step':
+            simplified.append(simple_state)
+    return simplified
+
+
+def baseline_clean_variables(variables):
+    cleaned = {}
+    for name, value in variables.items():
+        if name.startswith('__') and name.endswith('__'):
+            continue
+        if isinstance(value, str) and ('module' in value or '<' in value and '>' in value):
+            continue
+        if name in ['exception_type', 'exception_message']:
+            cleaned[name] = value
+            continue
+        cleaned[name] = value
+    return cleaned
+
+
+def baseline_has_vars_changed(prev_vars, current_vars):
+    if len(prev_vars) != len(current_vars):
+        return True
+    for key, value in current_vars.items():
+        if key not in prev_vars or prev_vars[key] != value:
+            return True
+    return False
+
+
+def baseline_process(tracer):
+    states = []
+    for state in tracer.debug_states:
+        state = dict(state)
+        state['variables'] = state_variables(state, tracer.snapshots)
+        state.pop('snapshot', None)
+        states.append(state)
+    return baseline_simplify_debug_states(baseline_filter_debug_states(states))
+
+
+@pytest.mark.parametrize('name', sorted(PROGRAMS))
+def test_fused_pass_matches_baseline(name):
+    tracer = raw_states(PROGRAMS[name])
+    assert process_debug_states(tracer.debug_states, tracer.snapshots) == baseline_process(tracer)
+
+
+def test_corpus_covers_errors_and_recursion():
+    # Guards the corpus itself: the error and recursion paths must really be taken
+    kinds = {name: raw_states(code) for name, code in PROGRAMS.items()}
+    assert kinds['uncaught error'].debug_states.errors
+    assert kinds['syntax error'].debug_states[-1]['lineNumber'] == -1
+    assert max(node.stack_depth for node in kinds['recursion'].call_tree) > 3
@@ -0,0 +1,40 @@
+import pytest
+
+from replay import CheckpointPolicy, ReplaySession, REPLAY_AVAILABLE
+
+LOOP = """
+total = 0
+for i in range(200):
+    total += i
+print(total)
+"""
+LIMITS = {'max_events': 10000, 'max_depth': 100, 'max_seconds': 10}
+
+
+@pytest.mark.parametrize('options', [{'maxCheckpoints': 1}, {'maxCheckpoints': 0}, {'interval': 0}, {'maxCheckpoints': True}])
+def test_policy_rejects_too_few_checkpoints(options):
+    with pytest.raises(ValueError):
+        CheckpointPolicy.from_options(options)
+
+
+@pytest.mark.parametrize('eviction', ['thin', 'oldest'])
+def test_victim_keeps_first_and_newest(eviction):
+    policy = CheckpointPolicy(max_checkpoints=2, eviction=eviction)
+    assert policy.victim([0, 10, 20]) == 10
+    assert policy.victim([0, 10, 15, 40]) in (10, 15)
+
+
+@pytest.mark.skipif(not REPLAY_AVAILABLE, reason="record/replay needs fork")
+@pytest.mark.parametrize('eviction', ['thin', 'oldest'])
+def test_recording_with_two_checkpoints(eviction):
+    session = ReplaySession.record(
+        'test', LOOP, None, LIMITS, {'interval': 5, 'maxCheckpoints': 2, 'eviction': eviction}
+    )
+    try:
+        assert session.summary['error'] is None
+        assert session.summary['output'] == '19900\n'
+        assert len(session.checkpoints()) == 2
+        last = session.summary['totalSteps'] - 1
+        assert session.state(last)['lineNumber'] == 5
+    finally:
+        session.close()
@@ -0,0 +1,68 @@
+from collections import Counter, defaultdict, deque
+
+import pytest
+
+from serializer import ValueSerializer
+
+
+class Ring(deque):
+    def __repr__(self):
+        raise AssertionError("full repr of a large container")
+
+
+class Groups(defaultdict):
+    def __repr__(self):
+        raise AssertionError("full repr of a large container")
+
+
+class Tags(set):
+    pass
+
+
+class Row(dict):
+    pass
+
+
+@pytest.mark.parametrize('value', [
+    deque([1, 'a', (2,)]),
+    deque(),
+    deque([1, 2], maxlen=4),
+    defaultdict(list, {1: [2, 3]}),
+    defaultdict(int),
+    Counter({'a': 2, 'b': 1}),
+    Tags({1}),
+    Tags(),
+    Row(a=[1]),
+    {}.keys(),
+    {1: 2}.items(),
+])
+def test_small_containers_match_repr(value):
+    assert ValueSerializer().serialize(value) == repr(value)
+
+
+def test_large_deque_is_previewed_without_repr():
+    serializer = ValueSerializer(max_items=3)
+    assert serializer.serialize(deque(range(100000))) == "deque([0, 1, 2, ... (100000 items)])"
+    # Ring's repr raises, so only a bounded preview can succeed
+    assert serializer.serialize(Ring(range(100000))) == "Ring([0, 1, 2, ... (100000 items)])"
+
+
+def test_large_defaultdict_is_previewed_without_repr():
+    serializer = ValueSerializer(max_items=2)
+    groups = defaultdict(list, {i: [i] for i in range(100000)})
+    assert serializer.serialize(groups) == "defaultdict(<class 'list'>, {0: [0], 1: [1], ... (100000 items)})"
+    groups = Groups(list, {i: [i] for i in range(100000)})
+    assert serializer.serialize(groups) == "Groups(<class 'list'>, {0: [0], 1: [1], ... (100000 items)})"
+
+
+def test_structured_preview_of_a_deque():
+    preview = ValueSerializer(max_items=2, value_format='structured').serialize(deque(range(10)))
+    assert preview == {'type': 'deque', 'length': 10, 'items': [0, 1], 'truncated': True}
+
+
+def test_changed_deque_is_not_served_from_cache():
+    serializer = ValueSerializer()
+    values = deque([1, 2])
+    assert serializer.serialize(values) == "deque([1, 2])"
+    values.append(3)
+    assert serializer.serialize(values) == "deque([1, 2, 3])"
@@ -0,0 +1,45 @@
+"""Syntax errors produce the same debug states as before programs were compiled in memory.
+
+The expected states were recorded with the original temp-file pipeline; file
+names in messages are replaced with FILE, since they differ on every run.
+"""
+import io
+import re
+from contextlib import redirect_stdout
+
+import pytest
+
+from python_debugger import debug_python
+
+
+def error_state(message):
+    return {
+        'line': -1,
+        'function': 'main',
+        'variables': {'exception': message},
+        'callId': None,
+        'parentId': None,
+        'stackDepth': 0,
+        'eventType': 'exception',
+        'error': True,
+        'errorMessage': message,
+    }
+
+
+BASELINE = {
+    'def f(:\n    return 1\n': [error_state("invalid syntax (FILE, line 1)")],
+    'x = (1,\n': [error_state("'(' was never closed (FILE, line 1)")],
+    'print("a")\n  y = 2\n': [error_state("unexpected indent (FILE, line 2)")],
+}
+
+
+def without_file_names(states):
+    text = repr(states)
+    return re.sub(r"\(([\w.-]+\.py), line", "(FILE, line", text)
+
+
+@pytest.mark.parametrize('code', sorted(BASELINE))
+def test_syntax_error_states_match_baseline(code):
+    with redirect_stdout(io.StringIO()):
+        result = debug_python(code)
+    assert without_file_names(result['debugStates']) == repr(BASELINE[code])
@@ -0,0 +1,282 @@
+import mmap
+import tempfile
+from array import array
+
+DEFAULT_CHUNK_STEPS = 1 << 16  # Power of two, so a step's chunk is a shift away
+
+# eventType of each event code
+EVENT_TYPES = ('step', 'return', 'exception')
+STEP, RETURN, EXCEPTION = range(len(EVENT_TYPES))
+EVENT_CODES = {event_type: code for code, event_type in enumerate(EVENT_TYPES)}
+
+# Bits of the flags column
+WATCHED = 1   # Recorded under a watch list, the state has 'captured'
+CAPTURED = 2  # The watch list captured this step's variables
+
+# Per step columns: (name, array typecode)
+COLUMNS = (
+    ('lines', 'i'),
+    ('events', 'b'),
+    ('depths', 'i'),
+    ('functions', 'i'),  # Interned function name
+    ('calls', 'i'),      # Index into the call table, -1 outside any call
+    ('snapshots', 'i'),  # SnapshotStore index, -1 when the step has no snapshot
+    ('flags', 'B'),
+)
+
+# Keys held in columns, everything else a recorded state has goes to the side store
+COLUMN_KEYS = {'lineNumber', 'functionName', 'callStack', 'callId', 'parentId', 'stackDepth', 'eventType', 'snapshot', 'captured'}
+
+
+class TraceBuffer:
+    """
+    Raw debug states stored as columns instead of one dict per event.
+    Line, event type, stack depth, interned function name, call and snapshot
+    index of every step are appended to typed arrays, in chunks of
+    `chunk_steps` steps. Calls are kept once in a call table (id, parent,
+    function, entry line), so a step's call stack is rebuilt from its call
+    by following the parents. The rare fields of return, exception and error
+    states (variables, returnValue, error, errorDetails, output) go to a
+    side store keyed by step.
+
+    Indexing and iterating give the states in their usual dict shape,
+    built on demand. Once more than `spill_steps` steps are recorded, full
+    chunks are written to an anonymous temporary file and read back through
+    mmap, so very long runs keep only the newest chunk in memory.
+    """
+
+    def __init__(self, chunk_steps=DEFAULT_CHUNK_STEPS, spill_steps=None, spill_dir=None):
+        if chunk_steps <= 0 or chunk_steps & (chunk_steps - 1):
+            raise ValueError("chunk_steps must be a power of two")
+        self.chunk_steps = chunk_steps
+        self.spill_steps = spill_steps
+        self.spill_dir = spill_dir
+        self.size = 0
+        self.errors = 0  # States with 'error' set
+        self.chunks = []  # One tuple of columns per chunk, arrays or memoryviews of the spill file
+        self.extras = {}  # Side store: step -> fields that have no column
+        self.functions = []
+        self.function_ids = {}
+        self.call_ids = []
+        self.call_parents = array('i')
+        self.call_functions = array('i')
+        self.call_lines = array('i')
+        self.call_indexes = {}  # call id -> index, for states recorded as dicts
+        self._shift = chunk_steps.bit_length() - 1
+        self._free = 0  # Steps left in the newest chunk
+        self._spilled = 0  # Chunks already in the spill file
+        self._spill_file = None
+        self._maps = []
+        self._stack = (None, None)  # Last materialized (call, call stack)
+
+    @classmethod
+    def from_limits(cls, limits):
+        """Buffer for a trace with the optional spill_steps setting of a limits dict"""
+        return cls(spill_steps=(limits or {}).get('spill_steps') or None)
+
+    def __len__(self):
+        return self.size
+
+    def intern(self, function):
+        """Id of a function name"""
+        function_id = self.function_ids.get(function)
+        if function_id is None:
+            function_id = self.function_ids[function] = len(self.functions)
+            self.functions.append(function)
+        return function_id
+
+    def add_call(self, call_id, parent, function, line):
+        """Add a call to the call table and return its index; `parent` is an index or -1"""
+        index = len(self.call_ids)
+        self.call_ids.append(call_id)
+        self.call_parents.append(parent)
+        self.call_functions.append(self.intern(function))
+        self.call_lines.append(line)
+        self.call_indexes[call_id] = index
+        return index
+
+    def add(self, line, function, call, depth, event=STEP, snapshot=-1, flags=0, extras=None):
+        """Append a step and return its index. `call` is a call table index or -1"""
+        if not self._free:
+            self._add_chunk()
+        self._free -= 1
+        function_id = self.function_ids.get(function)
+        if function_id is None:
+            function_id = self.intern(function)
+        step = self.size
+        if extras:
+            self.extras[step] = extras
+            if extras.get('error'):
+                self.errors += 1
+        columns = self.chunks[-1]
+        columns[0].append(line)
+        columns[1].append(event)
+        columns[2].append(depth)
+        columns[3].append(function_id)
+        columns[4].append(call)
+        columns[5].append(snapshot)
+        columns[6].append(flags)
+        self.size = step + 1
+        return step
+
+    def append(self, state):
+        """Append a state given as a dict. Its call stack must be the one of its callId"""
+        call_id = state.get('callId')
+        flags = 0
+        if 'captured' in state:
+            flags = WATCHED | (CAPTURED if state['captured'] else 0)
+        extras = {key: value for key, value in state.items() if key not in COLUMN_KEYS}
+        if 'snapshot' not in state:
+            extras.setdefault('variables', {})
+        return self.add(
+            state['lineNumber'],
+            state['functionName'],
+            -1 if call_id is None else self.call_indexes[call_id],
+            state.get('stackDepth', 0),
+            EVENT_CODES[state.get('eventType', 'step')],
+            state.get('snapshot', -1),
+            flags,
+            extras
+        )
+
+    def update(self, step, fields):
+        """Add fields, e.g. the captured output, to a recorded state"""
+        if step < 0:
+            step += self.size
+        if not 0 <= step < self.size:
+            raise IndexError("step out of range")
+        extras = self.extras.get(step)
+        if extras is None:
+            extras = self.extras[step] = {}
+            snapshots = self.chunks[step >> self._shift][5]
+            if snapshots[step & (self.chunk_steps - 1)] < 0:
+                extras['variables'] = {}
+        if fields.get('error') and not extras.get('error'):
+            self.errors += 1
+        extras.update(fields)
+
+    def __getitem__(self, step):
+        if isinstance(step, slice):
+            return [self.state(i) for i in range(*step.indices(self.size))]
+        if step < 0:
+            step += self.size
+        if not 0 <= step < self.size:
+            raise IndexError("step out of range")
+        return self.state(step)
+
+    def __iter__(self):
+        # Chunk by chunk, so columns are looked up once per chunk
+        step = 0
+        for columns in self.chunks:
+            for offset in range(min(self.chunk_steps, self.size - step)):
+                yield self._state(step, offset, columns)
+                step += 1
+
+    def state(self, step):
+        """The state of a step as a dict"""
+        return self._state(step, step & (self.chunk_steps - 1), self.chunks[step >> self._shift])
+
+    def _state(self, step, offset, columns):
+        lines, events, depths, functions, calls, snapshots, flags = columns
+        call = calls[offset]
+        state = {
+            'lineNumber': lines[offset],
+            'functionName': self.functions[functions[offset]],
+            'callStack': self.call_stack(call),
+            'callId': None,
+            'parentId': None,
+            'stackDepth': depths[offset],
+            'eventType': EVENT_TYPES[events[offset]],
+        }
+        if call >= 0:
+            state['callId'] = self.call_ids[call]
+            parent = self.call_parents[call]
+            if parent >= 0:
+                state['parentId'] = self.call_ids[parent]
+        snapshot = snapshots[offset]
+        if snapshot >= 0:
+            state['snapshot'] = snapshot
+        flag = flags[offset]
+        if flag & WATCHED:
+            state['captured'] = bool(flag & CAPTURED)
+        extras = self.extras.get(step)
+        if extras is not None:
+            state.update(extras)
+        elif snapshot < 0:
+            state['variables'] = {}
+        return state
+
+    def call_stack(self, call):
+        """Call stack entries from the outermost call down to `call`, shared by consecutive lookups"""
+        if self._stack[0] == call:
+            return self._stack[1]
+        stack = []
+        index = call
+        while index >= 0:
+            parent = self.call_parents[index]
+            stack.append({
+                'function': self.functions[self.call_functions[index]],
+                'line': self.call_lines[index],
+                'call_id': self.call_ids[index],
+                'parent_id': self.call_ids[parent] if parent >= 0 else None,
+            })
+            index = parent
+        stack.reverse()
+        self._stack = (call, stack)
+        return stack
+
+    def nbytes(self):
+        """Bytes of column data held in memory (spilled chunks are not counted)"""
+        return sum(
+            column.itemsize * len(column)
+            for columns in self.chunks[self._spilled:] for column in columns
+        )
+
+    def _add_chunk(self):
+        if self.spill_steps is not None and self.size >= self.spill_steps:
+            self._spill(len(self.chunks))
+        self.chunks.append(tuple(array(typecode) for _, typecode in COLUMNS))
+        self._free = self.chunk_steps
+
+    def _spill(self, count):
+        """Move the first `count` (full) chunks into the spill file"""
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(prefix='trace-', dir=self.spill_dir)
+        f = self._spill_file
+        for index in range(self._spilled, count):
+            start = f.seek(0, 2)
+            for column in self.chunks[index]:
+                column.tofile(f)
+            length = f.tell() - start
+            # mmap offsets must be multiples of the allocation granularity
+            f.write(b'\0' * (-length % mmap.ALLOCATIONGRANULARITY))
+            f.flush()
+            mapped = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ, offset=start)
+            self._maps.append(mapped)
+            view = memoryview(mapped)
+            columns = []
+            position = 0
+            for (_, typecode), column in zip(COLUMNS, self.chunks[index]):
+                size = column.itemsize * len(column)
+                columns.append(view[position:position + size].cast(typecode))
+                position += size
+            self.chunks[index] = tuple(columns)
+        self._spilled = count
+
+    def close(self):
+        """Drop the recorded steps and remove the spill file"""
+        self.chunks = []
+        self.extras = {}
+        self.size = 0
+        self._free = 0
+        self._spilled = 0
+        self._stack = (None, None)
+        for mapped in self._maps:
+            try:
+                mapped.close()
+            except BufferError:
+                pass  # Still referenced, closed when collected
+        self._maps = []
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
@@ -0,0 +1,85 @@
+class WatchList:
+    """
+    Which steps of a trace get their variables captured, and which variables.
+    A step is captured when it is in one of `functions` and on one of `lines`
+    (each only checked when given) and any of the `conditions` holds, e.g.
+    "i % 1000 == 0". Captured steps record only `variables` and the values of
+    `expressions`, or all locals when neither is given. Other steps keep just
+    their line, function and call stack.
+    """
+
+    def __init__(self, variables=None, expressions=None, lines=None, functions=None, conditions=None):
+        self.variables = list(variables or [])
+        self.expressions = [(text, compile_expression(text)) for text in expressions or []]
+        self.lines = set(lines or [])
+        self.functions = set(functions or [])
+        self.conditions = [(text, compile_expression(text)) for text in conditions or []]
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Build a watch list from a request's `watch` object, or return None when
+        there is nothing to watch. Raises ValueError for malformed entries.
+        """
+        if not spec:
+            return None
+        if not isinstance(spec, dict):
+            raise ValueError("watch must be an object")
+
+        conditions = spec.get('when') or []
+        if isinstance(conditions, str):
+            conditions = [conditions]
+        fields = {
+            'variables': spec.get('variables') or [],
+            'expressions': spec.get('expressions') or [],
+            'functions': spec.get('functions') or [],
+            'conditions': conditions,
+        }
+        for name, values in fields.items():
+            if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+                raise ValueError(f"watch.{'when' if name == 'conditions' else name} must be a list of strings")
+
+        lines = spec.get('lines') or []
+        if not isinstance(lines, list) or not all(isinstance(line, int) and not isinstance(line, bool) for line in lines):
+            raise ValueError("watch.lines must be a list of line numbers")
+
+        return cls(lines=lines, **fields)
+
+    def matches(self, frame, line_no):
+        """Whether the step about to run at `line_no` in `frame` should be captured"""
+        if self.functions and frame.f_code.co_name not in self.functions:
+            return False
+        if self.lines and line_no not in self.lines:
+            return False
+        if not self.conditions:
+            return True
+        local_vars = frame.f_locals
+        for _, code in self.conditions:
+            try:
+                if eval(code, frame.f_globals, local_vars):
+                    return True
+            except Exception:
+                # Names that are not in scope yet simply don't match
+                continue
+        return False
+
+    def capture(self, frame):
+        """(name, value) pairs to record for a captured step"""
+        local_vars = frame.f_locals
+        if not self.variables and not self.expressions:
+            return local_vars.items()
+
+        captured = [(name, local_vars[name]) for name in self.variables if name in local_vars]
+        for text, code in self.expressions:
+            try:
+                captured.append((text, eval(code, frame.f_globals, local_vars)))
+            except Exception as e:
+                captured.append((text, f"Error: {type(e).__name__}: {e}"))
+        return captured
+
+
+def compile_expression(text):
+    try:
+        return compile(text, '<watch>', 'eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid watch expression {text!r}: {e.msg}")
@@ -0,0 +1,375 @@
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import queue
+import threading
+import time
+import traceback
+
+# Modules imported once in the fork server, so new workers start warm
+PRELOAD_MODULES = ['python_debugger', 'batch', 'replay']
+
+# Hash seed of the workers, so set iteration order (and results) are the same in every worker
+DEFAULT_HASH_SEED = 0
+
+# Held while os.environ carries the workers' hash seed
+_environ_lock = threading.Lock()
+
+
+class PoolSaturated(Exception):
+    """All workers are busy and the wait queue is full"""
+
+
+class JobTimeout(Exception):
+    """A job ran past its wall-clock limit and its worker was killed"""
+
+
+class WorkerJobError(Exception):
+    """A job raised inside the worker process"""
+
+    def __init__(self, error_type, message, remote_traceback):
+        super().__init__(message)
+        self.error_type = error_type
+        self.remote_traceback = remote_traceback
+
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def worker_main(conn):
+    """Worker loop: run one job at a time and send results back over `conn`"""
+    from python_debugger import debug_python, stream_debug_python
+    from batch import run_case
+    jobs = {
+        'debug': debug_python,
+        'stream': stream_debug_python,
+        'case': run_case,
+    }
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if message[0] == 'stop':
+            return
+        if message[0] != 'job':
+            continue
+
+        _, name, kwargs = message
+        try:
+            if name == 'stream':
+                frames = jobs[name](**kwargs)
+                try:
+                    for frame in frames:
+                        conn.send(('frame', frame))
+                        # The pool asks to stop when its client goes away
+                        if conn.poll() and conn.recv()[0] == 'cancel':
+                            break
+                finally:
+                    frames.close()
+                conn.send(('done', current_rss()))
+            else:
+                result = jobs[name](**kwargs)
+                conn.send(('result', result, current_rss()))
+        except (Exception, SystemExit) as e:
+            conn.send(('error', type(e).__name__, str(e), traceback.format_exc()))
+
+
+class _Worker:
+    __slots__ = ('process', 'conn', 'jobs', 'rss')
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.jobs = 0
+        self.rss = 0
+
+
+class WorkerPool:
+    """
+    Pool of warm worker processes that each run one debug job at a time.
+    User code runs outside the server process, so concurrent requests no longer
+    share sys.stdin, sys.stdout or the trace function. Workers are recycled after
+    `max_jobs_per_worker` jobs or once their memory passes `max_memory_mb`, and
+    killed when a job exceeds `job_timeout` seconds. At most `max_queue` requests
+    wait for a free worker; beyond that PoolSaturated is raised.
+    Workers run with PYTHONHASHSEED=`hash_seed` (None keeps the server's setting),
+    which is only in the environment while the fork server or a worker starts.
+    """
+
+    def __init__(self, size=None, max_jobs_per_worker=100, max_memory_mb=512, job_timeout=30, max_queue=None, hash_seed=DEFAULT_HASH_SEED):
+        self.size = size or os.cpu_count() or 1
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        self.job_timeout = job_timeout
+        self.max_queue = self.size * 2 if max_queue is None else max_queue
+        self.hash_seed = hash_seed
+
+        methods = multiprocessing.get_all_start_methods()
+        self._forkserver = 'forkserver' in methods
+        self._ctx = multiprocessing.get_context('forkserver' if self._forkserver else 'spawn')
+        if self._forkserver:
+            self._ctx.set_forkserver_preload(PRELOAD_MODULES)
+
+        self._idle = queue.Queue()
+        self._slots = threading.BoundedSemaphore(self.size + self.max_queue)
+        self._lock = threading.Lock()
+        self._workers = []
+        self._started = False
+        self._draining = False
+        self.in_flight = 0  # Jobs currently running on a worker
+        self.waiting = 0    # Requests waiting for a free worker
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        if self._forkserver:
+            # Workers are forked from the fork server and share its hash seed
+            self._with_hash_seed(multiprocessing.forkserver.ensure_running)
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+
+    def shutdown(self):
+        """Stop all idle workers; busy ones are stopped when their job returns"""
+        with self._lock:
+            self._started = False
+            workers = list(self._workers)
+        for worker in workers:
+            try:
+                worker.conn.send(('stop',))
+            except (OSError, ValueError):
+                pass
+        for worker in workers:
+            worker.process.join(timeout=1)
+            if worker.process.is_alive():
+                worker.process.kill()
+
+    def drain(self, timeout):
+        """
+        Refuse new jobs, wait up to `timeout` seconds for running and queued
+        ones to finish, then shut down. Returns whether everything finished.
+        """
+        with self._lock:
+            self._draining = True
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self.in_flight and not self.waiting:
+                    break
+            time.sleep(0.05)
+        with self._lock:
+            drained = not self.in_flight and not self.waiting
+        self.shutdown()
+        return drained
+
+    def queue_depth(self):
+        return self.waiting
+
+    def stats(self):
+        """Load figures for readiness checks"""
+        with self._lock:
+            return {
+                'workers': self.size,
+                'inFlight': self.in_flight,
+                'waiting': self.waiting,
+                'maxQueue': self.max_queue,
+                'draining': self._draining
+            }
+
+    def saturated(self):
+        """Whether a new job would be rejected with PoolSaturated right now"""
+        with self._lock:
+            return self._draining or self.in_flight + self.waiting >= self.size + self.max_queue
+
+    def run(self, job, **kwargs):
+        """Run a job in a worker and return its result"""
+        worker = self._acquire()
+        healthy = False
+        try:
+            worker.conn.send(('job', job, kwargs))
+            message = self._receive(worker, time.monotonic() + self.job_timeout)
+            if message[0] == 'error':
+                healthy = True
+                raise WorkerJobError(*message[1:])
+            worker.rss = message[2]
+            healthy = True
+            return message[1]
+        finally:
+            self._release(worker, healthy)
+
+    def stream(self, job, **kwargs):
+        """
+        Start a streaming job and return an iterator over its frames.
+        A worker is claimed right away, so PoolSaturated is raised here rather
+        than while iterating; the iterator must be closed if not exhausted.
+        """
+        worker = self._acquire()
+        try:
+            worker.conn.send(('job', job, kwargs))
+        except BaseException:
+            self._release(worker, False)
+            raise
+        return FrameStream(self, worker, time.monotonic() + self.job_timeout)
+
+    def _spawn(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=worker_main, args=(child_conn,), daemon=True)
+        if self._forkserver:
+            process.start()
+        else:
+            self._with_hash_seed(process.start)
+        child_conn.close()
+        worker = _Worker(process, parent_conn)
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    def _with_hash_seed(self, start):
+        """
+        Call `start`, which launches a new interpreter, with PYTHONHASHSEED set
+        to hash_seed, then put back the server's own value so no other process
+        it starts inherits the seed
+        """
+        if self.hash_seed is None:
+            start()
+            return
+        with _environ_lock:
+            previous = os.environ.get('PYTHONHASHSEED')
+            os.environ['PYTHONHASHSEED'] = str(self.hash_seed)
+            try:
+                start()
+            finally:
+                if previous is None:
+                    del os.environ['PYTHONHASHSEED']
+                else:
+                    os.environ['PYTHONHASHSEED'] = previous
+
+    def _retire(self, worker):
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        try:
+            worker.conn.send(('stop',))
+        except (OSError, ValueError):
+            pass
+        worker.process.join(timeout=1)
+        if worker.process.is_alive():
+            worker.process.kill()
+            worker.process.join()
+        worker.conn.close()
+
+    def _acquire(self):
+        if self._draining:
+            raise PoolSaturated("Shutting down")
+        self.start()
+        if not self._slots.acquire(blocking=False):
+            raise PoolSaturated(f"All {self.size} workers busy and {self.max_queue} requests queued")
+
+        with self._lock:
+            self.waiting += 1
+        try:
+            worker = self._idle.get(timeout=self.job_timeout)
+        except queue.Empty:
+            self._slots.release()
+            raise PoolSaturated(f"No worker became free within {self.job_timeout}s")
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+        with self._lock:
+            self.in_flight += 1
+        worker.jobs += 1
+        return worker
+
+    def _release(self, worker, healthy):
+        with self._lock:
+            self.in_flight -= 1
+            running = self._started
+
+        recycle = (
+            not healthy or
+            worker.jobs >= self.max_jobs_per_worker or
+            worker.rss > self.max_memory_bytes
+        )
+        if recycle or not running:
+            self._retire(worker)
+            if running:
+                worker = self._spawn()
+        if running:
+            self._idle.put(worker)
+        self._slots.release()
+
+    def _receive(self, worker, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not worker.conn.poll(remaining):
+            worker.process.kill()
+            worker.process.join()
+            raise JobTimeout(f"Job exceeded {self.job_timeout}s")
+        try:
+            return worker.conn.recv()
+        except (EOFError, OSError):
+            raise WorkerJobError('WorkerCrashed', 'Worker process exited unexpectedly', '')
+
+    def _cancel(self, worker):
+        """Ask a streaming job to stop, returning whether the worker is reusable"""
+        try:
+            worker.conn.send(('cancel',))
+            deadline = time.monotonic() + 5
+            while True:
+                message = self._receive(worker, deadline)
+                if message[0] != 'frame':
+                    return message[0] == 'done'
+        except (JobTimeout, WorkerJobError, OSError):
+            return False
+
+
+class FrameStream:
+    """Iterator over the frames of a streaming job running in a pool worker"""
+
+    def __init__(self, pool, worker, deadline):
+        self._pool = pool
+        self._worker = worker
+        self._deadline = deadline
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        try:
+            message = self._pool._receive(self._worker, self._deadline)
+        except BaseException:
+            self._finish(False)
+            raise
+
+        if message[0] == 'frame':
+            return message[1]
+
+        self._finish(True)
+        if message[0] == 'error':
+            raise WorkerJobError(*message[1:])
+        self._worker.rss = message[1]
+        raise StopIteration
+
+    def close(self):
+        """Stop the job if it is still running and give the worker back"""
+        if not self._closed:
+            # The client went away; stop the job and drain what is left
+            self._finish(self._pool._cancel(self._worker))
+
+    def _finish(self, healthy):
+        if not self._closed:
+            self._closed = True
+            self._pool._release(self._worker, healthy)
@@ -32,6 +32,23 @@ const ComplexityPanel = ({ complexity }) => {
         </div>
       </div>
 
+      {complexity.empirical && complexity.empirical.time && (
+        <div className="mb-4 p-3 bg-yellow-50 rounded-lg border border-yellow-200">
+          <h3 className="text-sm font-medium text-yellow-800 mb-1">
+            Measured on {complexity.empirical.samples.length} input sizes
+          </h3>
+          <p className="text-sm text-yellow-700">
+            {complexity.empirical.function}: time{" "}
+            <span className="font-bold">{complexity.empirical.time.class}</span>{" "}
+            ({Math.round(complexity.empirical.time.confidence * 100)}%
+            confidence), call stack{" "}
+            <span className="font-bold">{complexity.empirical.space.class}</span>{" "}
+            ({Math.round(complexity.empirical.space.confidence * 100)}%
+            confidence)
+          </p>
+        </div>
+      )}
+
       {complexity.has_recursion && (
         <div className="mb-4 p-3 bg-purple-50 rounded-lg border border-purple-200">
           <h3 className="text-sm font-medium text-purple-800 mb-1">
@@ -10,7 +10,8 @@ const RecursionTree = ({ debugData, currentStep, onStepChange }) => {
   const positions = useRef({});
 
   useEffect(() => {
-    if (!debugData?.callHierarchy?.length) return;
+    const callDag = debugData?.callDag;
+    if (!debugData?.callHierarchy?.length && !callDag) return;
 
     const svgElement = d3.select(svgRef.current);
     svgElement.selectAll("*").remove();
@@ -49,21 +50,35 @@ const RecursionTree = ({ debugData, currentStep, onStepChange }) => {
       .attr("d", "M0,-5L10,0L0,5")
       .attr("fill", "#999");
 
+    // The backend's callIndex gives the first and last state of each call
+    // (first_state/last_state) and the position of a call by id; older
+    // responses without it fall back to scanning the states.
+    const callIndex = debugData.callIndex;
+    const firstStateOf = (call) =>
+      callIndex
+        ? call.first_state ?? -1
+        : debugData.debugStates.findIndex((s) => s.callId === call.call_id);
+    const returnStateOf = (call) => {
+      if (!callIndex) {
+        return debugData.debugStates.findIndex(
+          (s) => s.callId === call.call_id && s.eventType === "return"
+        );
+      }
+      const last = call.last_state ?? -1;
+      return debugData.debugStates[last]?.eventType === "return" ? last : -1;
+    };
+    const callById = (id) =>
+      callIndex
+        ? debugData.callHierarchy[callIndex.positions[id]]
+        : debugData.callHierarchy.find((c) => c.call_id === id);
+
     const buildTree = () => {
       const nodesMap = new Map();
       const rootNodes = [];
 
-      const filteredCalls = debugData.callHierarchy.filter((call) => {
-        const idx = debugData.debugStates.findIndex(
-          (s) => s.callId === call.call_id
-        );
-        return (
-          viewAll ||
-          idx <= currentStep ||
-          (debugData.debugStates[idx]?.eventType === "return" &&
-            idx <= currentStep)
-        );
-      });
+      const filteredCalls = debugData.callHierarchy.filter(
+        (call) => viewAll || firstStateOf(call) <= currentStep
+      );
 
       filteredCalls.forEach((call) => {
         const args = call.args ? Object.values(call.args).join(", ") : "";
@@ -84,13 +99,8 @@ const RecursionTree = ({ debugData, currentStep, onStepChange }) => {
           rootNodes.push(node);
         }
 
-        const returnState = debugData.debugStates.find(
-          (s) => s.callId === call.call_id && s.eventType === "return"
-        );
-
-        const returnStepIndex = debugData.debugStates.findIndex(
-          (s) => s.callId === call.call_id && s.eventType === "return"
-        );
+        const returnStepIndex = returnStateOf(call);
+        const returnState = debugData.debugStates[returnStepIndex];
 
         if (returnState && (viewAll || returnStepIndex <= currentStep)) {
           node.returnValue = returnState.returnValue;
@@ -102,19 +112,54 @@ const RecursionTree = ({ debugData, currentStep, onStepChange }) => {
         : { name: "root", children: rootNodes };
     };
 
-    const root = d3.hierarchy(buildTree());
+    // With callDag (repeated subtrees merged by the backend) each distinct
+    // call is drawn once with its repeat count; a shared subproblem is
+    // expanded where it first appears and marked ↺ elsewhere.
+    const buildDagTree = () => {
+      const expanded = new Set();
+      const toNode = (dagId, count, key) => {
+        const call = callDag.nodes[dagId];
+        const args = Object.values(call.args || {}).join(", ");
+        const node = {
+          id: key,
+          dagId,
+          name: `${call.function}(${args})${count > 1 ? ` ×${count}` : ""}`,
+          children: [],
+          returnValue: call.return_value ?? undefined,
+        };
+        if (expanded.has(dagId)) {
+          node.name += " ↺";
+          return node;
+        }
+        expanded.add(dagId);
+        if (call.hidden) node.name += ` +${call.hidden.calls}`;
+        node.children = call.children.map(([child, n], i) =>
+          toNode(child, n, `${key}/${i}`)
+        );
+        return node;
+      };
+      const rootNodes = callDag.roots.map(([dagId, n], i) =>
+        toNode(dagId, n, `dag-${i}`)
+      );
+      return rootNodes.length === 1
+        ? rootNodes[0]
+        : { name: "root", children: rootNodes };
+    };
+
+    const root = d3.hierarchy(callDag ? buildDagTree() : buildTree());
     const treeLayout = d3.tree().nodeSize([120, 120]);
     treeLayout(root);
 
-    const currentCallId = debugData.debugStates?.[currentStep]?.callId;
+    const currentCallId = callDag
+      ? undefined
+      : debugData.debugStates?.[currentStep]?.callId;
+    const currentDagId = callDag?.stateNodes?.[currentStep];
     const getAncestors = (id) => {
       const ancestors = new Set();
       let currentId = id;
       while (currentId) {
         ancestors.add(currentId);
-        currentId = debugData.callHierarchy.find(
-          (c) => c.call_id === currentId
-        )?.parent_id;
+        currentId = callById(currentId)?.parent_id;
       }
       return ancestors;
     };
@@ -219,9 +264,9 @@ const RecursionTree = ({ debugData, currentStep, onStepChange }) => {
       )
       .on("click", (_, d) => {
         if (!d.data.id) return;
-        const matchingStep = debugData.debugStates.findIndex(
-          (s) => s.callId === d.data.id
-        );
+        const matchingStep = callDag
+          ? callDag.stateNodes.indexOf(d.data.dagId)
+          : firstStateOf(callById(d.data.id) || {});
         if (matchingStep >= 0) onStepChange(matchingStep);
       });
 
@@ -229,7 +274,8 @@ const RecursionTree = ({ debugData, currentStep, onStepChange }) => {
       .append("circle")
       .attr("r", 8)
       .attr("fill", (d) => {
-        if (d.data.id === currentCallId) return "#ff7f0e";
+        if (callDag ? d.data.dagId === currentDagId : d.data.id === currentCallId)
+          return "#ff7f0e";
         if (d.data.returnValue !== undefined) return "#e41a1c";
         return highlightedNodes.has(d.data.id) ? "#ffbb78" : "#1f77b4";
       })
@@ -1,12 +1,19 @@
-export const callDebugAPI = async (code, testCase) => {
+import { expandResult } from "./stackTable";
+
+// Backend URL; set VITE_API_BASE at build time to point elsewhere
+const API_BASE = import.meta.env.VITE_API_BASE || "http://localhost:5000";
+
+// `options` adds request fields, e.g. { callDag: { maxDepth: 6 } } to get the
+// call tree with repeated subtrees merged.
+export const callDebugAPI = async (code, testCase, options = {}) => {
   try {
-    const response = await fetch("http://localhost:5000/api/debug", {
+    const response = await fetch(`${API_BASE}/api/debug`, {
       method: "POST",
       headers: {
         "Content-Type": "application/json",
       },
-      // backend expects `input` for stdin content
-      body: JSON.stringify({ code, input: testCase }),
+      // backend expects `input` for stdin content; stacks come back as a table
+      body: JSON.stringify({ code, input: testCase, compact: true, ...options }),
     });
 
     if (!response.ok) {
@@ -21,9 +28,145 @@ export const callDebugAPI = async (code, testCase) => {
     }
 
     const data = await response.json();
+    if (data.success) data.debugStates = expandResult(data.debugStates);
     return data;
   } catch (error) {
     console.error("Error calling debug API:", error);
     return null;
   }
-};
\ No newline at end of file
+};
+
+// Trace sessions keep the full trace on the server; the first page comes back
+// with the session summary and further states are fetched by range.
+export const createDebugSession = async (code, testCase, pageSize = 200) => {
+  try {
+    const response = await fetch(`${API_BASE}/api/sessions`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({ code, input: testCase, pageSize }),
+    });
+    return await response.json();
+  } catch (error) {
+    console.error("Error creating debug session:", error);
+    return null;
+  }
+};
+
+// Runs one program against many stdin cases ({input, expected?, trace?}) in one
+// request; full traces come back only for cases with `trace` or, with
+// traceFailing, for failing ones.
+export const runBatchAPI = async (code, cases, traceFailing = false) => {
+  try {
+    const response = await fetch(`${API_BASE}/api/batch`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({ code, cases, traceFailing }),
+    });
+    return await response.json();
+  } catch (error) {
+    console.error("Error running batch:", error);
+    return null;
+  }
+};
+
+export const fetchSessionStates = async (sessionId, from, to) => {
+  try {
+    const response = await fetch(
+      `${API_BASE}/api/sessions/${sessionId}/states?from=${from}&to=${to}`
+    );
+    return await response.json();
+  } catch (error) {
+    console.error("Error fetching session states:", error);
+    return null;
+  }
+};
+
+export const fetchCallSubtree = async (sessionId, callId, depth) => {
+  try {
+    const query = depth !== undefined ? `?depth=${depth}` : "";
+    const response = await fetch(
+      `${API_BASE}/api/sessions/${sessionId}/calls/${encodeURIComponent(callId)}${query}`
+    );
+    return await response.json();
+  } catch (error) {
+    console.error("Error fetching call subtree:", error);
+    return null;
+  }
+};
+
+// Record/replay (Linux servers): the program is recorded with fork checkpoints
+// and only a timeline of line/event/depth/function per step comes back; the
+// full state of any step is re-executed from the nearest checkpoint on demand.
+export const createReplay = async (code, testCase, checkpoints, pageSize = 200) => {
+  try {
+    const response = await fetch(`${API_BASE}/api/replays`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({ code, input: testCase, checkpoints, pageSize }),
+    });
+    return await response.json();
+  } catch (error) {
+    console.error("Error creating replay:", error);
+    return null;
+  }
+};
+
+export const fetchReplayTimeline = async (replayId, from, to) => {
+  try {
+    const response = await fetch(
+      `${API_BASE}/api/replays/${replayId}/timeline?from=${from}&to=${to}`
+    );
+    return await response.json();
+  } catch (error) {
+    console.error("Error fetching replay timeline:", error);
+    return null;
+  }
+};
+
+export const fetchReplayStep = async (replayId, step) => {
+  try {
+    const response = await fetch(`${API_BASE}/api/replays/${replayId}/steps/${step}`);
+    return await response.json();
+  } catch (error) {
+    console.error("Error fetching replay step:", error);
+    return null;
+  }
+};
+
+// Streams debug states as NDJSON frames while the program runs. `onFrame` is
+// called with each {type: "states"} chunk and finally the {type: "summary"} frame.
+export const streamDebugAPI = async (code, testCase, onFrame) => {
+  try {
+    const response = await fetch(`${API_BASE}/api/debug`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        Accept: "application/x-ndjson",
+      },
+      body: JSON.stringify({ code, input: testCase }),
+    });
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = "";
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffered += decoder.decode(value, { stream: true });
+      const lines = buffered.split("\n");
+      buffered = lines.pop();
+      lines.filter((line) => line.trim()).forEach((line) => onFrame(JSON.parse(line)));
+    }
+    if (buffered.trim()) onFrame(JSON.parse(buffered));
+    return true;
+  } catch (error) {
+    console.error("Error streaming debug API:", error);
+    return false;
+  }
+};
@@ -0,0 +1,44 @@
+// Compact debug responses send every call stack once in `stackTable`; each
+// entry is a frame plus the index of the entry below it (`parent`), and states
+// carry a `stackId` instead of a `callStack` list. These helpers rebuild the
+// default shape, so components keep reading `state.callStack`.
+
+const FRAME_FIELDS = ["function", "line", "call_id", "parent_id"];
+
+export const expandStates = (states, table) => {
+  const stacks = new Map();
+
+  const stackFor = (stackId) => {
+    // Walk down to the nearest stack already rebuilt, then build back up
+    const missing = [];
+    let id = stackId;
+    while (id !== null && id !== undefined && !stacks.has(id)) {
+      missing.push(id);
+      id = table[id].parent;
+    }
+    let stack = id === null || id === undefined ? [] : stacks.get(id);
+    for (let i = missing.length - 1; i >= 0; i--) {
+      const entry = table[missing[i]];
+      const frame = {};
+      FRAME_FIELDS.forEach((field) => {
+        frame[field] = entry[field];
+      });
+      stack = [...stack, frame];
+      stacks.set(missing[i], stack);
+    }
+    return stack;
+  };
+
+  return states.map((state) => {
+    if (!("stackId" in state)) return state;
+    const { stackId, ...rest } = state;
+    return { ...rest, callStack: stackFor(stackId) };
+  });
+};
+
+// Turns a compact debug_python result back into the default format
+export const expandResult = (result) => {
+  if (!result || result.format !== "compact") return result;
+  const { stackTable, format, ...rest } = result;
+  return { ...rest, debugStates: expandStates(result.debugStates, stackTable) };
+};